@@ -1,14 +1,16 @@
 import os, uuid
 from pathlib import Path
-from fastapi import FastAPI, UploadFile, File, Depends
+from fastapi import FastAPI, UploadFile, File, Depends, HTTPException
 from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_jwt_auth import AuthJWT
 from pydantic import BaseModel
-import bcrypt, fitz, pytesseract
+from typing import Optional
+import bcrypt, pytesseract
 
 from storage_manager import StorageManager
-from rag_engine import RAGStore
+from pdf_extract import extract_pdf
+from rag_engine import RAGStore, parse_filters
 from agents import TextAgent, ImageAgent, ConfluenceAgent, MasterAgent
 from db import init_db, create_user, authenticate_user, get_user_history, add_chat_history
 
@@ -40,6 +42,7 @@ class UserCreds(BaseModel):
 
 class Query(BaseModel):
     query: str
+    filters: Optional[dict] = None
 
 @app.post("/register")
 def register(creds: UserCreds):
@@ -64,22 +67,21 @@ async def upload_file(file: UploadFile = File(...), Authorize: AuthJWT=Depends()
         f.write(await file.read())
     blob_path = storage.save_file(local_path)
 
-    text_content = ""
+    pages = []
     ext = Path(file.filename).suffix.lower()
     if ext == ".pdf":
-        doc = fitz.open(local_path)
-        pdf_text = ""
-        for page in doc:
-            pdf_text += page.get_text("text") + "\\n"
-        doc.close()
-        text_content = pdf_text
+        # One entry per page (extracted in parallel for big files), so results can cite pages
+        pages = extract_pdf(local_path)["pages"]
     elif ext in [".png",".jpg",".jpeg"]:
         ocr_text = pytesseract.image_to_string(str(local_path))
-        text_content = ocr_text
+        pages = [ocr_text]
     else:
-        text_content = local_path.read_text(encoding="utf-8", errors="ignore")
+        pages = [local_path.read_text(encoding="utf-8", errors="ignore")]
 
-    rag_store.add_documents([(text_content, {"user": user, "source": file.filename})])
+    docs = [(text, {"user": user, "source": file.filename, "page": n})
+            for n, text in enumerate(pages, start=1) if text.strip()]
+    if docs:
+        rag_store.add_documents(docs)
     rag_store.save()
     return {"message":"File indexed", "path": str(blob_path)}
 
@@ -87,7 +89,15 @@ async def upload_file(file: UploadFile = File(...), Authorize: AuthJWT=Depends()
 async def chat_endpoint(query: Query, Authorize: AuthJWT=Depends()):
     Authorize.jwt_required()
     user = Authorize.get_jwt_subject()
-    results = rag_store.search(query.query, k=5)
+    # Only the caller's own uploads can be selected by user. Filters scope retrieval,
+    # they are not access control: without a user filter everyone's uploads are searched.
+    try:
+        filters = parse_filters(query.filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if filters and "user" in filters:
+        filters["user"] = user
+    results = rag_store.search(query.query, k=5, filters=filters)
     context = "\\n\\n".join([r["text"] for r in results])
 
     if os.getenv("MULTI_AGENT","false").lower()=="true":
@@ -1,43 +1,62 @@
-import sqlite3
-DB = "chatbot.db"
+import os, sqlite3, threading
+DB = os.getenv("SQLITE_PATH", "chatbot.db")
+# WAL lets readers run alongside the single writer, and with synchronous=NORMAL
+# a commit only fsyncs at checkpoints (a power cut can drop the last commits,
+# never corrupt the file). Writers that still collide wait up to the busy timeout.
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", "64"))
+
+# Statements are module constants so each connection prepares them once and
+# reuses them from its statement cache.
+INSERT_USER = "INSERT INTO users(username,password) VALUES (?,?)"
+SELECT_PASSWORD = "SELECT password FROM users WHERE username=?"
+INSERT_HISTORY = "INSERT INTO history(user,query,response) VALUES (?,?,?)"
+SELECT_HISTORY = "SELECT query,response FROM history WHERE user=?"
+
+_local = threading.local()
+
+def get_conn():
+    # One connection per thread, opened on first use and reused for the thread's lifetime.
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, cached_statements=SQLITE_STATEMENT_CACHE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        _local.conn = conn
+    return conn
+
+def close_conn():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
 
 def init_db():
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
-    c.execute("CREATE TABLE IF NOT EXISTS users(username TEXT PRIMARY KEY, password TEXT)")
-    c.execute("CREATE TABLE IF NOT EXISTS history(user TEXT, query TEXT, response TEXT)")
-    conn.commit()
-    conn.close()
+    conn = get_conn()
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS users(username TEXT PRIMARY KEY, password TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS history(user TEXT, query TEXT, response TEXT)")
+        conn.execute("CREATE INDEX IF NOT EXISTS history_user ON history(user)")
 
 def create_user(username,password):
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
-    c.execute("INSERT INTO users(username,password) VALUES (?,?)",(username,password))
-    conn.commit()
-    conn.close()
+    conn = get_conn()
+    with conn:
+        conn.execute(INSERT_USER,(username,password))
     return {"message":"User created"}
 
 def authenticate_user(username,password):
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
-    c.execute("SELECT password FROM users WHERE username=?",(username,))
-    row = c.fetchone()
-    conn.close()
+    row = get_conn().execute(SELECT_PASSWORD,(username,)).fetchone()
     if row:
         return password == row[0]
     return False
 
 def add_chat_history(user,query,response):
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
-    c.execute("INSERT INTO history(user,query,response) VALUES (?,?,?)",(user,query,response))
-    conn.commit()
-    conn.close()
+    conn = get_conn()
+    with conn:
+        conn.execute(INSERT_HISTORY,(user,query,response))
 
 def get_user_history(user):
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
-    c.execute("SELECT query,response FROM history WHERE user=?",(user,))
-    rows = c.fetchall()
-    conn.close()
+    rows = get_conn().execute(SELECT_HISTORY,(user,)).fetchall()
     return [{"query":q,"response":r} for q,r in rows]
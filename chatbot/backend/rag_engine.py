@@ -1,25 +1,73 @@
 import faiss, numpy as np
 
+# Metadata fields a search can filter on; each is indexed as (field, value) -> rows
+FILTER_FIELDS = ("user", "source")
+
+def parse_filters(raw):
+    # Request filters -> {field: [values]}; ValueError (a 400) for anything but an object of known fields
+    if raw is None:
+        return None
+    if not isinstance(raw, dict):
+        raise ValueError(f"filters must be an object, got {type(raw).__name__}")
+    unknown = set(raw) - set(FILTER_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown filter field(s) {sorted(unknown)}, expected {FILTER_FIELDS}")
+    out = {}
+    for field, value in raw.items():
+        values = value if isinstance(value, list) else [value]
+        if not all(isinstance(v, (str, int)) and not isinstance(v, bool) for v in values):
+            raise ValueError(f"filter {field!r} must be a string or a list of strings")
+        if values and values != [""]:
+            out[field] = values
+    return out or None
+
 class RAGStore:
     def __init__(self):
         self.texts = []
+        self.metas = []
         self.embeddings = []
         self.index = None
+        self.postings = {}   # (field, value) -> rows, so a filter never scans every passage
 
     def add_documents(self, docs):
         for text, meta in docs:
+            row = len(self.texts)
             self.texts.append(text)
+            self.metas.append(meta or {})
+            for field in FILTER_FIELDS:
+                if (meta or {}).get(field) is not None:
+                    self.postings.setdefault((field, str(meta[field])), []).append(row)
             emb = np.random.rand(768).astype("float32")
             self.embeddings.append(emb)
         self.index = faiss.IndexFlatL2(768)
         self.index.add(np.array(self.embeddings))
 
-    def search(self, query, k=5):
+    def _rows(self, filters):
+        # filters: {"user": ..., "source": ...}; a value may also be a list of allowed values.
+        # Union the postings of each field's values, then intersect across fields.
+        rows = None
+        for field, value in filters.items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            hits = [np.array(self.postings.get((field, str(v)), []), dtype="int64") for v in values]
+            hits = np.unique(np.concatenate(hits)) if hits else np.zeros(0, dtype="int64")
+            rows = hits if rows is None else np.intersect1d(rows, hits, assume_unique=True)
+            if not len(rows):
+                break
+        return rows if rows is not None else np.zeros(0, dtype="int64")
+
+    def search(self, query, k=5, filters=None):
         if not self.texts:
             return []
         q_emb = np.random.rand(768).astype("float32")
-        D,I = self.index.search(np.array([q_emb]), k)
-        return [{"text": self.texts[i]} for i in I[0]]
+        params = None
+        if filters:
+            rows = self._rows(filters)
+            if not len(rows):
+                return []
+            # Restrict the search inside FAISS so k results still come back from the allowed rows
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(rows))
+        D,I = self.index.search(np.array([q_emb]), k, params=params)
+        return [{"text": self.texts[i], "meta": self.metas[i]} for i in I[0] if i >= 0]
 
     def save(self):
         pass
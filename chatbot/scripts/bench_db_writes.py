@@ -0,0 +1,113 @@
+# scripts/bench_db_writes.py
+# Chat-history write throughput with concurrent writers: a fresh connection per
+# call on the rollback journal (old db.py) vs. db.py's per-thread WAL connections.
+#
+#   python scripts/bench_db_writes.py --writers 1 4 16 --writes 500
+#
+# Each writer thread inserts --writes rows through add_chat_history, with a
+# --read-every history read mixed in, as a chat turn would. Both variants use
+# their own database in a temp directory. Failed writes ("database is locked")
+# are counted, not retried.
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+TMP = tempfile.mkdtemp(prefix="bench_db_")
+os.environ["SQLITE_PATH"] = os.path.join(TMP, "wal.db")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+import db  # noqa: E402
+
+OLD_DB = os.path.join(TMP, "rollback.db")
+
+
+def old_add_chat_history(user, query, response):
+    # db.py before connection reuse
+    conn = sqlite3.connect(OLD_DB)
+    c = conn.cursor()
+    c.execute("INSERT INTO history(user,query,response) VALUES (?,?,?)", (user, query, response))
+    conn.commit()
+    conn.close()
+
+
+def old_get_user_history(user):
+    conn = sqlite3.connect(OLD_DB)
+    c = conn.cursor()
+    c.execute("SELECT query,response FROM history WHERE user=?", (user,))
+    rows = c.fetchall()
+    conn.close()
+    return rows
+
+
+def old_init():
+    conn = sqlite3.connect(OLD_DB)
+    conn.execute("CREATE TABLE IF NOT EXISTS history(user TEXT, query TEXT, response TEXT)")
+    conn.commit()
+    conn.close()
+
+
+def run(add, read, writers, writes, read_every, payload):
+    errors, latencies = [], []
+    lock = threading.Lock()
+    start = threading.Barrier(writers + 1)
+
+    def writer(i):
+        user = f"user{i}"
+        mine, failed = [], 0
+        start.wait()
+        for n in range(writes):
+            t = time.perf_counter()
+            try:
+                add(user, f"question {n}", payload)
+            except sqlite3.OperationalError:
+                failed += 1
+            mine.append(time.perf_counter() - t)
+            if read_every and n % read_every == 0:
+                try:
+                    read(user)
+                except sqlite3.OperationalError:
+                    pass
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+        if add is db.add_chat_history:
+            db.close_conn()
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for t in threads:
+        t.start()
+    start.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {"writes_per_sec": writers * writes / elapsed, "p50_ms": statistics.median(latencies) * 1000,
+            "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000, "errors": sum(errors)}
+
+
+def main(args):
+    old_init()
+    db.init_db()
+    payload = "x" * args.payload
+    print(f"sqlite {sqlite3.sqlite_version}, {args.writes} writes per writer, {args.payload} byte responses, "
+          f"synchronous={db.SQLITE_SYNCHRONOUS}, files in {TMP}")
+    for writers in args.writers:
+        for name, add, read in (("per-call (old)", old_add_chat_history, old_get_user_history),
+                                ("thread-local WAL", db.add_chat_history, db.get_user_history)):
+            r = run(add, read, writers, args.writes, args.read_every, payload)
+            print(f"writers={writers:>3} {name:>17}: {r['writes_per_sec']:9.1f} writes/s  "
+                  f"p50 {r['p50_ms']:7.2f} ms  p99 {r['p99_ms']:8.2f} ms  locked errors {r['errors']}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--writers", type=int, nargs="+", default=[1, 4, 16])
+    ap.add_argument("--writes", type=int, default=500, help="inserts per writer thread")
+    ap.add_argument("--read-every", type=int, default=10, help="read the writer's history every N writes (0 = never)")
+    ap.add_argument("--payload", type=int, default=2000, help="response size in bytes")
+    main(ap.parse_args())
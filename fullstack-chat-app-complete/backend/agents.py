@@ -1,11 +1,16 @@
 # agents.py
 import os
 import json
-from typing import Dict, Any
+import math
+import time
+import queue
+from collections import deque
+from typing import Dict, Any, Iterator
 import threading
 from concurrent.futures import ThreadPoolExecutor
-from PIL import Image
-import pytesseract
+from ocr import OCR_TIMEOUT, OcrPool, default_pool
+from search_cache import LRUCache, normalize_query
+from confluence_sync import CONFLUENCE_SYNC_OVERLAP_MINUTES, CONFLUENCE_SYNC_STATE, load_state
 # optional openai
 try:
     import openai
@@ -21,21 +26,31 @@ class TextAgent:
     def __init__(self):
         pass
 
-    def generate(self, prompt: str):
+    def generate(self, prompt: str, timeout: float = None):
         """If OpenAI key present, returns a generator that yields token chunks as they arrive.
-        Otherwise returns a synchronous dict with 'text'."""
+        Otherwise returns a synchronous dict with 'text'.
+        timeout (seconds) bounds the HTTP request, so a caller that stops
+        waiting also gets the thread back; closing the generator closes the stream."""
         if openai and OPENAI_API_KEY:
             def gen():
+                response = None
                 try:
                     response = openai.chat.completions.create(
                         model=OPENAI_MODEL,
                         messages=[{"role":"user","content": prompt}],
-                        stream=True
+                        stream=True,
+                        timeout=timeout
                     )
                     for event in response:
                         # streaming events — depending on SDK, structure may differ
                         try:
-                            if getattr(event, 'type', None) == 'response.delta':
+                            choices = getattr(event, 'choices', None)
+                            if choices:
+                                # chat.completions chunk
+                                text = choices[0].delta.content
+                                if text:
+                                    yield text
+                            elif getattr(event, 'type', None) == 'response.delta':
                                 delta = getattr(event, 'delta', {}) or {}
                                 text = delta.get('content') or ''
                                 if text:
@@ -51,23 +66,33 @@ class TextAgent:
                             continue
                 except Exception as e:
                     yield f"[openai error] {str(e)}"
+                finally:
+                    if response is not None and hasattr(response, 'close'):
+                        response.close()
             return gen()
         else:
             return {"source": "local", "text": f"[local answer to] {prompt}"}
 
 class ImageAgent:
-    def __init__(self):
-        pass
-    def analyze_image(self, image_path: str):
+    def __init__(self, pool: OcrPool = None):
+        # One bounded OCR pool (and result cache) for the whole process unless given another.
+        self.pool = pool or default_pool()
+
+    def analyze_image(self, image_path: str, timeout: float = None):
         """
                 Extracts text from the image using OCR and returns metadata.
                 Stores a short description for RAG retrieval.
+                Images are grayscaled, rescaled and OCR'd in the shared
+                worker pool; repeats are served from its cache.
+                Waits at most timeout seconds (OCR_TIMEOUT when None).
                 """
         result = {"labels": [], "text": ""}
         try:
-            img = Image.open(image_path)
-            text = pytesseract.image_to_string(img)
+            out = self.pool.ocr(image_path, timeout=OCR_TIMEOUT if timeout is None else min(timeout, OCR_TIMEOUT))
+            text = out["text"]
             result["text"] = text.strip()
+            result["sha256"] = out["sha256"]
+            result["cached"] = out["cached"]
             # Optional: add some simple labels (you can enhance later)
             if len(text.strip()) > 0:
                 result["labels"].append("contains_text")
@@ -77,8 +102,39 @@ class ImageAgent:
             result["text"] = f"[OCR error] {str(e)}"
         return result
 
+# Pages synced by confluence_sync.py are answered from the local RAG index.
+# Live CQL only runs on a miss (no synced page is relevant, or the space was
+# never synced) and, once a space's last sync is CONFLUENCE_LIVE_AFTER seconds
+# old, for pages edited since then. Live results are cached for CONFLUENCE_LIVE_TTL.
+# Hybrid search always returns a synced space's top k, however weak, so a
+# local hit only counts when it shares a query term (BM25) or its cosine
+# similarity reaches CONFLUENCE_LOCAL_MIN_SIMILARITY.
+CONFLUENCE_LOCAL_K = int(os.getenv('CONFLUENCE_LOCAL_K', '5'))
+CONFLUENCE_LOCAL_MIN_SIMILARITY = float(os.getenv('CONFLUENCE_LOCAL_MIN_SIMILARITY', '0.4'))
+CONFLUENCE_LIVE_AFTER = float(os.getenv('CONFLUENCE_LIVE_AFTER', '300'))
+CONFLUENCE_LIVE_TTL = float(os.getenv('CONFLUENCE_LIVE_TTL', '300'))
+CONFLUENCE_LIVE_CACHE_SIZE = int(os.getenv('CONFLUENCE_LIVE_CACHE_SIZE', '256'))
+CONFLUENCE_LIVE_LIMIT = int(os.getenv('CONFLUENCE_LIVE_LIMIT', '10'))
+# Seconds before the HTTP client gives up on a live CQL request. Keep it within
+# ORCH_CONFLUENCE_TIMEOUT so a search the orchestrator gave up on ends soon after.
+CONFLUENCE_LIVE_TIMEOUT = float(os.getenv('CONFLUENCE_LIVE_TIMEOUT', '5'))
+
+
+def _cql_string(value) -> str:
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _merge_hits(first, then):
+    seen, out = set(), []
+    for h in list(first) + list(then):
+        if str(h.get('id')) not in seen:
+            seen.add(str(h.get('id')))
+            out.append(h)
+    return out
+
+
 class ConfluenceAgent:
-    def __init__(self):
+    def __init__(self, store=None, state_path=CONFLUENCE_SYNC_STATE):
         try:
             from atlassian import Confluence
         except Exception:
@@ -87,48 +143,320 @@ class ConfluenceAgent:
         self.user = os.getenv("CONFLUENCE_USERNAME")
         self.token = os.getenv("CONFLUENCE_TOKEN")
         if Confluence and self.base and self.user and self.token:
-            self.client = Confluence(url=self.base, username=self.user, password=self.token)
+            self.client = Confluence(url=self.base, username=self.user, password=self.token,
+                                     timeout=CONFLUENCE_LIVE_TIMEOUT)
         else:
             self.client = None
-    def search(self, query: str, space_keys: str=None):
+        self.store = store   # rag_store.store unless given
+        self.state_path = state_path
+        self._synced_state = (None, {})   # (state file mtime, {space: sync marks})
+        self.live_cache = LRUCache(CONFLUENCE_LIVE_CACHE_SIZE, CONFLUENCE_LIVE_TTL)
+        self._lock = threading.Lock()
+        self.counters = {'searches': 0, 'local': 0, 'misses': 0, 'live_calls': 0, 'live_errors': 0}
+
+    def _count(self, **deltas):
+        with self._lock:
+            for k, v in deltas.items():
+                self.counters[k] += v
+
+    def _synced(self):
+        # high_water / synced_at per synced space; the state file is re-read only when it changes
+        try:
+            mtime = os.stat(self.state_path).st_mtime
+        except OSError:
+            return {}
+        if self._synced_state[0] != mtime:
+            spaces = load_state(self.state_path).get('spaces', {})
+            self._synced_state = (mtime, {k: {'high_water': v['high_water'], 'synced_at': v.get('synced_at') or 0.0}
+                                          for k, v in spaces.items() if v.get('high_water')})
+        return self._synced_state[1]
+
+    def _local(self, query: str, spaces):
+        store = self.store
+        if store is None:
+            from rag_store import store
+        filters = {'type': 'confluence'}
+        if spaces:
+            filters['space'] = spaces
+        k = CONFLUENCE_LOCAL_K * 3
+        relevant = {r['id'] for r in store.keyword_search(query, k=k, filters=filters)}
+        relevant.update(r['id'] for r in store.semantic_search(query, k=k, filters=filters)
+                        if r['score'] >= CONFLUENCE_LOCAL_MIN_SIMILARITY)
+        hits = []
+        # Several passages of one page can match; the page is listed once, at its best passage
+        for r in store.search(query, k=k, filters=filters):
+            if r['id'] not in relevant:
+                continue
+            meta = r.get('meta') or {}
+            hits.append({'title': meta.get('title'), 'id': meta.get('id'), 'space': meta.get('space'),
+                         'version': meta.get('version'), 'score': r['score'], 'source': 'local'})
+        return _merge_hits(hits, [])[:CONFLUENCE_LOCAL_K]
+
+    def _live(self, query: str, spaces, since=None):
+        # since (epoch seconds) limits the search to pages modified after it
+        cql = f'text ~ {_cql_string(query)} and type = page'
+        if spaces:
+            cql += ' and space in (' + ', '.join(_cql_string(s) for s in spaces) + ')'
+        if since is not None:
+            minutes = math.ceil((time.time() - since) / 60) + CONFLUENCE_SYNC_OVERLAP_MINUTES
+            cql += f' and lastmodified >= now("-{minutes}m")'
+        # A sync moves the high-water mark, which turns cached "newer than" results stale
+        key = (normalize_query(query), tuple(spaces), since is not None)
+        hits = self.live_cache.get(key, since)
+        if hits is None:
+            self._count(live_calls=1)
+            try:
+                results = self.client.cql(cql, expand='content', limit=CONFLUENCE_LIVE_LIMIT)
+            except Exception:
+                self._count(live_errors=1)
+                raise
+            hits = []
+            for r in results.get('results', []):
+                content = r.get('content', {})
+                hits.append({"title": content.get('title'), "id": content.get('id'), "source": "live"})
+            self.live_cache.put(key, hits, since)
+        return [dict(h) for h in hits]
+
+    def search(self, query: str, space_keys=None):
+        """
+        Pages matching ``query`` in ``space_keys`` (a key, comma-separated keys
+        or a list; all spaces when None), each tagged ``source`` local or live.
+        """
+        if isinstance(space_keys, str):
+            space_keys = space_keys.split(',')
+        spaces = [s.strip() for s in space_keys or [] if s.strip()]
+        self._count(searches=1)
+        synced = self._synced()
+        hits = self._local(query, spaces) if synced else []
         if not self.client:
-            return []
-        cql = f'text ~ "{query}"'
-        if space_keys:
-            cql += f' and space = {space_keys}'
-        results = self.client.cql(cql, expand='content')
-        out = []
-        for r in results.get('results', []):
-            content = r.get('content', {})
-            out.append({"title": content.get('title'), "id": content.get('id')})
+            return hits
+        unsynced = [s for s in spaces if s not in synced]
+        if not hits or unsynced:
+            self._count(misses=1)
+            return _merge_hits(self._live(query, unsynced or spaces), hits)
+        self._count(local=1)
+        marks = [synced[s] for s in spaces] if spaces else list(synced.values())
+        if any(time.time() - m['synced_at'] > CONFLUENCE_LIVE_AFTER for m in marks):
+            try:
+                newer = self._live(query, spaces, since=min(m['high_water'] for m in marks))
+            except Exception as e:
+                print('Confluence live search failed, answering from the local index:', e)
+                newer = []
+            # Edited since the sync: the live hit replaces the stale local one
+            hits = _merge_hits(newer, hits)
+        return hits
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, live_cache=self.live_cache.stats())
+
+# Each agent type gets its own long-lived pool so a burst of OCR or a hung
+# Confluence call cannot starve the LLM call, and its own deadline. The
+# answer goes out as soon as the text agent (the critical one) finishes.
+# Work still outstanding then, or past its deadline, is given up on: a task
+# that has not started is cancelled, but a running one cannot be interrupted
+# and is abandoned, keeping its worker until it returns. Agents therefore get
+# the time left to their deadline as an HTTP / OCR timeout (and the Confluence
+# client CONFLUENCE_LIVE_TIMEOUT), so abandoned work ends about when its
+# deadline passes. Size ORCH_*_WORKERS for concurrent chats x agents of that
+# type; stats() reports the tasks still running on each pool.
+# Only an answer the model actually streamed ends the run early; a local
+# (no OpenAI) answer comes back at once, so then the other agents still get
+# until their own deadlines and their events are streamed.
+AGENT_WORKERS = {
+    'text': int(os.getenv('ORCH_TEXT_WORKERS', '8')),
+    'image': int(os.getenv('ORCH_IMAGE_WORKERS', '4')),
+    'confluence': int(os.getenv('ORCH_CONFLUENCE_WORKERS', '4')),
+}
+AGENT_TIMEOUTS = {
+    'text': float(os.getenv('ORCH_TEXT_TIMEOUT', '30')),
+    'image': float(os.getenv('ORCH_IMAGE_TIMEOUT', '15')),
+    'confluence': float(os.getenv('ORCH_CONFLUENCE_TIMEOUT', '5')),
+}
+CRITICAL_AGENT = 'text'
+
+
+class AgentStats:
+    """Outcome counts and recent latencies for one agent type."""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.counts = {'ok': 0, 'error': 0, 'timeout': 0, 'cancelled': 0, 'abandoned': 0}
+        self.running = 0   # tasks on the pool now, abandoned ones included
+
+    def started(self, delta: int):
+        with self._lock:
+            self.running += delta
+
+    def record(self, status: str, seconds: float):
+        with self._lock:
+            self.counts[status] += 1
+            if status in ('ok', 'error'):
+                self._latencies.append(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lat = sorted(self._latencies)
+            out = dict(self.counts)
+            running = self.running
+        out['calls'] = sum(out.values())
+        out['running'] = running
+        if lat:
+            out['latency_ms'] = {
+                'p50': round(lat[len(lat) // 2] * 1000.0, 1),
+                'p95': round(lat[min(len(lat) - 1, int(len(lat) * 0.95))] * 1000.0, 1),
+                'max': round(lat[-1] * 1000.0, 1),
+            }
         return out
 
+
 class MasterOrchestrator:
-    def __init__(self, multi_agent=False):
+    def __init__(self, multi_agent=False, timeouts: Dict[str, float] = None):
         self.text_agent = TextAgent()
         self.image_agent = ImageAgent()
         self.confluence_agent = ConfluenceAgent()
         self.multi = multi_agent
+        self.timeouts = dict(AGENT_TIMEOUTS, **(timeouts or {}))
+        self.executors = {name: ThreadPoolExecutor(max_workers=n, thread_name_prefix=f'orch-{name}')
+                          for name, n in AGENT_WORKERS.items()}
+        self.agent_stats = {name: AgentStats() for name in AGENT_WORKERS}
+
+    # Event producers: each runs in its agent's pool and yields dicts tagged
+    # with a "type"; _run() adds the agent name and puts them on the queue.
+    # timeout is the time left to the agent's deadline.
+    def _text_events(self, prompt: str, timeout: float):
+        r = self.text_agent.generate(prompt, timeout=timeout)
+        if isinstance(r, dict):
+            yield {'type': 'delta', 'source': r.get('source', 'agent'), 'text': r.get('text', '')}
+        elif isinstance(r, str) or not hasattr(r, '__iter__'):
+            yield {'type': 'delta', 'source': 'agent', 'text': str(r)}
+        else:
+            for piece in r:
+                yield {'type': 'delta', 'source': 'openai', 'text': piece}
+
+    def _image_events(self, image_path: str, timeout: float):
+        yield dict(self.image_agent.analyze_image(image_path, timeout=timeout), type='ocr', image=image_path)
+
+    def _confluence_events(self, query: str, timeout: float):
+        yield {'type': 'hits', 'hits': self.confluence_agent.search(query)}
+
+    def _run(self, i: int, name: str, produce, arg, out: queue.Queue, stop: threading.Event, deadline: float):
+        started = time.perf_counter()
+        status = 'ok'
+        stats = self.agent_stats[name]
+        stats.started(1)
+        events = produce(arg, max(deadline - time.monotonic(), 0.001))
+        try:
+            for event in events:
+                if stop.is_set():
+                    break
+                event['agent'] = name
+                out.put((i, event))
+        except Exception as e:
+            status = 'error'
+            out.put((i, {'agent': name, 'type': 'error', 'error': str(e)}))
+        finally:
+            events.close()   # e.g. closes the OpenAI stream once nobody listens
+            stats.started(-1)
+        out.put((i, {'type': '_end', 'status': status, 'seconds': time.perf_counter() - started}))
+
+    def stream(self, payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Run the agents concurrently and yield their events as they happen:
+        ``delta`` (text agent output), ``ocr`` (one per image), ``hits``
+        (Confluence), ``error`` / ``timeout``, and a final ``done`` with
+        per-agent status and seconds. ``payload["prompt"]``, if given, is
+        what the text agent sees (e.g. with RAG context); ``payload["text"]``
+        is the user's question and what Confluence is searched for.
+        """
+        text = payload.get('text', '')
+        tasks = [('text', self._text_events, payload.get('prompt') or text)]
+        if self.multi:
+            tasks += [('image', self._image_events, img) for img in payload.get('images') or []]
+            tasks.append(('confluence', self._confluence_events, text))
+        out = queue.Queue()
+        stops = [threading.Event() for _ in tasks]
+        started = time.monotonic()
+        futures = [self.executors[name].submit(self._run, i, name, produce, arg, out, stops[i],
+                                               started + self.timeouts[name])
+                   for i, (name, produce, arg) in enumerate(tasks)]
+        records = [{'agent': name, 'status': None, 'seconds': None} for name, _, _ in tasks]
+        open_ = set(range(len(tasks)))
+        streamed = False   # the text agent produced a real model completion
+
+        def give_up(i, status=None):
+            # Not started: cancelled. Running: abandoned, unless it overran its deadline.
+            cancelled = futures[i].cancel()
+            status = status or ('cancelled' if cancelled else 'abandoned')
+            stops[i].set()
+            open_.discard(i)
+            records[i].update(status=status, seconds=time.monotonic() - started)
+
+        try:
+            while open_:
+                now = time.monotonic() - started
+                for i in sorted(open_):
+                    name = records[i]['agent']
+                    if now >= self.timeouts[name]:
+                        give_up(i, 'timeout')
+                        yield {'agent': name, 'type': 'timeout',
+                               'error': f'{name} timed out after {self.timeouts[name]:g}s'}
+                if not open_:
+                    break
+                waiting = 0 in open_ or not streamed
+                try:
+                    if waiting:
+                        wait_for = min(self.timeouts[records[i]['agent']] for i in open_) - now
+                        i, event = out.get(timeout=max(wait_for, 0.01))
+                    else:
+                        # The model's answer is complete: flush what the others already sent, then stop.
+                        i, event = out.get_nowait()
+                except queue.Empty:
+                    if waiting:
+                        continue
+                    break
+                if i not in open_:
+                    continue    # late output from an agent already given up on
+                if i == 0 and event.get('source') == 'openai':
+                    streamed = True
+                if event['type'] == '_end':
+                    open_.discard(i)
+                    records[i].update(status=event['status'], seconds=event['seconds'])
+                else:
+                    yield event
+            for i in list(open_):
+                give_up(i)
+        finally:
+            # Also reached when the consumer goes away mid-stream.
+            for i in list(open_):
+                give_up(i)
+            for rec in records:
+                self.agent_stats[rec['agent']].record(rec['status'], rec['seconds'])
+        yield {'type': 'done', 'agents': [dict(rec, seconds=round(rec['seconds'], 3)) for rec in records]}
 
     def handle_query(self, payload: Dict[str, Any]):
-        prompt = payload.get('text', '')
-        images = payload.get('images', [])
         results = []
+        agents = []
         if self.multi:
-            with ThreadPoolExecutor() as ex:
-                futures = []
-                futures.append(ex.submit(self.text_agent.generate, prompt))
-                if images:
-                    for img in images:
-                        futures.append(ex.submit(self.image_agent.analyze_image, img))
-                futures.append(ex.submit(self.confluence_agent.search, prompt))
-                for fut in futures:
-                    try:
-                        results.append(fut.result(timeout=30))
-                    except Exception as e:
-                        results.append({"error": str(e)})
+            parts, source = [], 'agent'
+            for event in self.stream(payload):
+                kind = event['type']
+                if kind == 'delta':
+                    parts.append(event['text'])
+                    source = event['source']
+                elif kind == 'ocr':
+                    results.append(event)
+                elif kind == 'hits':
+                    results.append(event['hits'])
+                elif kind in ('error', 'timeout'):
+                    results.append({'error': event['error']})
+                elif kind == 'done':
+                    agents = event['agents']
+            if parts:
+                results.insert(0, {'source': source, 'text': ''.join(parts)})
         else:
-            results.append(self.text_agent.generate(prompt))
+            results.append(self.text_agent.generate(payload.get('text', '')))
         # Merge
         merged_texts = []
         sources = []
@@ -145,5 +473,14 @@ class MasterOrchestrator:
                     merged_texts.append(str(r))
             else:
                 merged_texts.append(str(r))
-        merged = {"text": "\n".join([t for t in merged_texts if t]), "sources": sources}
+        merged = {"text": "\n".join([t for t in merged_texts if t]), "sources": sources, "agents": agents}
         return merged
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-agent outcome counts and latency percentiles for /metrics."""
+        return {name: dict(s.snapshot(), timeout_seconds=self.timeouts[name], workers=AGENT_WORKERS[name])
+                for name, s in self.agent_stats.items()}
+
+    def shutdown(self):
+        for ex in self.executors.values():
+            ex.shutdown(wait=False, cancel_futures=True)
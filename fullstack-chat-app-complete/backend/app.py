@@ -2,16 +2,21 @@
 import os
 import time
 import json
+import uuid
+import shutil
+import hashlib
 from pathlib import Path
 from dotenv import load_dotenv
 from flask import Flask, request, jsonify, send_from_directory, Response, render_template
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 from sqlalchemy import create_engine, Table, Column, Integer, String, Text, MetaData
 from sqlalchemy.exc import IntegrityError
 import bcrypt
 from rag_store import store as rag_store
+from metadata_index import FILTER_FIELDS, RANGE_FIELDS, parse_filters
 from agents import MasterOrchestrator
 import fitz  # PyMuPDF
 from pathlib import Path
@@ -32,19 +37,29 @@ OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
 STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local')
 AZURE_BLOB_CONNECTION_STRING = os.getenv('AZURE_BLOB_CONNECTION_STRING')
 AZURE_BLOB_CONTAINER = os.getenv('AZURE_BLOB_CONTAINER')
+# Uploads are streamed in chunks (never read whole into memory) and refused past
+# MAX_UPLOAD_BYTES (0 = no limit); blobs are sent as AZURE_BLOCK_BYTES blocks.
+# Azurite ("UseDevelopmentStorage=true") works as a local blob stand-in.
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', str(100 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv('UPLOAD_CHUNK_BYTES', str(1024 * 1024)))
+AZURE_BLOCK_BYTES = int(os.getenv('AZURE_BLOCK_BYTES', str(4 * 1024 * 1024)))
+AZURE_UPLOAD_CONCURRENCY = int(os.getenv('AZURE_UPLOAD_CONCURRENCY', '2'))
 
 # Azure blob optional
 azure_blob_client = None
 if STORAGE_BACKEND == 'azure_blob' and AZURE_BLOB_CONNECTION_STRING and AZURE_BLOB_CONTAINER:
     try:
         from azure.storage.blob import BlobServiceClient
-        azure_blob_client = BlobServiceClient.from_connection_string(AZURE_BLOB_CONNECTION_STRING)
+        azure_blob_client = BlobServiceClient.from_connection_string(
+            AZURE_BLOB_CONNECTION_STRING, max_block_size=AZURE_BLOCK_BYTES, max_single_put_size=AZURE_BLOCK_BYTES)
     except Exception:
         azure_blob_client = None
 
 app = Flask(__name__, template_folder='../frontend/templates')
 CORS(app)
 app.config['JWT_SECRET_KEY'] = JWT_SECRET
+# Declared bodies over the limit get a 413 before any of them is read
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES or None
 jwt = JWTManager(app)
 
 # Database
@@ -80,6 +95,32 @@ def hash_password(password: str) -> str:
 def check_password(password: str, password_hash: str) -> bool:
     return bcrypt.checkpw(password.encode(), password_hash.encode())
 
+class HashingReader:
+    """File-like wrapper that hashes an upload stream as it is read and enforces MAX_UPLOAD_BYTES."""
+
+    def __init__(self, raw, max_bytes=MAX_UPLOAD_BYTES):
+        self.raw = raw
+        self.max_bytes = max_bytes
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, n=-1):
+        block = self.raw.read(n)
+        self.size += len(block)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise RequestEntityTooLarge(f'upload exceeds {self.max_bytes} bytes')
+        self.sha256.update(block)
+        return block
+
+def search_filters(raw, username):
+    # Retrieval filters from a request (ValueError -> 400). A "user" filter only ever
+    # means the caller's own uploads; without one every user's uploads are searched,
+    # as the store is a shared knowledge base, not per-tenant.
+    filters = parse_filters(raw)
+    if filters and 'user' in filters:
+        filters['user'] = username
+    return filters
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -122,6 +163,7 @@ def upload():
     if f.filename == '':
         return jsonify({'msg': 'no selected file'}), 400
     filename = secure_filename(f.filename)
+    reader = HashingReader(f.stream)
 
     if STORAGE_BACKEND == 'azure_blob' and azure_blob_client:
         container_client = azure_blob_client.get_container_client(AZURE_BLOB_CONTAINER)
@@ -130,16 +172,22 @@ def upload():
             container_client.create_container()
         except Exception:
             pass
-        file_bytes = f.read()
-        container_client.upload_blob(name=blob_name, data=file_bytes, overwrite=True)
+        # The SDK pulls the stream block by block; a failed upload leaves only uncommitted blocks
+        container_client.upload_blob(name=blob_name, data=reader, overwrite=True, max_concurrency=AZURE_UPLOAD_CONCURRENCY)
         blob_url = f"https://{azure_blob_client.account_name}.blob.core.windows.net/{AZURE_BLOB_CONTAINER}/{blob_name}"
-        rag_store.add_documents([(f"[image-blob]\\nURL:{blob_url}", {'filename': filename, 'type': 'image', 'url': blob_url})])
-        return jsonify({'filename': filename, 'url': blob_url})
+        rag_store.add_documents([(f"[image-blob]\\nURL:{blob_url}", {'filename': filename, 'type': 'image', 'url': blob_url, 'user': get_jwt_identity(), 'sha256': reader.sha256.hexdigest()})])
+        return jsonify({'filename': filename, 'url': blob_url, 'size': reader.size, 'sha256': reader.sha256.hexdigest()})
     else:
         dest = UPLOAD_FOLDER / filename
-        f.save(dest)
-        rag_store.add_documents([(f"[image-file]\\nPath:{str(dest)}", {'filename': filename, 'type': 'image', 'path': str(dest)})])
-        return jsonify({'filename': filename, 'url': f"/uploads/{filename}"})
+        tmp = UPLOAD_FOLDER / f".incoming-{uuid.uuid4()}"
+        try:
+            with open(tmp, 'wb') as out:
+                shutil.copyfileobj(reader, out, UPLOAD_CHUNK_BYTES)
+            os.replace(tmp, dest)
+        finally:
+            tmp.unlink(missing_ok=True)
+        rag_store.add_documents([(f"[image-file]\\nPath:{str(dest)}", {'filename': filename, 'type': 'image', 'path': str(dest), 'user': get_jwt_identity(), 'sha256': reader.sha256.hexdigest()})])
+        return jsonify({'filename': filename, 'url': f"/uploads/{filename}", 'size': reader.size, 'sha256': reader.sha256.hexdigest()})
 
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
@@ -155,28 +203,25 @@ def history():
     out = [{'role': r.role, 'content': r.content, 'meta': r.meta} for r in rows]
     return jsonify(out)
 
-def generate_assistant_stream_openai(prompt: str):
-    if not openai:
-        yield json.dumps({'chunk': '[openai library not installed]'})
-        return
-    if not OPENAI_API_KEY:
-        yield json.dumps({'chunk': '[OPENAI_API_KEY not set]'})
-        return
-    try:
-        print("right path")
-        response = openai.chat.completions.create(model=OPENAI_MODEL, messages=[{'role':'user','content':prompt}], stream=True)
-        print(response)
-        for event in response:
-            print(event)
-            for chunk in response:
-                # chunk.choices is a list; usually one element
-                delta = chunk.choices[0].delta  # this is a ChoiceDelta object
-                if hasattr(delta, 'content') and delta.content:
-                    print(delta.content, end='')
-                    yield delta.content
-    except Exception as e:
-        print("rerrer: {}".format(e))
-        yield json.dumps({'chunk': f'[openai error] {str(e)}'})
+def agent_frame(event):
+    """SSE payload for one orchestrator event; ``chunk`` is what the chat window shows."""
+    agent, kind = event.get('agent'), event['type']
+    if kind == 'delta':
+        return {'role': 'assistant', 'agent': agent, 'chunk': event['text']}
+    if kind == 'ocr':
+        return {'role': 'agent', 'agent': agent, 'image': event['image'], 'labels': event.get('labels', []),
+                'chunk': f"[image] {os.path.basename(str(event['image']))}: {event['text'][:300]}"}
+    if kind == 'hits':
+        if not event['hits']:
+            return None
+        titles = ', '.join(str(h.get('title')) for h in event['hits'][:5])
+        return {'role': 'agent', 'agent': agent, 'hits': event['hits'],
+                'chunk': f"[confluence] {len(event['hits'])} page(s): {titles}"}
+    if kind in ('error', 'timeout'):
+        return {'role': 'agent', 'agent': agent, 'error': event['error'], 'chunk': f"[{agent} {kind}] {event['error']}"}
+    if kind == 'done':
+        return {'role': 'agent', 'agents': event['agents']}
+    return None
 
 @app.route('/chat', methods=['POST'])
 @jwt_required()
@@ -185,33 +230,29 @@ def chat():
     text = data.get('text', '')
     username = get_jwt_identity()
     images = data.get('images', [])
+    try:
+        filters = search_filters(data.get('filters'), username)
+    except ValueError as e:
+        return jsonify({'msg': str(e)}), 400
     ins = messages.insert().values(user=username, role='user', content=text, meta=json.dumps({'images': images}))
     with engine.begin() as conn:
         conn.execute(ins)
 
-    retrieved = rag_store.search(text, k=4)
+    retrieved = rag_store.search(text, k=4, filters=filters)
     print("retrieved {}".format(retrieved))
     context_texts = '\\n\\n'.join([r['text'] for r in retrieved])
     prompt_with_context = f"Context:\\n{context_texts}\\n\\nUser: {text}\\nAssistant:"
     print("RAG : {}".format(prompt_with_context))
     def event_stream():
-        if OPENAI_API_KEY and openai:
-            print("openai")
-            for chunk in generate_assistant_stream_openai(prompt_with_context):
-                # chunk might be raw text or json string
-                # print("chunk: {}".format(chunk))
-                if isinstance(chunk, str) and chunk.startswith('{') and 'chunk' in chunk:
-                    try:
-                        payload = json.loads(chunk)
-                        print(payload)
-                        yield f"data: {json.dumps({'role':'assistant','chunk': payload.get('chunk')})}\\n\\n"
-                    except Exception as e:
-                        print(chunk)
-                        print("error {}".format(e))
-                        yield f"data: {json.dumps({'role':'assistant','chunk': chunk})}\\n\\n"
-                else:
-                    # print("elseop {}".format(chunk))
-                    yield f"data: {json.dumps({'role':'assistant','chunk': chunk})}\\n\\n"
+        if orch.multi or (OPENAI_API_KEY and openai):
+            # Text deltas, OCR results and Confluence hits are relayed as each agent produces them.
+            # Images are referenced by upload name; only files in UPLOAD_FOLDER are OCR'd.
+            paths = [UPLOAD_FOLDER / secure_filename(os.path.basename(str(i))) for i in images]
+            paths = [str(p) for p in paths if p.is_file()]
+            for event in orch.stream({'text': text, 'prompt': prompt_with_context, 'images': paths}):
+                frame = agent_frame(event)
+                if frame:
+                    yield f"data: {json.dumps(frame)}\\n\\n"
         else:
             print("else")
             simulated = [
@@ -237,8 +278,21 @@ def chat():
 def search():
     q = request.args.get('q', '')
     k = int(request.args.get('k', 5))
-    results = rag_store.search(q, k=k)
-    return jsonify(results)
+    # ?space=ENG&space=OPS&type=pdf&since=1700000000
+    raw = {f: request.args.getlist(f) for f in FILTER_FIELDS}
+    # Raw strings: parse_filters rejects a malformed since / until instead of dropping it
+    raw.update({f: request.args.get(f) for f in RANGE_FIELDS})
+    try:
+        filters = search_filters(raw, get_jwt_identity())
+    except ValueError as e:
+        return jsonify({'msg': str(e)}), 400
+    return jsonify(rag_store.search(q, k=k, filters=filters))
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({'embedding': rag_store.query_encoder.stats(), 'search_cache': rag_store.cache_stats(),
+                    'index': rag_store.index_stats(), 'ocr': orch.image_agent.pool.stats(),
+                    'agents': orch.stats(), 'confluence': orch.confluence_agent.stats()})
 
 if __name__ == '__main__':
     app.run(host=os.getenv('FLASK_HOST', '0.0.0.0'), port=int(os.getenv('FLASK_PORT', 5000)), debug=True)
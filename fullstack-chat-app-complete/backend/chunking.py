@@ -0,0 +1,64 @@
+"""
+Split documents into overlapping passages before they are indexed.
+
+all-MiniLM-L6-v2 only looks at the first 256 word pieces of its input, so
+whole documents are cut into windows that fit the model. Tokens here are
+whitespace-separated words, which keeps chunking independent of the
+embedder; the default window leaves headroom for words that split into
+several word pieces. Chunks never cross a page boundary so every passage
+can be cited by page.
+"""
+import os
+import re
+from typing import Dict, Iterable, List, Tuple, Union
+
+CHUNK_TOKENS = int(os.getenv("RAG_CHUNK_TOKENS", "180"))
+CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "30"))
+
+_TOKEN_RE = re.compile(r"\S+")
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """Return windows of at most ``max_tokens`` words, consecutive windows sharing ``overlap`` words."""
+    if max_tokens <= 0:
+        raise ValueError("max_tokens must be positive")
+    if not 0 <= overlap < max_tokens:
+        raise ValueError("overlap must be between 0 and max_tokens - 1")
+    spans = [m.span() for m in _TOKEN_RE.finditer(text or "")]
+    if not spans:
+        return []
+    step = max_tokens - overlap
+    chunks = []
+    for start in range(0, len(spans), step):
+        window = spans[start:start + max_tokens]
+        # Slice the original string so line breaks inside a passage survive.
+        chunks.append(text[window[0][0]:window[-1][1]])
+        if start + max_tokens >= len(spans):
+            break
+    return chunks
+
+
+def chunk_document(doc_id: str, pages: Union[str, Iterable[str]], meta: Dict,
+                   max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP) -> List[Tuple[str, Dict]]:
+    """
+    Turn one document into ``(text, meta)`` passages ready for ``RAGStore.add_documents``.
+
+    ``pages`` is either the whole text or one string per page. Each passage
+    carries the parent ``doc_id``, its 1-based ``page`` and a ``chunk_id`` of
+    the form ``<doc_id>:<page>:<n>``.
+    """
+    if isinstance(pages, str):
+        pages = [pages]
+    out = []
+    n = 0
+    for page_no, page_text in enumerate(pages, start=1):
+        for text in chunk_text(page_text, max_tokens, overlap):
+            out.append((text, {
+                **meta,
+                "doc_id": doc_id,
+                "page": page_no,
+                "chunk": n,
+                "chunk_id": f"{doc_id}:{page_no}:{n}",
+            }))
+            n += 1
+    return out
@@ -1,37 +1,403 @@
 # confluence_sync.py
+"""
+Incremental Confluence -> RAG store sync.
+
+Every space in CONFLUENCE_SPACE_KEYS keeps a high-water mark (the newest
+``version.when`` seen) and the version number of every page synced so far,
+in CONFLUENCE_SYNC_STATE. A run then only:
+
+* lists the page ids of the space (no bodies) and deletes the passages of
+  pages that are gone;
+* asks CQL for pages modified since the high-water mark (minus
+  CONFLUENCE_SYNC_OVERLAP_MINUTES, since CQL dates only have minute
+  resolution), ids and versions only;
+* fetches the bodies of the pages whose version went up, converts their
+  storage-format HTML to text and re-indexes them, replacing their old
+  passages.
+
+Fetching is a pipeline: spaces are synced CONFLUENCE_SPACE_CONCURRENCY at
+a time and page bodies are fetched (and converted) by a shared pool of
+CONFLUENCE_CONCURRENCY workers over one pooled HTTP session, while the
+previous batch is being embedded. All requests go through a token bucket
+(CONFLUENCE_RATE per second, bursts of CONFLUENCE_BURST) and are retried
+with exponential backoff on 429 / 5xx / connection errors, honouring
+Retry-After.
+
+The state file is rewritten after every batch, with a cursor holding the
+query's lower bound while a pass is in progress, so a run that dies half
+way resumes that pass: pages already synced are skipped by version.
+
+    python confluence_sync.py            # incremental
+    python confluence_sync.py --full     # re-check every page's version
+"""
+import argparse
+import json
+import math
 import os
-from rag_store import RAGStore, store
-try:
-    from atlassian import Confluence
-except Exception:
-    Confluence = None
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from html.parser import HTMLParser
+from pathlib import Path
 
-def sync_all():
-    base = os.getenv('CONFLUENCE_BASE_URL')
-    user = os.getenv('CONFLUENCE_USERNAME')
-    token = os.getenv('CONFLUENCE_TOKEN')
-    if not base or not user or not token or Confluence is None:
-        print('Confluence not configured or atlassian lib missing')
-        return
-    c = Confluence(url=base, username=user, password=token)
-    space_keys = os.getenv('CONFLUENCE_SPACE_KEYS', '')
-    for space in space_keys.split(','):
+import requests
+from requests.adapters import HTTPAdapter
+
+from ingest import print_progress
+
+CONFLUENCE_SYNC_STATE = os.getenv('CONFLUENCE_SYNC_STATE', './confluence_sync.json')
+CONFLUENCE_PAGE_LIMIT = int(os.getenv('CONFLUENCE_PAGE_LIMIT', '50'))
+CONFLUENCE_LIST_LIMIT = int(os.getenv('CONFLUENCE_LIST_LIMIT', '200'))
+CONFLUENCE_SYNC_OVERLAP_MINUTES = int(os.getenv('CONFLUENCE_SYNC_OVERLAP_MINUTES', '10'))
+CONFLUENCE_TIMEOUT = float(os.getenv('CONFLUENCE_TIMEOUT', '30'))
+CONFLUENCE_CONCURRENCY = int(os.getenv('CONFLUENCE_CONCURRENCY', '8'))
+CONFLUENCE_SPACE_CONCURRENCY = int(os.getenv('CONFLUENCE_SPACE_CONCURRENCY', '2'))
+CONFLUENCE_RATE = float(os.getenv('CONFLUENCE_RATE', '20'))   # requests/second, 0 = unlimited
+CONFLUENCE_BURST = int(os.getenv('CONFLUENCE_BURST', '20'))
+CONFLUENCE_RETRIES = int(os.getenv('CONFLUENCE_RETRIES', '5'))
+CONFLUENCE_BACKOFF = float(os.getenv('CONFLUENCE_BACKOFF', '0.5'))
+CONFLUENCE_BACKOFF_MAX = float(os.getenv('CONFLUENCE_BACKOFF_MAX', '30'))
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def page_doc_id(page_id) -> str:
+    return f"confluence:{page_id}"
+
+
+def parse_when(when: str) -> float:
+    # version.when looks like 2024-05-01T10:22:33.123Z
+    return datetime.fromisoformat(when.replace('Z', '+00:00')).timestamp()
+
+
+# ---------------------------------------------------------------------
+# Storage format (XHTML) -> text
+# ---------------------------------------------------------------------
+BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'blockquote',
+              'table', 'ul', 'ol', 'hr', 'ac:task', 'ac:plain-text-body'}
+SKIP_TAGS = {'script', 'style', 'ac:parameter', 'ri:attachment', 'ri:user'}
+
+
+class _TextExtractor(HTMLParser):
+    """Incremental HTML -> text: feed() slices, take() the paragraphs completed so far."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._line = []
+        self._done = []
+        self._skip = 0
+
+    def _flush(self):
+        line = ' '.join(''.join(self._line).split())
+        if line:
+            self._done.append(line)
+        self._line = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip += 1
+        elif tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in BLOCK_TAGS:
+            self._flush()
+        elif tag in ('td', 'th'):
+            self._line.append(' | ')
+
+    def handle_data(self, data):
+        if not self._skip:
+            self._line.append(data)
+
+    def unknown_decl(self, data):
+        # Code macros keep their source in CDATA
+        if data.startswith('CDATA[') and not self._skip:
+            self._line.append(data[6:])
+
+    def take(self):
+        out, self._done = self._done, []
+        return out
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def iter_paragraphs(html: str, chunk_chars: int = 64 * 1024):
+    """Yield text paragraphs of ``html`` as the parser gets through it, a slice at a time."""
+    parser = _TextExtractor()
+    for i in range(0, len(html), chunk_chars):
+        parser.feed(html[i:i + chunk_chars])
+        yield from parser.take()
+    parser.close()
+    yield from parser.take()
+
+
+def html_to_text(html: str) -> str:
+    return '\n\n'.join(iter_paragraphs(html or ''))
+
+
+# ---------------------------------------------------------------------
+# HTTP client: pooled session, token bucket, retry with backoff
+# ---------------------------------------------------------------------
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, sleeping until it is available; returns the seconds waited."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class ConfluenceClient:
+    """The REST calls the sync needs, over one pooled, rate-limited, retrying session."""
+
+    def __init__(self, base: str, user: str, token: str, timeout: float = CONFLUENCE_TIMEOUT,
+                 concurrency: int = CONFLUENCE_CONCURRENCY, rate: float = CONFLUENCE_RATE,
+                 burst: int = CONFLUENCE_BURST, retries: int = CONFLUENCE_RETRIES):
+        self.base = base.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.bucket = TokenBucket(rate, burst)
+        self.session = requests.Session()
+        self.session.auth = (user, token)
+        self.session.headers['Accept'] = 'application/json'
+        # One keep-alive connection per worker instead of urllib3's default of 10 shared
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(concurrency, 1) + CONFLUENCE_SPACE_CONCURRENCY)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self.counters = {'requests': 0, 'retries': 0, 'throttled_seconds': 0.0, 'backoff_seconds': 0.0}
+
+    def _count(self, **deltas):
+        with self._lock:
+            for k, v in deltas.items():
+                self.counters[k] += v
+
+    def _backoff(self, attempt: int, response=None) -> float:
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), CONFLUENCE_BACKOFF_MAX)
+            except ValueError:
+                pass
+        return min(CONFLUENCE_BACKOFF_MAX, CONFLUENCE_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def _get(self, path: str, params: dict = None) -> dict:
+        for attempt in range(self.retries + 1):
+            self._count(requests=1, throttled_seconds=self.bucket.acquire())
+            try:
+                r = self.session.get(f"{self.base}{path}", params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                if r.status_code not in RETRY_STATUS or attempt == self.retries:
+                    r.raise_for_status()
+                    return r.json()
+                delay = self._backoff(attempt, r)
+            self._count(retries=1, backoff_seconds=delay)
+            time.sleep(delay)
+
+    def _paged(self, path: str, params: dict, limit: int):
         start = 0
-        limit = 50
         while True:
-            res = c.get_all_pages_from_space(space=space.strip(), start=start, limit=limit)
-            if not res:
-                break
-            docs = []
-            for page in res:
-                text = page.get('body', {}).get('storage', {}).get('value', '') or ''
-                meta = {"title": page.get('title'), "id": page.get('id'), "space": space}
-                docs.append((text, meta))
-            store.add_documents(docs)
+            res = self._get(path, dict(params, start=start, limit=limit)).get('results', [])
+            yield from res
             if len(res) < limit:
-                break
+                return
             start += limit
-    print('Confluence sync complete')
+
+    def page_ids(self, space: str, limit: int = CONFLUENCE_LIST_LIMIT):
+        params = {'spaceKey': space, 'type': 'page', 'status': 'current'}
+        return [str(p['id']) for p in self._paged('/rest/api/content', params, limit)]
+
+    def changed(self, cql: str, limit: int = CONFLUENCE_LIST_LIMIT):
+        """Pages matching ``cql`` with their versions, no bodies."""
+        return list(self._paged('/rest/api/content/search', {'cql': cql, 'expand': 'version'}, limit))
+
+    def page(self, page_id) -> dict:
+        """One page with its body converted to text (under ``"text"``); None if it was deleted meanwhile."""
+        try:
+            p = self._get(f'/rest/api/content/{page_id}', {'expand': 'body.storage,version'})
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
+        p['text'] = html_to_text(p.get('body', {}).get('storage', {}).get('value', ''))
+        p.pop('body', None)
+        return p
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, throttled_seconds=round(self.counters['throttled_seconds'], 3),
+                        backoff_seconds=round(self.counters['backoff_seconds'], 3))
+
+
+def fetch_batches(client: ConfluenceClient, pages, executor: ThreadPoolExecutor, batch_size: int = CONFLUENCE_PAGE_LIMIT):
+    """
+    Yield the full pages for ``pages`` (listing entries) in batches of
+    ``batch_size``. The next batch is already being fetched while the caller
+    works on the current one.
+    """
+    batches = [pages[i:i + batch_size] for i in range(0, len(pages), batch_size)]
+    ahead = None
+    for i, batch in enumerate(batches):
+        current = ahead or [executor.submit(client.page, p['id']) for p in batch]
+        ahead = ([executor.submit(client.page, p['id']) for p in batches[i + 1]]
+                 if i + 1 < len(batches) else None)
+        yield [f.result() for f in current]
+
+
+# ---------------------------------------------------------------------
+# Sync state
+# ---------------------------------------------------------------------
+_state_lock = threading.Lock()   # spaces sync in parallel but share one state file
+
+
+def load_state(path=CONFLUENCE_SYNC_STATE) -> dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'spaces': {}}
+
+
+def save_state(state: dict, path=CONFLUENCE_SYNC_STATE):
+    # Written next to the target and renamed over it, so a crash never leaves half a file
+    tmp = Path(f"{path}.tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def changed_cql(space: str, since) -> str:
+    cql = f'space = "{space}" and type = page'
+    if since is not None:
+        # Relative to the server's clock, which sidesteps the server's time zone
+        minutes = math.ceil((time.time() - since) / 60) + CONFLUENCE_SYNC_OVERLAP_MINUTES
+        cql += f' and lastmodified >= now("-{minutes}m")'
+    return cql + ' order by lastmodified asc'
+
+
+def sync_space(client: ConfluenceClient, space: str, state: dict, executor: ThreadPoolExecutor,
+               full: bool = False, state_path=CONFLUENCE_SYNC_STATE) -> dict:
+    # Imported here so the fetch pipeline can be used (and benchmarked) without loading the embedder
+    from rag_store import store
+
+    started = time.perf_counter()
+    with _state_lock:
+        st = state['spaces'].setdefault(space, {'high_water': None, 'pages': {}})
+        known = dict(st['pages'])
+        cursor = st.get('cursor')
+    report = {'space': space, 'deleted': 0, 'seen': 0, 'changed': 0, 'passages': 0, 'reused': 0, 'resumed': False}
+
+    # Pages no longer in the space (deleted, trashed, moved away)
+    current = set(client.page_ids(space))
+    gone = [pid for pid in known if pid not in current]
+    if gone:
+        report['passages_removed'] = store.delete_documents(page_doc_id(pid) for pid in gone)
+        with _state_lock:
+            for pid in gone:
+                st['pages'].pop(pid, None)
+            save_state(state, state_path)
+        report['deleted'] = len(gone)
+
+    if cursor and (not full or cursor['since'] is None):
+        # Finish the interrupted pass first; what it already synced is skipped by version
+        since = cursor['since']
+        report['resumed'] = True
+    else:
+        since = None if full else st['high_water']
+    listing = client.changed(changed_cql(space, since))
+    report['seen'] = len(listing)
+    todo = [p for p in listing if known.get(str(p['id']), 0) < p.get('version', {}).get('number', 1)]
+    whens = [parse_when(p['version']['when']) for p in listing if p.get('version', {}).get('when')]
+    with _state_lock:
+        st['cursor'] = {'since': since}
+        save_state(state, state_path)
+
+    fetch_started = time.perf_counter()
+    for batch in fetch_batches(client, todo, executor):
+        batch = [p for p in batch if p is not None]   # deleted since the listing: next run's delete pass
+        # Each page replaces its previous version; unchanged paragraphs keep their vectors
+        items = [(page_doc_id(p['id']), p['text'],
+                  {"title": p.get('title'), "id": p.get('id'), "space": space, "type": "confluence",
+                   "version": p.get('version', {}).get('number')})
+                 for p in batch]
+        r = store.ingest_documents(items, progress=print_progress(f'space {space}'), replace=True)
+        report['passages'] += r['indexed']
+        report['reused'] += r['reused']
+        report['changed'] += len(batch)
+        with _state_lock:
+            for p in batch:
+                st['pages'][str(p['id'])] = p.get('version', {}).get('number', 1)
+            save_state(state, state_path)
+    elapsed = time.perf_counter() - fetch_started
+
+    with _state_lock:
+        if whens:
+            st['high_water'] = max([st['high_water'] or 0.0] + whens)
+        st.pop('cursor', None)
+        st['synced_at'] = time.time()   # ConfluenceAgent trusts the local index for a while after this
+        save_state(state, state_path)
+    report['pages_per_sec'] = round(report['changed'] / elapsed, 1) if report['changed'] and elapsed > 0 else None
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def sync_all(full: bool = False, spaces=None, state_path=CONFLUENCE_SYNC_STATE):
+    base = os.getenv('CONFLUENCE_BASE_URL')
+    user = os.getenv('CONFLUENCE_USERNAME')
+    token = os.getenv('CONFLUENCE_TOKEN')
+    if not base or not user or not token:
+        print('Confluence not configured')
+        return []
+    client = ConfluenceClient(base, user, token)
+    if spaces is None:
+        spaces = os.getenv('CONFLUENCE_SPACE_KEYS', '').split(',')
+    spaces = [s.strip() for s in spaces if s.strip()]
+    state = load_state(state_path)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(CONFLUENCE_CONCURRENCY, 1), thread_name_prefix='confluence-page') as pages, \
+            ThreadPoolExecutor(max_workers=max(CONFLUENCE_SPACE_CONCURRENCY, 1), thread_name_prefix='confluence-space') as ex:
+        futures = [ex.submit(sync_space, client, space, state, pages, full, state_path) for space in spaces]
+        reports = []
+        for space, f in zip(spaces, futures):
+            report = f.result()
+            print(f'space {space}:', report)
+            reports.append(report)
+    elapsed = time.perf_counter() - started
+    changed = sum(r['changed'] for r in reports)
+    print('Confluence sync complete:', dict(client.stats(), pages=changed, seconds=round(elapsed, 3),
+                                             pages_per_sec=round(changed / elapsed, 1) if elapsed > 0 else None))
+    return reports
+
 
 if __name__ == '__main__':
-    sync_all()
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--full', action='store_true', help="re-check every page's version, not just recent edits")
+    ap.add_argument('--space', action='append', help='only these space keys (default CONFLUENCE_SPACE_KEYS)')
+    args = ap.parse_args()
+    sync_all(full=args.full, spaces=args.space)
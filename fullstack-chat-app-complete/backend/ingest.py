@@ -0,0 +1,68 @@
+"""
+Batched embedding for bulk ingestion.
+
+Texts are sorted by length before being cut into batches so each batch
+holds passages of similar size and the model pads as little as possible;
+vectors are scattered back into input order afterwards.
+
+Passages also carry a hash of their normalised text so the store can drop
+exact repeats before embedding them; near-duplicates (cosine similarity of
+at least ``RAG_NEAR_DUP_THRESHOLD`` to an indexed passage) are dropped after.
+"""
+import hashlib
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+EMBED_BATCH_SIZE = int(os.getenv("RAG_EMBED_BATCH_SIZE", "64"))
+NEAR_DUP_THRESHOLD = float(os.getenv("RAG_NEAR_DUP_THRESHOLD", "0.98"))
+
+ProgressFn = Callable[[int, int], None]
+
+
+def embed_texts(embedder, texts: List[str], batch_size: int = EMBED_BATCH_SIZE,
+                progress: Optional[ProgressFn] = None) -> Tuple[np.ndarray, Dict]:
+    """
+    Encode ``texts`` with normalized embeddings in length-sorted batches.
+
+    Returns the ``(len(texts), dim)`` float32 matrix in input order and a
+    throughput report. ``progress(done, total)`` is called after each batch.
+    """
+    if batch_size <= 0:
+        raise ValueError("batch_size must be positive")
+    started = time.perf_counter()
+    n = len(texts)
+    dim = embedder.get_sentence_embedding_dimension()
+    out = np.zeros((n, dim), dtype="float32")
+    order = sorted(range(n), key=lambda i: len(texts[i]), reverse=True)
+    batches = 0
+    for start in range(0, n, batch_size):
+        idx = order[start:start + batch_size]
+        out[idx] = embedder.encode([texts[i] for i in idx], batch_size=len(idx),
+                                   normalize_embeddings=True, show_progress_bar=False)
+        batches += 1
+        if progress:
+            progress(min(start + batch_size, n), n)
+    elapsed = time.perf_counter() - started
+    report = {
+        "passages": n,
+        "batches": batches,
+        "batch_size": batch_size,
+        "embed_seconds": round(elapsed, 3),
+        "passages_per_sec": round(n / elapsed, 1) if elapsed > 0 else None,
+    }
+    return out, report
+
+
+def passage_hash(text: str) -> str:
+    """SHA-1 of the case- and whitespace-normalised text."""
+    return hashlib.sha1(" ".join((text or "").lower().split()).encode("utf-8")).hexdigest()
+
+
+def print_progress(label: str) -> ProgressFn:
+    """Progress callback that prints ``label: done/total`` lines."""
+    def report(done: int, total: int):
+        print(f"{label}: embedded {done}/{total}")
+    return report
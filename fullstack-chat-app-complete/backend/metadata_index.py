@@ -0,0 +1,177 @@
+"""
+Metadata postings for filtered retrieval.
+
+Every passage's filterable fields are indexed as ``(field, value) -> rows``
+postings, mirroring the keyword index. A filter resolves to the sorted rows
+that satisfy it before any vector is scored, so the semantic and keyword
+retrievers only ever rank allowed passages and the top-k is never wasted on
+other tenants' documents.
+
+Filters are a dict; values may be a string or a list of strings (any of):
+
+* ``user``   - uploader(s), from ``meta["user"]`` (a string or a list)
+* ``space``  - Confluence space key, from ``meta["space"]``
+* ``source`` - ``meta["source"]`` or ``meta["filename"]``
+* ``type``   - ``meta["type"]``, else the source's file extension ("pdf")
+* ``doc_id`` - the parent document the passage was chunked from
+* ``since`` / ``until`` - epoch seconds bounding when the passage was ingested
+
+Fields are ANDed together. Deleted rows are tombstoned and never match.
+
+Filters scope retrieval; they are not access control. The store is shared by
+every user, and a search without a ``user`` filter sees everyone's uploads.
+"""
+import os
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+FILTER_FIELDS = ("user", "space", "source", "type", "doc_id")
+RANGE_FIELDS = ("since", "until")
+
+
+def passage_fields(meta: Dict) -> List[Tuple[str, str]]:
+    meta = meta or {}
+    out = []
+    for field in ("user", "space", "doc_id"):
+        values = meta.get(field)
+        if values is None:
+            continue
+        for value in values if isinstance(values, list) else [values]:
+            out.append((field, str(value)))
+    source = meta.get("source") or meta.get("filename")
+    if source:
+        out.append(("source", str(source)))
+    kind = meta.get("type") or (os.path.splitext(str(source))[1].lstrip(".").lower() if source else "")
+    if kind:
+        out.append(("type", str(kind)))
+    return out
+
+
+def parse_filters(raw) -> Optional[Dict]:
+    """
+    Validate filters from a request body or query string. Raises ValueError
+    (the endpoints answer 400) unless ``raw`` is an object of known fields
+    with string / number values or lists of them; empty values are dropped.
+    """
+    if raw is None:
+        return None
+    if not isinstance(raw, dict):
+        raise ValueError(f"filters must be an object, got {type(raw).__name__}")
+    unknown = set(raw) - set(FILTER_FIELDS) - set(RANGE_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown filter field(s) {sorted(unknown)}, expected {FILTER_FIELDS + RANGE_FIELDS}")
+    out = {}
+    for field, value in raw.items():
+        if value in (None, "", []):
+            continue
+        if field in RANGE_FIELDS:
+            if isinstance(value, list) and len(value) == 1:
+                value = value[0]
+            try:
+                out[field] = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"filter {field!r} must be epoch seconds, got {value!r}")
+            continue
+        values = value if isinstance(value, list) else [value]
+        if not all(isinstance(v, (str, int, float)) and not isinstance(v, bool) for v in values):
+            raise ValueError(f"filter {field!r} must be a string or a list of strings")
+        out[field] = value
+    return out or None
+
+
+def filter_key(filters: Optional[Dict]) -> Tuple:
+    """Hashable, order-independent form of ``filters`` for cache keys."""
+    if not filters:
+        return ()
+    return tuple(sorted((k, tuple(sorted(map(str, v))) if isinstance(v, (list, tuple, set)) else v)
+                        for k, v in filters.items()))
+
+
+class MetadataIndex:
+    def __init__(self):
+        self._postings: Dict[Tuple[str, str], array] = {}
+        self._added = array("d")   # per row: ingest time (0 when unknown)
+        self._dead = array("B")    # per row: 1 once deleted
+        self.deleted = 0
+
+    def __len__(self):
+        return len(self._added)
+
+    def add(self, docs: Iterable[Dict]) -> List[int]:
+        """Index passages (``{"meta": ..., "added": ...}``) and return their rows."""
+        rows = []
+        for d in docs:
+            row = len(self._added)
+            for key in passage_fields(d.get("meta")):
+                self._postings.setdefault(key, array("I")).append(row)
+            self._added.append(float(d.get("added") or 0.0))
+            self._dead.append(0)
+            rows.append(row)
+        return rows
+
+    def delete(self, rows: Iterable[int]):
+        """Tombstone rows so no filter matches them any more."""
+        for row in rows:
+            if not self._dead[row]:
+                self._dead[row] = 1
+                self.deleted += 1
+
+    def tag(self, rows: Iterable[int], field: str, value: str):
+        """Add ``field=value`` to rows that are already indexed."""
+        postings = self._postings.setdefault((field, str(value)), array("I"))
+        present = set(postings)
+        postings.extend(r for r in rows if r not in present)
+
+    def update(self, row: int, old_meta: Dict, new_meta: Dict):
+        """Re-index a row whose meta changed (e.g. a passage gained or lost an owner)."""
+        old, new = set(passage_fields(old_meta)), set(passage_fields(new_meta))
+        for key in old - new:
+            postings = self._postings.get(key)
+            if postings is not None and row in postings:
+                postings.remove(row)
+        for key in new - old:
+            self._postings.setdefault(key, array("I")).append(row)
+
+    def copy(self) -> "MetadataIndex":
+        mi = MetadataIndex()
+        mi._postings = {key: array("I", rows) for key, rows in self._postings.items()}
+        mi._added = array("d", self._added)
+        mi._dead = array("B", self._dead)
+        mi.deleted = self.deleted
+        return mi
+
+    def rows(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        """Sorted int64 rows matching ``filters``; None when there is nothing to filter on."""
+        if not filters:
+            return None
+        unknown = set(filters) - set(FILTER_FIELDS) - set(RANGE_FIELDS)
+        if unknown:
+            raise ValueError(f"unknown filter field(s) {sorted(unknown)}, expected {FILTER_FIELDS + RANGE_FIELDS}")
+        out = None
+        for field in FILTER_FIELDS:
+            if field not in filters or filters[field] is None:
+                continue
+            wanted = filters[field]
+            if isinstance(wanted, str) or not isinstance(wanted, Iterable):
+                wanted = [wanted]
+            parts = [np.frombuffer(self._postings[(field, str(v))], dtype=np.uint32)
+                     for v in wanted if (field, str(v)) in self._postings]
+            rows = np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.uint32)
+            out = rows if out is None else np.intersect1d(out, rows, assume_unique=True)
+            if not len(out):
+                break
+        if filters.get("since") is not None or filters.get("until") is not None:
+            added = np.frombuffer(self._added, dtype=np.float64)
+            mask = np.ones(len(added), dtype=bool)
+            if filters.get("since") is not None:
+                mask &= added >= float(filters["since"])
+            if filters.get("until") is not None:
+                mask &= added < float(filters["until"])
+            rows = np.flatnonzero(mask)
+            out = rows if out is None else np.intersect1d(out, rows, assume_unique=True)
+        out = out if out is not None else np.arange(len(self._added))
+        if self.deleted:
+            out = out[np.frombuffer(self._dead, dtype=np.uint8)[out] == 0]
+        return out.astype(np.int64)
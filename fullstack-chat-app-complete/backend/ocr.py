@@ -0,0 +1,185 @@
+"""
+Bounded OCR worker pool with preprocessing and a result cache.
+
+Every ``pytesseract.image_to_string`` call forks a tesseract process, and a
+chat payload with a handful of screenshots used to start one per image with
+nothing capping how many ran at once. Images now go through a fixed-size
+process pool (``OCR_WORKERS``) that converts them to grayscale, brings them
+to ``OCR_TARGET_DPI`` and caps the longer side at ``OCR_MAX_DIM`` pixels
+before recognising them. Results are cached by the SHA-256 of the image
+bytes, so the same screenshot pasted twice, or uploaded again later, is
+only recognised once; concurrent requests for the same image share a
+single OCR run.
+"""
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Union
+
+from search_cache import LRUCache
+
+try:
+    import pytesseract
+    from PIL import Image
+except Exception:
+    pytesseract = None
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(min(4, os.cpu_count() or 1))))
+OCR_MAX_DIM = int(os.getenv("OCR_MAX_DIM", "2000"))
+OCR_TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", "300"))
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", "60"))
+OCR_CACHE_SIZE = int(os.getenv("OCR_CACHE_SIZE", "512"))
+OCR_CACHE_TTL = float(os.getenv("OCR_CACHE_TTL", "86400"))
+
+
+def preprocess(img, max_dim: int = OCR_MAX_DIM, target_dpi: int = OCR_TARGET_DPI):
+    """Grayscale, rescale to ``target_dpi`` when the image says what it was scanned at, cap the longer side."""
+    img = img.convert("L")
+    scale = 1.0
+    dpi = img.info.get("dpi")
+    if dpi and target_dpi and dpi[0] and dpi[0] > 1:
+        scale = target_dpi / float(dpi[0])
+    longest = max(img.size) * scale
+    if max_dim and longest > max_dim:
+        scale *= max_dim / longest
+    if abs(scale - 1.0) > 0.01:
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img = img.resize(size, Image.LANCZOS)
+    return img
+
+
+def _recognise(data: bytes, max_dim: int, target_dpi: int, lang: str, timeout: float) -> str:
+    # Runs in a pool worker: decode, preprocess and OCR one image.
+    img = preprocess(Image.open(io.BytesIO(data)), max_dim, target_dpi)
+    return pytesseract.image_to_string(img, lang=lang, timeout=timeout)
+
+
+class OcrPool:
+    def __init__(self, workers: int = OCR_WORKERS, max_dim: int = OCR_MAX_DIM, target_dpi: int = OCR_TARGET_DPI,
+                 lang: str = OCR_LANG, cache_size: int = OCR_CACHE_SIZE, cache_ttl: float = OCR_CACHE_TTL):
+        self.workers = max(workers, 1)
+        self.max_dim = max_dim
+        self.target_dpi = target_dpi
+        self.lang = lang
+        self.cache = LRUCache(max_entries=cache_size, ttl_seconds=cache_ttl)
+        self._pool = None
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self.recognised = 0
+        self.shared = 0
+        self.errors = 0
+        self.ocr_seconds = 0.0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # Created on first use; "spawn" keeps workers from inheriting the server's threads and FAISS state.
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def submit(self, image: Union[str, bytes]) -> "Future[Dict]":
+        """
+        Start OCR of ``image`` (a path or raw bytes) and return a future of
+        ``{"text", "sha256", "cached", "seconds"}``.
+        """
+        started = time.perf_counter()
+        if pytesseract is None:
+            raise RuntimeError("pytesseract is not installed")
+        if isinstance(image, (str, os.PathLike)):
+            with open(image, "rb") as f:
+                data = f.read()
+        else:
+            data = bytes(image)
+        digest = hashlib.sha256(data).hexdigest()
+        key = (digest, self.max_dim, self.target_dpi, self.lang)
+        out: "Future[Dict]" = Future()
+        text = self.cache.get(key)
+        if text is not None:
+            out.set_result({"text": text, "sha256": digest, "cached": True,
+                            "seconds": round(time.perf_counter() - started, 4)})
+            return out
+        pool = self._executor()
+        with self._lock:
+            fut = self._inflight.get(digest)
+            fresh = fut is None
+            if fresh:
+                try:
+                    fut = pool.submit(_recognise, data, self.max_dim, self.target_dpi, self.lang, OCR_TIMEOUT)
+                except BrokenProcessPool:
+                    self._pool = None
+                    raise
+                self._inflight[digest] = fut
+            else:
+                self.shared += 1
+        if fresh:
+            fut.add_done_callback(lambda f: self._finished(key, f, started))
+
+        def resolve(f: Future):
+            try:
+                text = f.result()
+            except BaseException as e:
+                out.set_exception(e)
+                return
+            out.set_result({"text": text, "sha256": digest, "cached": False,
+                            "seconds": round(time.perf_counter() - started, 4)})
+        fut.add_done_callback(resolve)
+        return out
+
+    def _finished(self, key, fut: Future, started: float):
+        # Cache before leaving the in-flight table so a concurrent submit() sees one or the other.
+        failed = fut.cancelled() or fut.exception() is not None
+        if not failed:
+            self.cache.put(key, fut.result())
+        with self._lock:
+            self._inflight.pop(key[0], None)
+            self.ocr_seconds += time.perf_counter() - started
+            if failed:
+                self.errors += 1
+                # A worker died (OOM on a huge image, killed tesseract): start a fresh pool next time.
+                if not fut.cancelled() and isinstance(fut.exception(), BrokenProcessPool):
+                    self._pool = None
+            else:
+                self.recognised += 1
+
+    def ocr(self, image: Union[str, bytes], timeout: Optional[float] = None) -> Dict:
+        return self.submit(image).result(timeout=timeout)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_dim": self.max_dim,
+                "target_dpi": self.target_dpi,
+                "recognised": self.recognised,
+                "shared_inflight": self.shared,
+                "errors": self.errors,
+                "inflight": len(self._inflight),
+                "avg_seconds": round(self.ocr_seconds / self.recognised, 4) if self.recognised else None,
+                "cache": self.cache.stats(),
+            }
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_pool() -> OcrPool:
+    """Process-wide pool shared by every ImageAgent."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = OcrPool()
+        return _default
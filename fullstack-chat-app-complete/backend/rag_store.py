@@ -1,12 +1,103 @@
 import os
 import json
+import time
+import threading
 import faiss
 import numpy as np
 from pathlib import Path
-from typing import List, Tuple
+from typing import Iterable, List, Tuple
 from sentence_transformers import SentenceTransformer
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from snapshot import oldest_generation, read_snapshot, write_snapshot, SnapshotError
+from chunking import chunk_document
+from keyword_index import KeywordIndex
+from ingest import embed_texts, passage_hash, EMBED_BATCH_SIZE, NEAR_DUP_THRESHOLD
+from wal import WriteAheadLog
+from rwlock import ReadWriteLock
+from embedding_service import EmbeddingBatcher
+from search_cache import LRUCache, normalize_query
+from fusion import fuse, DEFAULT_FUSION
+from vector_index import (build_index, backend_of, choose_backend, configure,
+                          allow, deny, remove as vector_remove, search as vector_search)
+from metadata_index import MetadataIndex, filter_key
+
+WAL_COMPACT_BYTES = int(os.getenv("RAG_WAL_COMPACT_BYTES", str(64 * 1024 * 1024)))
+# Filters matching at most this many passages are scored exactly, not through the ANN index
+FILTER_EXACT_MAX = int(os.getenv("RAG_FILTER_EXACT_MAX", "4096"))
+# Deleted passages stay as tombstones until they are this share of all rows,
+# then a background compaction reclaims them
+TOMBSTONE_RATIO = float(os.getenv("RAG_TOMBSTONE_RATIO", "0.2"))
+
+
+def _with_value(meta, field, value):
+    # meta[field] becomes a list once a second value is tagged onto it
+    current = meta.get(field)
+    values = current if isinstance(current, list) else ([] if current is None else [current])
+    return meta if value in values else {**meta, field: values + [value]}
+
+
+# Fields naming the document a passage came from. Text found in several
+# documents is stored once, and each of them is listed in meta["owners"].
+OWNER_FIELDS = ("doc_id", "user", "space")
+
+
+def _values(v):
+    return v if isinstance(v, list) else ([] if v is None else [v])
+
+
+def _owners(meta):
+    return meta.get("owners") or [{f: meta[f] for f in OWNER_FIELDS if meta.get(f) is not None}]
+
+
+def _with_owners(meta, owners):
+    # Owner fields become the union over owners; one owner collapses back to plain fields
+    out = {k: v for k, v in meta.items() if k not in OWNER_FIELDS and k != "owners"}
+    merged = {}
+    for owner in owners:
+        for field in OWNER_FIELDS:
+            for value in _values(owner.get(field)):
+                if value not in merged.setdefault(field, []):
+                    merged[field].append(value)
+    out.update({f: vs[0] if len(vs) == 1 else vs for f, vs in merged.items()})
+    if len(owners) > 1:
+        out["owners"] = owners
+    return out
+
+
+def _share(meta, owners):
+    """
+    meta with owners added, or None when it lists all of them already. An owner whose
+    document already owns the passage adds its user / space to that document (the
+    same file uploaded again by someone else).
+    """
+    current = _owners(meta)
+    merged = list(current)
+    for owner in owners:
+        n = next((n for n, o in enumerate(merged) if o.get("doc_id") == owner.get("doc_id")), None)
+        if n is None:
+            merged.append(owner)
+            continue
+        for field in OWNER_FIELDS:
+            for value in _values(owner.get(field)):
+                merged[n] = _with_value(merged[n], field, value)
+    return None if merged == current else _with_owners(meta, merged)
+
+
+def _owned(meta, owners):
+    docs = {o.get("doc_id") for o in _owners(meta)}
+    return all(o.get("doc_id") in docs for o in owners)
+
+
+def _unshare(meta, doc_ids):
+    """meta without the owners in doc_ids, or None when no owner is left."""
+    owners = [o for o in _owners(meta) if o.get("doc_id") is None or str(o["doc_id"]) not in doc_ids]
+    return _with_owners(meta, owners) if owners else None
+
+
+def _tagged(meta, doc_id, field, value):
+    if "owners" not in meta or field not in OWNER_FIELDS:
+        return _with_value(meta, field, value)
+    return _with_owners(meta, [_with_value(o, field, value) if o.get("doc_id") == doc_id else o
+                               for o in meta["owners"]])
 
 
 class RAGStore:
@@ -14,160 +105,739 @@ class RAGStore:
     RAG store with hybrid (semantic + keyword) search and FAISS index for speed.
     """
 
-    def __init__(self, storage_dir="rag_data"):
+    def __init__(self, storage_dir="rag_data", emb_model="all-MiniLM-L6-v2"):
         self.storage_dir = Path(storage_dir)
         self.storage_dir.mkdir(parents=True, exist_ok=True)
 
-        # In-memory data
+        # In-memory data. Every passage carries a stable integer "id";
+        # _row_of maps it to the passage's row in documents / FAISS / BM25.
         self.documents: List[dict] = []
+        self._row_of = {}
+        self._hash_ids = {}   # passage_hash -> id, so repeated passages are skipped
+        self._next_id = 0
+        self.generation = 0
 
         # Sentence embedding model
-        self.embedder = SentenceTransformer("all-MiniLM-L6-v2")
+        self.emb_model = emb_model
+        self.embedder = SentenceTransformer(emb_model)
         self.embedding_dim = self.embedder.get_sentence_embedding_dimension()
 
-        # TF-IDF model for keyword matching
-        self.tfidf_vectorizer = TfidfVectorizer(stop_words="english")
-        self.tfidf_matrix = None
+        # Query embeddings from concurrent requests are encoded together
+        self.query_encoder = EmbeddingBatcher(self.embedder)
+
+        # Query embedding / result caches; results are keyed to the corpus
+        # version, which every ingest bumps, so stale entries are misses
+        self.corpus_version = 0
+        self.embedding_cache = LRUCache()
+        self.result_cache = LRUCache()
+
+        # Incremental BM25 index for keyword matching
+        self.keyword = KeywordIndex()
 
-        # FAISS index
-        self.index = faiss.IndexFlatIP(self.embedding_dim)  # Inner Product (cosine)
+        # user / space / source / type postings for filtered retrieval
+        self.metadata = MetadataIndex()
+
+        # FAISS index keyed by passage id: flat (exact) for small corpora,
+        # swapped for an ANN backend past RAG_ANN_THRESHOLD (see vector_index.py)
         self.embeddings = np.zeros((0, self.embedding_dim), dtype="float32")
+        self.ids = np.zeros(0, dtype="int64")   # passage id per row
+        self.index = build_index("flat", self.embedding_dim, self.embeddings, self.ids)
+        self.index_backend = "flat"
+        self._index_trained_on = 0
+        self._index_rebuilding = False
+
+        # Deleted passages keep their rows until compaction: their ids, and the
+        # FAISS selector that keeps them out of unfiltered searches
+        self._tombstones = set()
+        self._deny = None
+        self._reclaiming = False
+        self._retagged = set()   # ids whose meta changed while a reclaim was building its copy
+
+        # Persistence: appends go to the log, compaction writes snapshots
+        self.wal = WriteAheadLog(self.storage_dir, emb_model, self.embedding_dim)
+        self._lock = threading.RLock()   # serialises writers (ingest, compaction)
+        self._rw = ReadWriteLock()       # searches vs. in-place index updates
+        self._compacting = False
+
+        self._load()
 
     # -----------------------------------------------------------
-    # Add documents
+    # Add documents (bulk ingestion)
     # -----------------------------------------------------------
-    def add_documents(self, docs: List[Tuple[str, dict]]):
-        new_texts, new_embs = [], []
-
+    def ingest(self, docs: Iterable[Tuple[str, dict]], batch_size=EMBED_BATCH_SIZE, progress=None, replace=()):
+        """
+        Bulk-index (text, meta) passages: one batched embedding pass, one
+        write-ahead log append and one keyword-index append. Returns a throughput report.
+        Passages are deduplicated per document: text the same document already has
+        indexed (verbatim, or cosine >= RAG_NEAR_DUP_THRESHOLD) is dropped and counted
+        as "duplicates", though a new user / space on it is still added. Text indexed for another document is not embedded or stored
+        again; the existing passage gets this document's doc_id / user / space as
+        another owner ("shared"), so filters on either document find it and deleting
+        one keeps it for the other.
+        replace lists doc_ids this batch is the new version of: their current passages
+        are deleted in the same write, and unchanged passages keep their stored vector.
+        """
+        started = time.perf_counter()
+        now = time.time()
+        replace = sorted(set(replace))
+
+        # Text repeated within the batch is stored once, with every document as an owner
+        passages, first = [], {}
+        duplicates = shared = 0
         for text, meta in docs:
-            if not text.strip():
+            if not (text and text.strip()):
                 continue
-            emb = self.embedder.encode(text, normalize_embeddings=True)
-            self.documents.append({"text": text, "meta": meta})
-            new_texts.append(text)
-            new_embs.append(emb)
-
-        if not new_embs:
-            return
-
-        new_embs = np.array(new_embs, dtype="float32")
+            d = {"text": text, "meta": meta or {}, "added": now, "hash": passage_hash(text)}
+            if d["hash"] not in first:
+                first[d["hash"]] = d
+                passages.append(d)
+                continue
+            f, owners = first[d["hash"]], _owners(d["meta"])
+            if _owned(f["meta"], owners):
+                duplicates += 1
+            else:
+                shared += 1
+            f["meta"] = _share(f["meta"], owners) or f["meta"]
+
+        # Vectors of the passages being replaced, by text hash
+        reuse = {}
+        if replace:
+            with self._rw.read():
+                for row in self.metadata.rows({"doc_id": replace}):
+                    reuse.setdefault(self.documents[row]["hash"], self.embeddings[row])
+
+        # Text already indexed never reaches the embedder: it is dropped or shared below
+        reused = np.array([d["hash"] in reuse for d in passages], dtype=bool)
+        known = np.array([d["hash"] in self._hash_ids for d in passages], dtype=bool) & ~reused
+        todo = np.flatnonzero(~reused & ~known)
+        embedded, report = embed_texts(self.embedder, [passages[i]["text"] for i in todo], batch_size, progress)
+        new_embs = np.zeros((len(passages), self.embedding_dim), dtype="float32")
+        for i in np.flatnonzero(reused):
+            new_embs[i] = reuse[passages[i]["hash"]]
+        if len(todo):
+            new_embs[todo] = embedded
+
+        replaced = 0
+        if passages or replace:
+            with self._lock:
+                if replace:
+                    replaced = self._drop_documents(replace)
+                # Indexed passage each new one repeats verbatim, else -1
+                match = np.array([self._hash_ids.get(d["hash"], -1) for d in passages], dtype="int64")
+                # Passages deleted since the check above need their vector after all
+                late = np.flatnonzero(known & (match < 0))
+                if len(late):
+                    new_embs[late], _ = embed_texts(self.embedder, [passages[i]["text"] for i in late])
+                # Reused vectors were accepted before; only new ones are checked for near-duplicates
+                check = np.flatnonzero((match < 0) & ~reused)
+                match[check] = self._near_duplicates(new_embs[check])
+
+                changes = {}
+                for i in np.flatnonzero(match >= 0):
+                    row = self._row_of[int(match[i])]
+                    current, owners = changes.get(row, self.documents[row]["meta"]), _owners(passages[i]["meta"])
+                    if _owned(current, owners):
+                        duplicates += 1
+                    else:
+                        shared += 1
+                    # A duplicate still records a new uploader of its document
+                    meta = _share(current, owners)
+                    if meta is not None:
+                        changes[row] = meta
+                if changes:
+                    self._set_meta(changes)
+
+                keep = match < 0
+                passages = [d for d, k in zip(passages, keep) if k]
+                new_embs = new_embs[keep]
+                for d in passages:
+                    d["id"] = self._next_id
+                    self._next_id += 1
+                if passages:
+                    # Log first so a crash after this point is recovered on replay
+                    self.wal.append([({"op": "add", "doc": d}, vec) for d, vec in zip(passages, new_embs)])
+                    self._apply(passages, new_embs)
+            self._maybe_compact()
+            self._maybe_rebuild_index()
+            self._maybe_reclaim()
+
+        report["duplicates"] = duplicates
+        report["shared"] = shared
+        report["indexed"] = len(passages)
+        report["reused"] = int(reused.sum())
+        report["replaced"] = replaced
+        report["total_seconds"] = round(time.perf_counter() - started, 3)
+        return report
+
+    def _near_duplicates(self, new_embs):
+        # Id of the indexed passage each vector nearly repeats, else -1.
+        # Runs under self._lock so no writer interleaves
+        out = np.full(len(new_embs), -1, dtype="int64")
+        if NEAR_DUP_THRESHOLD <= 0 or not self.index.ntotal or not len(new_embs):
+            return out
+        scores, ids = vector_search(self.index, new_embs, 1, self._deny)
+        near = (scores[:, 0] >= NEAR_DUP_THRESHOLD) & (ids[:, 0] >= 0)
+        out[near] = ids[near, 0]
+        return out
+
+    def _set_meta(self, changes):
+        # Caller holds self._lock. Logged as the passage's whole new meta, keyed by id
+        self.wal.append([({"op": "meta", "id": int(self.ids[row]), "meta": meta}, None)
+                         for row, meta in changes.items()])
+        self._apply_meta(changes)
+
+    def _apply_meta(self, changes):
+        with self._rw.write():
+            for row, meta in changes.items():
+                d = self.documents[row]
+                self.metadata.update(row, d["meta"], meta)
+                d["meta"] = meta
+                if self._reclaiming:
+                    self._retagged.add(d["id"])
+            self.corpus_version += 1
+
+    def _apply(self, docs: List[dict], new_embs: np.ndarray):
+        # FAISS and the keyword index reallocate while growing: no search may overlap
+        with self._rw.write():
+            self._register(docs, len(self.documents))
+            self.documents.extend(docs)
+
+            # Add to FAISS index under the passage ids
+            ids = np.array([d["id"] for d in docs], dtype="int64")
+            self.index.add_with_ids(new_embs, ids)
+            self.ids = np.concatenate([self.ids, ids])
+
+            # Update stored embeddings
+            if self.embeddings.shape[0] == 0:
+                self.embeddings = new_embs
+            else:
+                self.embeddings = np.vstack([self.embeddings, new_embs])
+
+            # Append to the keyword index (no refit over the corpus)
+            self.keyword.add(d["text"] for d in docs)
+            self.metadata.add(docs)
+
+            self.corpus_version += 1
+
+    def ingest_documents(self, items: Iterable[Tuple[str, object, dict]], batch_size=EMBED_BATCH_SIZE, progress=None,
+                         replace=False):
+        """
+        Chunk (doc_id, pages, meta) documents and ingest all their passages in one pass.
+        With replace=True each item supersedes whatever is indexed under its doc_id.
+        """
+        items = list(items)
+        chunks = [c for doc_id, pages, meta in items for c in chunk_document(doc_id, pages, meta)]
+        report = self.ingest(chunks, batch_size, progress, replace=[doc_id for doc_id, _, _ in items] if replace else ())
+        report["documents"] = len(items)
+        return report
 
-        # Add to FAISS index
-        self.index.add(new_embs)
+    def add_documents(self, docs: List[Tuple[str, dict]]):
+        self.ingest(docs)
+
+    def add_document(self, doc_id: str, pages, meta: dict):
+        """
+        Chunk one document into passages and index them.
+        `pages` is the whole text or one string per page; returns the number of passages.
+        """
+        return self.ingest_documents([(doc_id, pages, meta)])["indexed"]
+
+    def document_passages(self, doc_id: str):
+        with self._rw.read():
+            return len(self.metadata.rows({"doc_id": doc_id}))
+
+    def tag_document(self, doc_id: str, field: str, value):
+        """
+        Add field=value (e.g. another uploader) to every passage of doc_id
+        without re-indexing it. Returns the number of passages tagged.
+        """
+        with self._lock:
+            rows = self.metadata.rows({"doc_id": doc_id})
+            if len(rows):
+                self.wal.append([({"op": "tag", "doc_id": doc_id, "field": field, "value": value}, None)])
+                self._apply_meta({row: _tagged(self.documents[row]["meta"], doc_id, field, value)
+                                  for row in rows.tolist()})
+        return len(rows)
 
-        # Update stored embeddings
-        if self.embeddings.shape[0] == 0:
-            self.embeddings = new_embs
+    # -----------------------------------------------------------
+    # Update / delete: tombstones, reclaimed by compaction
+    # -----------------------------------------------------------
+    def upsert(self, doc_id: str, pages, meta: dict):
+        """
+        Index a new version of doc_id: its old passages are deleted and the new
+        ones added in one write, re-embedding only passages whose text changed.
+        Returns the ingest report.
+        """
+        return self.ingest_documents([(doc_id, pages, meta)], replace=True)
+
+    def delete(self, doc_id: str):
+        """Delete every passage of doc_id; returns how many there were."""
+        return self.delete_documents([doc_id])
+
+    def delete_documents(self, doc_ids: Iterable[str]):
+        """
+        Delete every passage of the given documents. They are tombstoned, so
+        they leave search results at once; their rows are reclaimed by a
+        background compaction once tombstones reach RAG_TOMBSTONE_RATIO of the
+        store. Passages another document shares are kept for that document.
+        Returns the number of passages removed from these documents.
+        """
+        doc_ids = sorted(set(doc_ids))
+        if not doc_ids:
+            return 0
+        with self._lock:
+            removed = self._drop_documents(doc_ids)
+        self._maybe_reclaim()
+        return removed
+
+    def _drop_documents(self, doc_ids):
+        # Caller holds self._lock. Passages other documents still own only lose these owners
+        rows = self.metadata.rows({"doc_id": doc_ids})
+        wanted = {str(i) for i in doc_ids}
+        dead, changes = [], {}
+        for row in rows.tolist():
+            meta = _unshare(self.documents[row]["meta"], wanted)
+            if meta is None:
+                dead.append(row)
+            else:
+                changes[row] = meta
+        if changes:
+            self._set_meta(changes)
+        if dead:
+            self._delete_rows(np.array(dead, dtype="int64"))
+        return len(rows)
+
+    def _delete_rows(self, rows):
+        # Caller holds self._lock. Logged by passage id, which is never reused
+        self.wal.append([({"op": "delete", "ids": self.ids[rows].tolist()}, None)])
+        self._tombstone(rows)
+
+    def _tombstone(self, rows):
+        with self._rw.write():
+            self._mark_dead(rows)
+            self.corpus_version += 1
+
+    def _mark_dead(self, rows):
+        # Caller holds self._rw for writing
+        for row in rows:
+            d = self.documents[row]
+            self._tombstones.add(d["id"])
+            if self._hash_ids.get(d["hash"]) == d["id"]:
+                del self._hash_ids[d["hash"]]
+        self.keyword.delete(rows)
+        self.metadata.delete(rows)
+        self._deny = deny(np.fromiter(self._tombstones, dtype="int64")) if self._tombstones else None
+
+    def _maybe_reclaim(self):
+        if TOMBSTONE_RATIO > 0 and self._tombstones and len(self._tombstones) >= TOMBSTONE_RATIO * len(self.documents):
+            self.reclaim(background=True)
+
+    def reclaim(self, background=False):
+        """
+        Compact tombstoned passages out of the documents, embeddings, FAISS,
+        keyword and metadata indexes. The compacted copies are built outside
+        the locks (FAISS drops the vectors in place where the backend can,
+        otherwise it is rebuilt); passages added or deleted meanwhile are
+        carried over just before the swap, and a snapshot follows.
+        """
+        with self._lock:
+            if self._reclaiming or self._index_rebuilding or not self._tombstones:
+                return
+            self._reclaiming = True
+            n = len(self.documents)
+            documents, embeddings, ids = self.documents[:], self.embeddings, self.ids
+            metas = [d["meta"] for d in documents]
+            self._retagged = set()
+            dead = set(self._tombstones)
+            index = faiss.clone_index(self.index)
+            keyword = self.keyword.copy()
+
+        def run():
+            try:
+                started = time.perf_counter()
+                keep = np.array([d["id"] not in dead for d in documents], dtype=bool)
+                docs = [d for d, k in zip(documents, keep) if k]
+                embs, kept_ids = embeddings[keep], ids[keep]
+                rebuilt = not vector_remove(index, ids[~keep])
+                new_index = self._build_index(embs, kept_ids) if rebuilt else index
+                base = len(docs)
+                keyword_index = keyword.compact()
+                metadata = MetadataIndex()
+                metadata.add({"meta": m, "added": d.get("added")} for d, m, k in zip(documents, metas, keep) if k)
+                row_of = {d["id"]: row for row, d in enumerate(docs)}
+                hash_ids = {d["hash"]: d["id"] for d in docs}
+
+                with self._lock, self._rw.write():
+                    # Passages shared, released or tagged since the copy was taken
+                    for i in self._retagged:
+                        if i in row_of:
+                            metadata.update(row_of[i], metas[self._row_of[i]], docs[row_of[i]]["meta"])
+                    # Passages ingested since the copy was taken
+                    extra = self.documents[n:]
+                    if extra:
+                        new_index.add_with_ids(self.embeddings[n:], self.ids[n:])
+                        keyword_index.add(d["text"] for d in extra)
+                        metadata.add(extra)
+                        docs = docs + extra
+                        embs = np.vstack([embs, self.embeddings[n:]])
+                        kept_ids = np.concatenate([kept_ids, self.ids[n:]])
+                    later = self._tombstones - dead
+                    self.documents, self.embeddings, self.ids = docs, embs, kept_ids
+                    self._set_index(new_index, base if rebuilt else self._index_trained_on)
+                    self.keyword, self.metadata = keyword_index, metadata
+                    self._row_of, self._hash_ids = row_of, hash_ids
+                    self._register(extra, base)
+                    # ...and passages deleted since
+                    self._tombstones = set()
+                    self._mark_dead([self._row_of[i] for i in later])
+                    self.corpus_version += 1
+                print(f"RAG compaction reclaimed {len(dead)} deleted passages "
+                      f"in {time.perf_counter() - started:.1f}s")
+            except Exception as e:
+                print("RAG compaction failed, keeping tombstones:", e)
+                return
+            finally:
+                self._reclaiming = False
+            self.compact(background=True)
+            self._maybe_rebuild_index()
+
+        if background:
+            threading.Thread(target=run, name="rag-reclaim", daemon=True).start()
         else:
-            self.embeddings = np.vstack([self.embeddings, new_embs])
-
-        # Update TF-IDF
-        self.tfidf_matrix = self.tfidf_vectorizer.fit_transform([d["text"] for d in self.documents])
-
-        self._save()
+            run()
 
     # -----------------------------------------------------------
     # Semantic search (via FAISS)
     # -----------------------------------------------------------
-    def semantic_search(self, query: str, k=5):
+    # The underscored helpers expect the caller to hold self._rw for reading.
+    # Retrievers return (doc_id, score) candidates; _hydrate maps ids back to passages.
+    def _embed_query(self, query: str):
+        key = normalize_query(query)
+        emb = self.embedding_cache.get(key)
+        if emb is None:
+            emb = self.query_encoder.encode(query).reshape(1, -1)
+            self.embedding_cache.put(key, emb)
+        return emb
+
+    # `rows` (from self.metadata) restricts the retrievers to passages a filter allows.
+    def _semantic(self, q_emb, k, rows=None):
+        if rows is not None and len(rows) <= FILTER_EXACT_MAX:
+            # A small partition (one user's uploads, one space) is cheaper to
+            # score exactly than to search for in the whole index
+            sims = self.embeddings[rows] @ q_emb[0]
+            top = np.argsort(-sims, kind="stable")[:k]
+            return [(int(self.ids[rows[i]]), float(sims[i])) for i in top]
+
+        # FAISS returns passage ids; tombstones are kept out by the selector
+        sel = allow(self.ids[rows]) if rows is not None else self._deny
+        scores, ids = vector_search(self.index, q_emb, k, sel)
+        # FAISS pads with -1 when k exceeds the number of vectors
+        return [(int(i), float(score)) for i, score in zip(ids[0], scores[0]) if i >= 0]
+
+    def _hydrate(self, hits, method):
+        return [
+            {**self.documents[self._row_of[doc_id]], "score": float(score), "method": method}
+            for doc_id, score in hits
+        ]
+
+    def semantic_search(self, query: str, k=5, filters=None):
         if len(self.documents) == 0:
             return []
 
-        q_emb = self.embedder.encode(query, normalize_embeddings=True).astype("float32").reshape(1, -1)
-        scores, indices = self.index.search(q_emb, k)
-        results = []
-
-        for idx, score in zip(indices[0], scores[0]):
-            if idx < len(self.documents):
-                results.append({
-                    **self.documents[idx],
-                    "score": float(score),
-                    "method": "semantic"
-                })
-
-        return results
+        q_emb = self._embed_query(query)
+        with self._rw.read():
+            return self._hydrate(self._semantic(q_emb, k, self.metadata.rows(filters)), "semantic")
 
     # -----------------------------------------------------------
-    # Keyword (TF-IDF) search
+    # Keyword (BM25) search
     # -----------------------------------------------------------
-    def keyword_search(self, query: str, k=5):
-        if self.tfidf_matrix is None or not self.documents:
-            return []
-
-        q_vec = self.tfidf_vectorizer.transform([query])
-        sims = cosine_similarity(q_vec, self.tfidf_matrix).flatten()
-        top_idx = sims.argsort()[-k:][::-1]
+    def _keyword(self, query: str, k, rows=None):
+        return [(self.documents[row]["id"], score) for row, score in self.keyword.search(query, k, rows)]
 
-        return [
-            {**self.documents[i], "score": float(sims[i]), "method": "keyword"}
-            for i in top_idx
-        ]
+    def keyword_search(self, query: str, k=5, filters=None):
+        with self._rw.read():
+            return self._hydrate(self._keyword(query, k, self.metadata.rows(filters)), "keyword")
 
     # -----------------------------------------------------------
-    # Hybrid search: semantic + keyword weighted merge
+    # Hybrid search: semantic + keyword fused by passage id
     # -----------------------------------------------------------
-    def search(self, query: str, k=5, alpha=0.7):
+    def search(self, query: str, k=5, alpha=0.7, fusion=DEFAULT_FUSION, filters=None):
+        """
+        fusion="weighted" blends min-max normalised scores (alpha weights the
+        semantic side); fusion="rrf" uses reciprocal rank fusion.
+        filters, e.g. {"space": ["ENG", "OPS"], "type": "pdf"}, restrict both
+        retrievers before ranking (see metadata_index.py).
+        """
         if not self.documents:
             return []
 
-        semantic_results = self.semantic_search(query, k * 2)
-        keyword_results = self.keyword_search(query, k * 2)
-
-        combined_scores = {}
-
-        def add_score(item, weight):
-            meta_id = item["meta"].get("path") or item["meta"].get("filename")
-            combined_scores[meta_id] = combined_scores.get(meta_id, 0) + weight * item["score"]
+        cache_key = (normalize_query(query), k, alpha, fusion, filter_key(filters))
+        cached = self.result_cache.get(cache_key, self.corpus_version)
+        if cached is not None:
+            return [dict(r) for r in cached]
 
-        for r in semantic_results:
-            add_score(r, alpha)
-        for r in keyword_results:
-            add_score(r, 1 - alpha)
-
-        top_sorted = sorted(combined_scores.items(), key=lambda x: x[1], reverse=True)[:k]
-        results = []
-        for meta_id, score in top_sorted:
-            for d in self.documents:
-                if d["meta"].get("path") == meta_id or d["meta"].get("filename") == meta_id:
-                    results.append({**d, "score": float(score), "method": "hybrid"})
-                    break
+        q_emb = self._embed_query(query)
+        with self._rw.read():
+            version = self.corpus_version
+            rows = self.metadata.rows(filters)
+            semantic_results = self._semantic(q_emb, k * 2, rows)
+            keyword_results = self._keyword(query, k * 2, rows)
+            results = self._hydrate(fuse(semantic_results, keyword_results, k, alpha, fusion), "hybrid")
 
+        self.result_cache.put(cache_key, [dict(r) for r in results], version)
         return results
 
+    def cache_stats(self):
+        return {
+            "corpus_version": self.corpus_version,
+            "embeddings": self.embedding_cache.stats(),
+            "results": self.result_cache.stats(),
+        }
+
     # -----------------------------------------------------------
-    # Persistence for metadata + FAISS index
+    # Persistence: snapshot + write-ahead log
     # -----------------------------------------------------------
-    def _save(self):
-        data = [{"text": d["text"], "meta": d["meta"]} for d in self.documents]
-        with open(self.storage_dir / "rag_store.json", "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
+    def compact(self, background=False):
+        """
+        Fold the write-ahead log into a new snapshot.
+        State is captured and the log rotated under the lock; the snapshot is
+        written outside it, so ingestion only waits for the in-memory copy.
+        """
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+            self.generation += 1
+            gen = self.generation
+            documents = list(self.documents)
+            embeddings = self.embeddings
+            index = faiss.clone_index(self.index)
+            keyword = self.keyword.copy()
+            deleted = sorted(self._tombstones)
+            self.wal.rotate(gen)
+
+        def run():
+            try:
+                write_snapshot(self.storage_dir, gen, self.emb_model, self.embedding_dim,
+                               documents, embeddings, index=index, keyword=keyword, deleted=deleted)
+                # Keep the log back to the oldest kept snapshot, the one a damaged
+                # newest snapshot falls back to.
+                self.wal.drop_before(oldest_generation(self.storage_dir) or gen)
+            except Exception as e:
+                print("RAG compaction failed, keeping write-ahead log:", e)
+            finally:
+                self._compacting = False
+
+        if background:
+            threading.Thread(target=run, name="rag-compaction", daemon=True).start()
+        else:
+            run()
 
-        faiss.write_index(self.index, str(self.storage_dir / "faiss.index"))
+    def _maybe_compact(self):
+        if self.wal.size() >= WAL_COMPACT_BYTES:
+            self.compact(background=True)
 
     def _load(self):
-        json_path = self.storage_dir / "rag_store.json"
-        faiss_path = self.storage_dir / "faiss.index"
-
-        if not json_path.exists():
+        """
+        Restore the store without running the embedder: load the newest
+        snapshot (or the pre-snapshot rag_store.json), then replay the
+        write-ahead log on top. Only re-embeds when the vectors came from
+        another model, are damaged, or the store predates snapshots.
+        """
+        try:
+            snap = read_snapshot(self.storage_dir, self.emb_model, self.embedding_dim)
+        except SnapshotError as e:
+            print("RAG snapshot unreadable, rebuilding from legacy store:", e)
+            snap = None
+
+        reembed = False
+        if snap is None:
+            self.documents = self._read_legacy()
+            reembed = bool(self.documents)
+        else:
+            self.documents = snap["documents"]
+            self.generation = snap["manifest"]["generation"]
+            if snap["embeddings"] is None:
+                print("RAG snapshot built with another embedding model, re-embedding")
+                reembed = True
+            else:
+                self._register(self.documents, 0)
+                self.embeddings = snap["embeddings"]
+                self.ids = np.array([d["id"] for d in self.documents], dtype="int64")
+                # No index comes back from an older snapshot format: build one under passage ids
+                if snap["index"] is None:
+                    self._set_index(self._build_index(self.embeddings, self.ids), len(self.embeddings))
+                else:
+                    self._set_index(configure(snap["index"]), len(self.embeddings))
+                self.keyword = snap["keyword"]
+                if self.keyword is None:
+                    self.keyword = KeywordIndex()
+                    self.keyword.add(d["text"] for d in self.documents)
+
+        records = self.wal.replay(self.generation)
+        # Deletes name passage ids, which are never reused, so their position in
+        # the log does not matter. Older logs named whole documents instead:
+        # those drop the document's passages added before them, snapshot included.
+        replayed = []
+        deleted = set(snap["deleted"]) if snap else set()
+        for h, vec in records:
+            if h.get("op") == "add":
+                replayed.append((h["doc"], vec))
+            elif h.get("op") == "delete" and "ids" in h:
+                deleted.update(h["ids"])
+            elif h.get("op") == "delete":
+                gone = set(h["doc_ids"])
+                deleted.update(d.get("id") for d in self.documents + [doc for doc, _ in replayed]
+                               if gone.intersection(_values((d.get("meta") or {}).get("doc_id"))))
+
+        # A passage shared with or released by a document was logged with its whole new meta
+        metas = [h for h, _ in records if h.get("op") == "meta"]
+        if metas:
+            by_id = {d.get("id"): d for d in self.documents + [doc for doc, _ in replayed]}
+            for h in metas:
+                if h["id"] in by_id:
+                    by_id[h["id"]]["meta"] = h["meta"]
+
+        # Tags only ever add a value, so fold them into the passages before indexing metadata
+        tags = {}
+        for h, _ in records:
+            if h.get("op") == "tag":
+                tags.setdefault(h["doc_id"], []).append((h["field"], h["value"]))
+        if tags:
+            for d in self.documents + [doc for doc, _ in replayed]:
+                for doc_id in _values((d.get("meta") or {}).get("doc_id")):
+                    for field, value in tags.get(doc_id, ()):
+                        d["meta"] = _tagged(d["meta"], doc_id, field, value)
+
+        if reembed:
+            self.documents.extend(doc for doc, _ in replayed)
+            self.documents = [d for d in self.documents if d.get("id") not in deleted]
+            self._rebuild()
             return
 
-        with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        self.metadata.add(self.documents)
+        if replayed:
+            docs = [doc for doc, _ in replayed]
+            new_embs = np.zeros((len(docs), self.embedding_dim), dtype="float32")
+            missing = []
+            for i, (_, vec) in enumerate(replayed):
+                if vec is None:
+                    missing.append(i)
+                else:
+                    new_embs[i] = vec
+            if missing:
+                new_embs[missing], _ = embed_texts(self.embedder, [docs[i]["text"] for i in missing])
+            self._apply(docs, new_embs)
+
+        rows = [self._row_of[i] for i in deleted if i in self._row_of]
+        if rows:
+            self._tombstone(rows)
+
+        self.wal.open(self.generation)
+        self._maybe_compact()
+        self._maybe_rebuild_index()
+        self._maybe_reclaim()
+
+    def _read_legacy(self):
+        # rag_store.json only kept texts: they get embedded once and migrated to a snapshot
+        json_path = self.storage_dir / "rag_store.json"
+        if not json_path.exists():
+            return []
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print("RAG legacy store unreadable:", e)
+            return []
 
-        self.documents = data
-        texts = [d["text"] for d in data]
-        self.embeddings = np.array(
-            [self.embedder.encode(t, normalize_embeddings=True) for t in texts],
-            dtype="float32"
-        )
+    def _register(self, docs: List[dict], start: int):
+        # Passages stored before ids existed get the next free one
+        for row, d in enumerate(docs, start):
+            if "id" not in d:
+                d["id"] = self._next_id
+            if "hash" not in d:
+                d["hash"] = passage_hash(d["text"])
+            self._next_id = max(self._next_id, d["id"] + 1)
+            self._row_of[d["id"]] = row
+            self._hash_ids[d["hash"]] = d["id"]
+
+    def _rebuild(self):
+        self._row_of = {}
+        self._hash_ids = {}
+        self._register(self.documents, 0)
+        texts = [d["text"] for d in self.documents]
+        self.embeddings = np.zeros((0, self.embedding_dim), dtype="float32")
+        self.ids = np.array([d["id"] for d in self.documents], dtype="int64")
+        self.keyword = KeywordIndex()
+        self.metadata = MetadataIndex()
+        self.metadata.add(self.documents)
+        if texts:
+            self.embeddings, _ = embed_texts(self.embedder, texts)
+            self.keyword.add(texts)
+        self._set_index(self._build_index(self.embeddings, self.ids), len(self.embeddings))
+        self.compact()
 
-        # Rebuild or load FAISS index
-        if faiss_path.exists():
-            self.index = faiss.read_index(str(faiss_path))
+    # -----------------------------------------------------------
+    # Vector index backend (flat / IVF / HNSW)
+    # -----------------------------------------------------------
+    def _build_index(self, vectors, ids):
+        return build_index(choose_backend(len(vectors)), self.embedding_dim, vectors, ids)
+
+    def _set_index(self, index, trained_on):
+        self.index = index
+        self.index_backend = backend_of(index)
+        self._index_trained_on = trained_on
+
+    def _maybe_rebuild_index(self):
+        # Switch backend when the corpus crosses the ANN threshold, and retrain
+        # an IVF index once the corpus has doubled since its centroids were trained
+        n = len(self.embeddings)
+        want = choose_backend(n)
+        if want != self.index_backend or (want.startswith("ivf") and n >= 2 * self._index_trained_on):
+            self.rebuild_index(background=True)
+
+    def rebuild_index(self, background=False):
+        """
+        Rebuild (and train) the vector index for the current corpus size.
+        The new index is built from the current embeddings outside the locks;
+        passages ingested meanwhile are added just before it is swapped in.
+        Never runs alongside reclaim(), which renumbers the rows this relies on.
+        """
+        with self._lock:
+            if self._index_rebuilding or self._reclaiming:
+                return
+            self._index_rebuilding = True
+            vectors, ids = self.embeddings, self.ids
+
+        def run():
+            try:
+                started = time.perf_counter()
+                index = self._build_index(vectors, ids)
+                with self._lock, self._rw.write():
+                    extra = self.embeddings[len(vectors):]
+                    if len(extra):
+                        index.add_with_ids(extra, self.ids[len(vectors):])
+                    self._set_index(index, len(vectors))
+                print(f"RAG index rebuilt: {self.index_backend} over {index.ntotal} vectors "
+                      f"in {time.perf_counter() - started:.1f}s")
+            except Exception as e:
+                print("RAG index rebuild failed, keeping current index:", e)
+            finally:
+                self._index_rebuilding = False
+
+        if background:
+            threading.Thread(target=run, name="rag-index-rebuild", daemon=True).start()
         else:
-            self.index.add(self.embeddings)
-
-        self.tfidf_matrix = self.tfidf_vectorizer.fit_transform(texts)
+            run()
+
+    def index_stats(self):
+        return {
+            "backend": self.index_backend,
+            "vectors": int(self.index.ntotal),
+            "trained_on": self._index_trained_on,
+            "rebuilding": self._index_rebuilding,
+            "tombstones": len(self._tombstones),
+            "reclaiming": self._reclaiming,
+        }
 
 
 store = RAGStore()
\ No newline at end of file
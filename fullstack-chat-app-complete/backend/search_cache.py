@@ -0,0 +1,75 @@
+"""
+Bounded LRU cache with TTL for query embeddings and search results.
+
+KT users ask the same onboarding questions over and over; a hit skips the
+query embedding and the whole hybrid search. Result entries remember the
+corpus version they were computed against, so anything cached before an
+ingest is treated as a miss afterwards without having to flush the cache.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+RAG_CACHE_SIZE = int(os.getenv("RAG_CACHE_SIZE", "1024"))
+RAG_CACHE_TTL = float(os.getenv("RAG_CACHE_TTL", "600"))
+
+
+def normalize_query(query: str) -> str:
+    return " ".join((query or "").lower().split())
+
+
+class LRUCache:
+    def __init__(self, max_entries: int = RAG_CACHE_SIZE, ttl_seconds: float = RAG_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def get(self, key: Hashable, version: Any = None) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, entry_version, expires = entry
+                if entry_version == version and now < expires:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.stale += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any, version: Any = None):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, version, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "stale": self.stale,
+            }
@@ -0,0 +1,217 @@
+"""
+Versioned on-disk snapshots for RAGStore.
+
+Each snapshot is written to its own ``snap-<generation>`` directory and made
+live by atomically replacing the ``CURRENT`` pointer file, so a crash while
+saving never leaves a half-written store behind. A snapshot holds the
+document metadata, the raw embedding matrix, the FAISS index and the BM25
+keyword index, and records the embedding model name and dimension so
+the store can tell whether the vectors are still usable without running the
+model. Passages deleted but not yet compacted away are listed by id in the
+manifest.
+"""
+import json
+import os
+import shutil
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import faiss
+import numpy as np
+
+from keyword_index import KeywordIndex
+
+SNAPSHOT_VERSION = 3
+# Version 1 predates deletes and keyed the FAISS index by row. Version 2 kept
+# IVF indexes inside IndexIDMap2, whose id map a compaction could leave
+# pointing at the wrong vectors. Indexes from either are rebuilt on load.
+READABLE_VERSIONS = (1, 2, 3)
+CURRENT_FILE = "CURRENT"
+KEEP_SNAPSHOTS = 2
+
+DOCUMENTS_FILE = "documents.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+INDEX_FILE = "faiss.index"
+KEYWORD_FILE = "keyword.npz"
+MANIFEST_FILE = "manifest.json"
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _crc32(path: Path) -> int:
+    crc = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            crc = zlib.crc32(block, crc)
+    return crc
+
+
+def _fsync(path: Path):
+    """Flush a file, or a directory's entries, to disk."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # Directories cannot be opened on Windows; NTFS journals renames itself.
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync(path.parent)
+
+
+def _snapshot_dirs(storage_dir: Path) -> List[Path]:
+    dirs = [p for p in storage_dir.glob("snap-*") if p.is_dir()]
+    return sorted(dirs, key=lambda p: p.name, reverse=True)
+
+
+def oldest_generation(storage_dir: Path) -> Optional[int]:
+    """
+    Generation of the oldest snapshot still on disk. The write-ahead log has
+    to reach back this far: a reader that finds the newest snapshot damaged
+    falls back to an older one and replays the log from there.
+    """
+    gens = []
+    for p in _snapshot_dirs(Path(storage_dir)):
+        try:
+            gens.append(int(p.name.split("-", 1)[1]))
+        except ValueError:
+            continue
+    return min(gens) if gens else None
+
+
+def write_snapshot(storage_dir: Path, generation: int, model_name: str, dim: int,
+                   documents: List[Dict], embeddings: np.ndarray, index=None,
+                   keyword: Optional[KeywordIndex] = None, deleted: Iterable[int] = ()) -> Path:
+    """
+    Write a complete snapshot and atomically make it the current one. Every
+    file and the directories are fsynced before ``CURRENT`` moves, so a crash
+    can never leave ``CURRENT`` naming a snapshot whose data is not on disk.
+    """
+    storage_dir = Path(storage_dir)
+    name = f"snap-{generation:010d}"
+    final = storage_dir / name
+    tmp = storage_dir / f".{name}.tmp"
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir(parents=True)
+
+    with open(tmp / DOCUMENTS_FILE, "w", encoding="utf-8") as f:
+        json.dump(documents, f, ensure_ascii=False, separators=(",", ":"))
+    np.save(tmp / EMBEDDINGS_FILE, np.ascontiguousarray(embeddings, dtype="float32"))
+    files = [DOCUMENTS_FILE, EMBEDDINGS_FILE]
+    if index is not None:
+        faiss.write_index(index, str(tmp / INDEX_FILE))
+        files.append(INDEX_FILE)
+    if keyword is not None:
+        keyword.save(tmp / KEYWORD_FILE)
+        files.append(KEYWORD_FILE)
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "generation": generation,
+        "model": model_name,
+        "dim": int(dim),
+        "count": len(documents),
+        "deleted": sorted(int(i) for i in deleted),
+        "checksums": {fn: _crc32(tmp / fn) for fn in files},
+    }
+    for fn in files:
+        _fsync(tmp / fn)
+    _write_atomic(tmp / MANIFEST_FILE, json.dumps(manifest, indent=2).encode("utf-8"))
+
+    if final.exists():
+        shutil.rmtree(final)
+    os.replace(tmp, final)
+    _fsync(storage_dir)
+    _write_atomic(storage_dir / CURRENT_FILE, name.encode("utf-8"))
+
+    for old in _snapshot_dirs(storage_dir)[KEEP_SNAPSHOTS:]:
+        shutil.rmtree(old, ignore_errors=True)
+    return final
+
+
+def _read_dir(snap_dir: Path, model_name: str, dim: int) -> Dict[str, Any]:
+    try:
+        manifest = json.loads((snap_dir / MANIFEST_FILE).read_text(encoding="utf-8"))
+    except Exception as e:
+        raise SnapshotError(f"{snap_dir.name}: unreadable manifest ({e})")
+    if manifest.get("version") not in READABLE_VERSIONS:
+        raise SnapshotError(f"{snap_dir.name}: unsupported version {manifest.get('version')}")
+    checksums = manifest.get("checksums", {})
+
+    def valid(fn):
+        p = snap_dir / fn
+        return fn in checksums and p.exists() and _crc32(p) == checksums[fn]
+
+    if not valid(DOCUMENTS_FILE):
+        raise SnapshotError(f"{snap_dir.name}: documents checksum mismatch")
+    with open(snap_dir / DOCUMENTS_FILE, "r", encoding="utf-8") as f:
+        documents = json.load(f)
+    if len(documents) != manifest.get("count"):
+        raise SnapshotError(f"{snap_dir.name}: document count mismatch")
+
+    out = {"manifest": manifest, "documents": documents, "embeddings": None, "index": None, "keyword": None,
+           "deleted": manifest.get("deleted", [])}
+    # Vectors are only reusable when they came from the same model.
+    same_model = manifest.get("model") == model_name and manifest.get("dim") == int(dim)
+    if same_model and valid(EMBEDDINGS_FILE):
+        emb = np.load(snap_dir / EMBEDDINGS_FILE)
+        if emb.shape == (len(documents), int(dim)):
+            out["embeddings"] = emb
+            if manifest["version"] == SNAPSHOT_VERSION and valid(INDEX_FILE):
+                try:
+                    index = faiss.read_index(str(snap_dir / INDEX_FILE))
+                    if index.ntotal == emb.shape[0]:
+                        out["index"] = index
+                except Exception:
+                    pass
+    if valid(KEYWORD_FILE):
+        try:
+            keyword = KeywordIndex.load(snap_dir / KEYWORD_FILE)
+            if len(keyword) == len(documents):
+                out["keyword"] = keyword
+        except Exception:
+            pass
+    return out
+
+
+def read_snapshot(storage_dir: Path, model_name: str, dim: int) -> Optional[Dict[str, Any]]:
+    """
+    Load the newest readable snapshot, or None when there is none.
+
+    ``embeddings`` / ``index`` in the result are None when the snapshot was
+    built with a different model or those files are damaged (``index`` also
+    when it was written by an older version), and ``keyword``
+    is None when the keyword index is missing or damaged; ``documents`` is
+    always present, tombstoned passages included (their ids are in
+    ``deleted``). Falls back to the previous generation when the current
+    one cannot be read at all.
+    """
+    storage_dir = Path(storage_dir)
+    candidates = _snapshot_dirs(storage_dir)
+    current = storage_dir / CURRENT_FILE
+    if current.exists():
+        name = current.read_text(encoding="utf-8").strip()
+        candidates.sort(key=lambda p: p.name != name)
+    errors = []
+    for snap_dir in candidates:
+        try:
+            return _read_dir(snap_dir, model_name, dim)
+        except SnapshotError as e:
+            errors.append(str(e))
+    if errors:
+        raise SnapshotError("; ".join(errors))
+    return None
@@ -0,0 +1,176 @@
+"""
+FAISS index backends for RAGStore.
+
+``flat`` scans every vector and is exact; past a few tens of thousands of
+passages that scan becomes the query-latency floor, so larger corpora move
+to an approximate index:
+
+* ``ivf_flat`` - inverted file over k-means cells, exact vectors per cell.
+* ``ivf_pq``   - inverted file with product-quantised vectors (far smaller);
+  unless ``RAG_PQ_REFINE=0`` the top ``k * RAG_PQ_REFINE`` candidates are
+  re-ranked against the exact vectors, so returned scores stay true cosines.
+* ``hnsw``     - navigable small-world graph, no training required.
+
+All backends use inner product; the store only adds normalised vectors, so
+scores stay cosine similarities. ``RAG_INDEX_BACKEND=auto`` (the default)
+uses ``flat`` below ``RAG_ANN_THRESHOLD`` vectors and ``RAG_ANN_BACKEND``
+above it.
+
+Every index is keyed by the store's stable passage ids rather than row
+positions, so deleted passages can be skipped with a selector and later
+removed without renumbering the rest. IVF indexes store those ids in their
+inverted lists; the others are wrapped in ``IndexIDMap2``. (The wrapper's
+``remove_ids`` compacts its id map on the assumption that the wrapped index
+renumbers what is left, which IVF does not.)
+"""
+import math
+import os
+
+import faiss
+import numpy as np
+
+BACKENDS = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+INDEX_BACKEND = os.getenv("RAG_INDEX_BACKEND", "auto")
+ANN_BACKEND = os.getenv("RAG_ANN_BACKEND", "hnsw")
+ANN_THRESHOLD = int(os.getenv("RAG_ANN_THRESHOLD", "20000"))
+
+IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE", "16"))
+PQ_M = int(os.getenv("RAG_PQ_M", "16"))
+PQ_REFINE = float(os.getenv("RAG_PQ_REFINE", "4"))
+HNSW_M = int(os.getenv("RAG_HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", "80"))
+HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH", "64"))
+
+# k-means wants roughly 39 training points per centroid, PQ 256 per sub-quantizer code.
+_MIN_POINTS_PER_CELL = 39
+_PQ_MIN_TRAIN = 256 * _MIN_POINTS_PER_CELL
+
+
+def choose_backend(n: int, configured: str = INDEX_BACKEND) -> str:
+    """Backend to use for ``n`` vectors; IVF falls back to flat until there is enough data to train it."""
+    kind = ANN_BACKEND if configured == "auto" else configured
+    if kind not in BACKENDS:
+        raise ValueError(f"unknown index backend {kind!r}, expected auto or one of {BACKENDS}")
+    if configured == "auto" and n < ANN_THRESHOLD:
+        return "flat"
+    if kind == "ivf_flat" and n < 2 * _MIN_POINTS_PER_CELL:
+        return "flat"
+    if kind == "ivf_pq" and n < _PQ_MIN_TRAIN:
+        return "flat"
+    return kind
+
+
+def _nlist(n: int) -> int:
+    return max(1, min(int(4 * math.sqrt(n)), n // _MIN_POINTS_PER_CELL))
+
+
+def _pq_m(dim: int) -> int:
+    m = min(PQ_M, dim)
+    while dim % m:
+        m -= 1
+    return m
+
+
+def new_index(kind: str, dim: int, n: int = 0):
+    if kind == "flat":
+        return faiss.IndexFlatIP(dim)
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return index
+    quantizer = faiss.IndexFlatIP(dim)
+    if kind == "ivf_flat":
+        return faiss.IndexIVFFlat(quantizer, dim, _nlist(n), faiss.METRIC_INNER_PRODUCT)
+    if kind == "ivf_pq":
+        index = faiss.IndexIVFPQ(quantizer, dim, _nlist(n), _pq_m(dim), 8, faiss.METRIC_INNER_PRODUCT)
+        return faiss.IndexRefineFlat(index) if PQ_REFINE > 0 else index
+    raise ValueError(f"unknown index backend {kind!r}")
+
+
+def _base(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexRefine):
+        return faiss.downcast_index(index.base_index), index
+    return index, None
+
+
+def backend_of(index) -> str:
+    index, _ = _base(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def configure(index):
+    """Apply the search-time knobs (nprobe / efSearch) to a built or loaded index."""
+    inner, refine = _base(index)
+    if refine is not None:
+        refine.k_factor = PQ_REFINE
+    if isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = min(IVF_NPROBE, inner.nlist)
+    elif isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+
+def build_index(kind: str, dim: int, vectors: np.ndarray, ids: np.ndarray):
+    """Create, train if needed, and fill an index of ``kind`` with ``vectors`` under the passage ``ids``."""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    index = new_index(kind, dim, len(vectors))
+    if not isinstance(index, faiss.IndexIVF):
+        index = faiss.IndexIDMap2(index)
+    if not index.is_trained:
+        index.train(vectors)
+    if len(vectors):
+        index.add_with_ids(vectors, np.ascontiguousarray(ids, dtype="int64"))
+    return configure(index)
+
+
+def allow(ids: np.ndarray):
+    """Selector admitting only the given passage ids."""
+    return faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype="int64"))
+
+
+def deny(ids: np.ndarray):
+    """Selector admitting every passage id except the given ones (tombstones)."""
+    return faiss.IDSelectorNot(allow(ids))
+
+
+def search(index, queries: np.ndarray, k: int, sel=None):
+    """``index.search`` restricted by an ``allow`` / ``deny`` selector; returns passage ids."""
+    if sel is None:
+        return index.search(queries, k)
+    inner, refine = _base(index)
+    # The ID map translates the top-level selector only; the refine stage's
+    # base index needs one that maps its internal positions to passage ids.
+    base_sel = faiss.IDSelectorTranslated(faiss.downcast_index(index).id_map, sel) if refine is not None else sel
+    # Explicit search parameters replace the index's own nprobe / efSearch, so carry them over.
+    if isinstance(inner, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=base_sel, nprobe=inner.nprobe)
+    elif isinstance(inner, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=base_sel, efSearch=inner.hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=base_sel)
+    if refine is not None:
+        params = faiss.IndexRefineSearchParameters(k_factor=refine.k_factor, base_index_params=params, sel=sel)
+    return index.search(queries, k, params=params)
+
+
+def remove(index, ids: np.ndarray) -> bool:
+    """
+    Drop the vectors of ``ids`` in place. Returns False, leaving the index
+    untouched, for backends that cannot remove (HNSW, refined IVF-PQ); those
+    have to be rebuilt from the remaining vectors instead.
+    """
+    inner, refine = _base(index)
+    if refine is not None or isinstance(inner, faiss.IndexHNSW):
+        return False
+    if len(ids):
+        index.remove_ids(allow(ids))
+    return True
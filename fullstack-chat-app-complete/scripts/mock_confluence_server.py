@@ -0,0 +1,199 @@
+# scripts/mock_confluence_server.py
+# Minimal Confluence REST API stand-in for testing confluence_sync.py locally.
+#
+#   python scripts/mock_confluence_server.py --port 8090 --spaces ENG,OPS --pages 500
+#   CONFLUENCE_BASE_URL=http://127.0.0.1:8090 CONFLUENCE_USERNAME=x CONFLUENCE_TOKEN=x \
+#   CONFLUENCE_SPACE_KEYS=ENG,OPS python backend/confluence_sync.py
+#
+# Serves GET /rest/api/content (page listing), GET /rest/api/content/{id} and
+# GET /rest/api/content/search (CQL: space, type, lastmodified >= now("-Nm")
+# and order by lastmodified are understood). --latency delays every GET and
+# --fail-rate answers that fraction of them with 429 (Retry-After) or 503,
+# to exercise the sync's rate limiting and retries. Pages can be changed between syncs:
+#
+#   curl -X POST 127.0.0.1:8090/_mock/edit/ENG-3      # new version of a page
+#   curl -X POST 127.0.0.1:8090/_mock/delete/ENG-3
+#   curl -X POST '127.0.0.1:8090/_mock/create/ENG?n=5'
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+WORDS = ("onboarding deploy pipeline cluster runbook incident owner service alert rollback "
+         "database schema migration access token review release branch staging canary").split()
+
+
+def iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.") + f"{int(ts * 1000) % 1000:03d}Z"
+
+
+class Wiki:
+    def __init__(self, spaces, pages, paragraphs, seed=0):
+        self.rng = random.Random(seed)
+        self.paragraphs = paragraphs
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.counter = {}
+        now = time.time()
+        for space in spaces:
+            for i in range(pages):
+                self.create(space, when=now - (pages - i) * 60)
+
+    def body(self):
+        # Storage format: paragraphs, a table and a code macro, as real pages have
+        paras = "".join("<p>" + " ".join(self.rng.choice(WORDS) for _ in range(40)) + "</p>"
+                        for _ in range(self.paragraphs))
+        return (f"<h2>{self.rng.choice(WORDS).title()}</h2>{paras}"
+                "<table><tbody><tr><th>owner</th><th>service</th></tr>"
+                f"<tr><td>{self.rng.choice(WORDS)}</td><td>{self.rng.choice(WORDS)}</td></tr></tbody></table>"
+                '<ac:structured-macro ac:name="code"><ac:parameter ac:name="language">bash</ac:parameter>'
+                f"<ac:plain-text-body><![CDATA[kubectl rollout undo deploy/{self.rng.choice(WORDS)}]]>"
+                "</ac:plain-text-body></ac:structured-macro>")
+
+    def create(self, space, when=None):
+        with self.lock:
+            n = self.counter.get(space, 0) + 1
+            self.counter[space] = n
+            pid = f"{space}-{n}"
+            self.pages[pid] = {"id": pid, "type": "page", "status": "current", "title": f"{space} page {n}",
+                               "space": space, "version": 1, "when": when or time.time(), "body": self.body()}
+            return pid
+
+    def edit(self, pid):
+        with self.lock:
+            p = self.pages[pid]
+            p.update(version=p["version"] + 1, when=time.time(), body=self.body())
+
+    def get(self, pid):
+        with self.lock:
+            p = self.pages.get(pid)
+            return dict(p) if p else None
+
+    def delete(self, pid):
+        with self.lock:
+            self.pages.pop(pid, None)
+
+    def query(self, space=None, since=None):
+        with self.lock:
+            out = [p for p in self.pages.values()
+                   if (space is None or p["space"] == space) and (since is None or p["when"] >= since)]
+        return sorted(out, key=lambda p: (p["when"], p["id"]))
+
+
+def render(p, expand):
+    out = {"id": p["id"], "type": "page", "status": "current", "title": p["title"]}
+    if "version" in expand:
+        out["version"] = {"number": p["version"], "when": iso(p["when"])}
+    if "body.storage" in expand:
+        out["body"] = {"storage": {"value": p["body"], "representation": "storage"}}
+    return out
+
+
+def parse_cql(cql):
+    space = re.search(r'space\s*=\s*"?([\w-]+)"?', cql)
+    rel = re.search(r'lastmodified\s*>=\s*now\("-(\d+)m"\)', cql)
+    return (space.group(1) if space else None), (time.time() - int(rel.group(1)) * 60 if rel else None)
+
+
+def make_handler(wiki, latency, fail_rate=0.0):
+    rng = random.Random(1)
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def send_json(self, obj, status=200):
+            data = json.dumps(obj).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            with lock:
+                fail = fail_rate and rng.random() < fail_rate
+                throttle = rng.random() < 0.5
+            if fail:
+                if throttle:
+                    self.send_response(429)
+                    self.send_header("Retry-After", "0.05")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                else:
+                    self.send_json({"message": "service unavailable"}, 503)
+                return
+            url = urlparse(self.path)
+            q = {k: v[0] for k, v in parse_qs(url.query).items()}
+            start, limit = int(q.get("start", 0)), int(q.get("limit", 25))
+            expand = q.get("expand", "").split(",")
+            if url.path == "/rest/api/content":
+                pages = wiki.query(space=q.get("spaceKey"))
+            elif url.path == "/rest/api/content/search":
+                space, since = parse_cql(q.get("cql", ""))
+                pages = wiki.query(space=space, since=since)
+            elif url.path.startswith("/rest/api/content/"):
+                page = wiki.get(url.path.rsplit("/", 1)[1])
+                if page is None:
+                    self.send_json({"message": "no content"}, 404)
+                else:
+                    self.send_json(render(page, expand))
+                return
+            else:
+                self.send_json({"message": "not found"}, 404)
+                return
+            res = [render(p, expand) for p in pages[start:start + limit]]
+            self.send_json({"results": res, "start": start, "limit": limit, "size": len(res)})
+
+        def do_POST(self):
+            parts = urlparse(self.path).path.strip("/").split("/")
+            q = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+            if len(parts) == 3 and parts[0] == "_mock":
+                action, arg = parts[1], parts[2]
+                try:
+                    if action == "edit":
+                        wiki.edit(arg)
+                        self.send_json({"edited": arg})
+                    elif action == "delete":
+                        wiki.delete(arg)
+                        self.send_json({"deleted": arg})
+                    elif action == "create":
+                        self.send_json({"created": [wiki.create(arg) for _ in range(int(q.get("n", 1)))]})
+                    else:
+                        self.send_json({"message": "unknown action"}, 404)
+                except KeyError:
+                    self.send_json({"message": f"no page {arg}"}, 404)
+                return
+            self.send_json({"message": "not found"}, 404)
+
+    return Handler
+
+
+def serve(port=8090, spaces=("ENG",), pages=100, paragraphs=5, latency=0.0, fail_rate=0.0):
+    wiki = Wiki(spaces, pages, paragraphs)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(wiki, latency, fail_rate))
+    return server, wiki
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8090)
+    ap.add_argument("--spaces", default="ENG")
+    ap.add_argument("--pages", type=int, default=100, help="pages per space")
+    ap.add_argument("--paragraphs", type=int, default=5, help="paragraphs per page body")
+    ap.add_argument("--latency", type=float, default=0.0, help="seconds added to every GET")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="fraction of GETs answered 429/503")
+    args = ap.parse_args()
+    server, _ = serve(args.port, args.spaces.split(","), args.pages, args.paragraphs, args.latency, args.fail_rate)
+    print(f"mock Confluence on http://127.0.0.1:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,84 @@
+# tests/test_confluence_agent.py
+# ConfluenceAgent answers from the local index and only falls back to live CQL
+# on a miss. Run from fullstack-chat-app-complete/:  python -m pytest tests
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from agents import ConfluenceAgent  # noqa: E402
+
+PAGES = [
+    ("ENG", "1", "Deploy runbook", "drain the node, upgrade the agent, re-enable traffic"),
+    ("ENG", "2", "Onboarding", "laptop setup, accounts and the first week"),
+]
+
+
+class FakeStore:
+    """Like RAGStore: hybrid search returns the filtered top k whatever the query."""
+
+    def __init__(self, similarity):
+        self.similarity = similarity   # passage id -> cosine for every query
+        self.passages = [{"id": n, "text": f"{title}: {body}",
+                          "meta": {"type": "confluence", "space": space, "id": page, "title": title, "version": 1}}
+                         for n, (space, page, title, body) in enumerate(PAGES)]
+
+    def _allowed(self, filters):
+        spaces = filters.get("space")
+        return [p for p in self.passages if not spaces or p["meta"]["space"] in spaces]
+
+    def search(self, query, k=5, filters=None):
+        return [dict(p, score=1.0 - n / 10) for n, p in enumerate(self._allowed(filters))][:k]
+
+    def keyword_search(self, query, k=5, filters=None):
+        terms = set(query.lower().split())
+        return [dict(p, score=1.0) for p in self._allowed(filters) if terms & set(p["text"].lower().split())][:k]
+
+    def semantic_search(self, query, k=5, filters=None):
+        return [dict(p, score=self.similarity.get(p["id"], 0.0)) for p in self._allowed(filters)][:k]
+
+
+class FakeClient:
+    def __init__(self):
+        self.cqls = []
+
+    def cql(self, cql, expand=None, limit=None):
+        self.cqls.append(cql)
+        return {"results": [{"content": {"title": "Incident review 2024-03", "id": "99"}}]}
+
+
+def make_agent(tmp_path, similarity=None):
+    state = tmp_path / "confluence_sync.json"
+    # ENG was synced just now, so nothing counts as stale
+    state.write_text(json.dumps({"spaces": {"ENG": {"high_water": time.time() - 60, "synced_at": time.time(),
+                                                    "pages": {}}}}))
+    agent = ConfluenceAgent(store=FakeStore(similarity or {}), state_path=str(state))
+    agent.client = FakeClient()
+    return agent
+
+
+def test_relevant_local_page_answers_without_cql(tmp_path):
+    agent = make_agent(tmp_path)
+    hits = agent.search("how do I drain a node", "ENG")
+    assert [h["id"] for h in hits] == ["1"]
+    assert hits[0]["source"] == "local"
+    assert agent.client.cqls == []
+    assert agent.stats()["local"] == 1
+
+
+def test_synced_space_without_relevant_page_calls_cql(tmp_path):
+    agent = make_agent(tmp_path, similarity={0: 0.12, 1: 0.08})
+    hits = agent.search("incident review march", "ENG")
+    assert len(agent.client.cqls) == 1
+    assert 'space in ("ENG")' in agent.client.cqls[0]
+    # The unrelated synced pages are not passed off as answers
+    assert [(h["id"], h["source"]) for h in hits] == [("99", "live")]
+    assert agent.stats()["misses"] == 1
+
+
+def test_semantically_close_page_is_a_local_hit(tmp_path):
+    agent = make_agent(tmp_path, similarity={1: 0.71})
+    hits = agent.search("new starter checklist", "ENG")
+    assert [h["id"] for h in hits] == ["2"]
+    assert agent.client.cqls == []
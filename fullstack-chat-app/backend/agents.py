@@ -1,8 +1,9 @@
 
-import os, json
+import os, json, threading, time, inspect
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import Dict, Any, List
-from PIL import Image
-import pytesseract
+from ocr import OCR_TIMEOUT, OcrPool, default_pool
 
 try:
     import openai
@@ -11,21 +12,47 @@ except Exception:
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY","")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL","gpt-4o-mini")
+# Point at any OpenAI-compatible server, e.g. scripts/mock_openai_server.py in tests.
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
 print("openai")
 print(openai)
 print(OPENAI_API_KEY)
 if openai and OPENAI_API_KEY:
     print("OpenAI API KEY {}".format(OPENAI_API_KEY))
     openai.api_key = OPENAI_API_KEY
+    if OPENAI_BASE_URL:
+        openai.base_url = OPENAI_BASE_URL.rstrip("/") + "/"
 
 class TextAgent:
     def __init__(self):
-        pass
-    def generate(self, prompt: str, context: str=""):
+        self._async_client = None
+    def _aclient(self):
+        if self._async_client is None:
+            self._async_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+        return self._async_client
+    async def stream(self, prompt: str, context: str=""):
+        """Yield the completion as text deltas, as the model produces them."""
         full = context + "\n\nUser: " + prompt
         if openai and OPENAI_API_KEY:
             try:
-                resp = openai.chat.completions.create(model=OPENAI_MODEL, messages=[{"role":"user","content":full}])
+                resp = await self._aclient().chat.completions.create(model=OPENAI_MODEL, messages=[{"role":"user","content":full}], stream=True)
+                async for chunk in resp:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        yield delta
+            except Exception as e:
+                yield f"[openai error] {e}"
+            return
+        yield f"[local answer] {prompt}"
+    def generate(self, prompt: str, context: str="", timeout: float=None):
+        # timeout bounds the HTTP request, so a caller that stops waiting also frees this thread.
+        full = context + "\n\nUser: " + prompt
+        if openai and OPENAI_API_KEY:
+            try:
+                resp = openai.chat.completions.create(model=OPENAI_MODEL, messages=[{"role":"user","content":full}],
+                                                      timeout=timeout)
                 try:
                     print("Answer3 : {}".format(resp.choices[0].message.content))
                     return resp.choices[0].message.content
@@ -39,14 +66,16 @@ class TextAgent:
         return f"[local answer] {prompt}"
 
 class ImageAgent:
-    def __init__(self):
-        pass
+    def __init__(self, pool: OcrPool=None):
+        # All agents share one bounded OCR pool and its result cache unless given their own.
+        self.pool = pool or default_pool()
     def analyze_image(self, image_path: str) -> Dict[str, Any]:
         res = {"labels": [], "text": ""}
         try:
-            img = Image.open(image_path)
-            text = pytesseract.image_to_string(img)
-            res["text"] = text.strip()
+            out = self.pool.ocr(image_path, timeout=OCR_TIMEOUT)
+            res["text"] = out["text"].strip()
+            res["sha256"] = out["sha256"]
+            res["cached"] = out["cached"]
             if res["text"]:
                 res["labels"].append("contains_text")
             else:
@@ -55,6 +84,10 @@ class ImageAgent:
             res["text"] = f"[ocr error] {str(e)}"
         return res
 
+# Seconds before the HTTP client gives up on a CQL request; keep it within
+# MasterAgent's deadline so a search it stopped waiting for ends soon after.
+CONFLUENCE_TIMEOUT = float(os.getenv("CONFLUENCE_TIMEOUT", "30"))
+
 class ConfluenceAgent:
     def __init__(self):
         try:
@@ -65,7 +98,7 @@ class ConfluenceAgent:
         self.user = os.getenv("CONFLUENCE_USERNAME")
         self.token = os.getenv("CONFLUENCE_TOKEN")
         if Confluence and self.base and self.user and self.token:
-            self.client = Confluence(url=self.base, username=self.user, password=self.token)
+            self.client = Confluence(url=self.base, username=self.user, password=self.token, timeout=CONFLUENCE_TIMEOUT)
         else:
             self.client = None
     def search(self, query: str, space_keys: str=None):
@@ -81,20 +114,113 @@ class ConfluenceAgent:
             out.append({"title": content.get("title"), "id": content.get("id")})
         return out
 
+# MasterAgent fans out to every agent at once. The merge policy decides how
+# long it waits: "all" agents, the "first" with a non-empty answer, or a
+# "quorum" of them (MASTER_QUORUM, 0 = majority). Each agent also has its own
+# deadline (MASTER_AGENT_TIMEOUT, or per agent class via ``timeouts``).
+# A call that has not started when the policy is met is cancelled. A running
+# call cannot be interrupted: it is abandoned and keeps its worker until it
+# returns. Agents that take a ``timeout`` argument (TextAgent) get the time
+# left to their deadline for their HTTP request, so abandoned work ends by
+# then; ConfluenceAgent's client is bounded by CONFLUENCE_TIMEOUT. Size
+# MASTER_WORKERS for concurrent requests x agents; stats() reports the calls
+# still running.
+MASTER_POLICIES = ("first", "all", "quorum")
+MASTER_MERGE_POLICY = os.getenv("MASTER_MERGE_POLICY", "all")
+MASTER_AGENT_TIMEOUT = float(os.getenv("MASTER_AGENT_TIMEOUT", "30"))
+MASTER_QUORUM = int(os.getenv("MASTER_QUORUM", "0"))
+MASTER_WORKERS = int(os.getenv("MASTER_WORKERS", "8"))
+
+def _takes_timeout(fn) -> bool:
+    try:
+        params = inspect.signature(fn).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(p.name == "timeout" or p.kind is p.VAR_KEYWORD for p in params)
+
 class MasterAgent:
-    def __init__(self, agents: List[Any]):
+    def __init__(self, agents: List[Any], policy: str=MASTER_MERGE_POLICY, timeout: float=MASTER_AGENT_TIMEOUT,
+                 timeouts: Dict[str, float]=None, quorum: int=MASTER_QUORUM, workers: int=MASTER_WORKERS):
+        if policy not in MASTER_POLICIES:
+            raise ValueError(f"unknown merge policy {policy!r}; expected one of {MASTER_POLICIES}")
         self.agents = agents
+        self.policy = policy
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.quorum = quorum
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, len(agents), 1), thread_name_prefix="master")
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._running = 0   # calls on the pool now, abandoned ones included
+    def _call(self, agent, prompt: str, context: str, deadline: float):
+        started = time.perf_counter()
+        timeout = max(deadline - time.monotonic(), 0.001)   # what is left once a worker picks it up
+        with self._lock:
+            self._running += 1
+        try:
+            if hasattr(agent, "generate"):
+                fn, args = agent.generate, (prompt, context)
+            else:
+                fn, args = agent.search, (prompt,)
+            out = fn(*args, timeout=timeout) if _takes_timeout(fn) else fn(*args)
+            if not hasattr(agent, "generate"):
+                out = str(out) if out else ""
+        finally:
+            with self._lock:
+                self._running -= 1
+        return out or "", time.perf_counter() - started
+    def _record(self, agent, status: str, seconds: float):
+        with self._lock:
+            st = self._stats.setdefault(type(agent).__name__, {"ok": 0, "error": 0, "timeout": 0, "cancelled": 0,
+                                                               "abandoned": 0, "latency": deque(maxlen=1000)})
+            st[status] += 1
+            if status == "ok":
+                st["latency"].append(seconds)
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {}
+            for name, st in self._stats.items():
+                lat = sorted(st["latency"])
+                out[name] = {k: v for k, v in st.items() if k != "latency"}
+                if lat:
+                    out[name]["latency_ms"] = {"p50": round(lat[len(lat) // 2] * 1000.0, 1),
+                                               "p95": round(lat[min(len(lat) - 1, int(len(lat) * 0.95))] * 1000.0, 1)}
+            running = self._running
+        return {"policy": self.policy, "running": running, "agents": out}
     def generate(self, prompt: str, context: str=""):
-        parts = []
-        for a in self.agents:
-            if hasattr(a, "generate"):
-                try:
-                    parts.append(a.generate(prompt, context))
-                except Exception:
-                    parts.append("")
-            elif hasattr(a, "search"):
+        agents = [a for a in self.agents if hasattr(a, "generate") or hasattr(a, "search")]
+        if not agents:
+            return ""
+        started = time.monotonic()
+        deadlines = [self.timeouts.get(type(a).__name__, self.timeout) for a in agents]
+        need = {"first": 1, "all": len(agents), "quorum": self.quorum or len(agents) // 2 + 1}[self.policy]
+        futures = {self._executor.submit(self._call, a, prompt, context, started + deadlines[i]): i
+                   for i, a in enumerate(agents)}
+        pending = set(futures)
+        parts = [""] * len(agents)
+        answered = 0
+        while pending and answered < need:
+            now = time.monotonic() - started
+            for f in [f for f in pending if now >= deadlines[futures[f]]]:
+                f.cancel()
+                pending.discard(f)
+                self._record(agents[futures[f]], "timeout", now)
+            if not pending:
+                break
+            wait_for = min(deadlines[futures[f]] for f in pending) - now
+            done, _ = wait(pending, timeout=max(wait_for, 0), return_when=FIRST_COMPLETED)
+            for f in done:
+                pending.discard(f)
+                i = futures[f]
                 try:
-                    parts.append(str(a.search(prompt)))
+                    parts[i], seconds = f.result()
+                    self._record(agents[i], "ok", seconds)
                 except Exception:
-                    parts.append("")
+                    self._record(agents[i], "error", time.monotonic() - started)
+                if parts[i]:
+                    answered += 1
+        # Policy met: whoever is still working is not waited for. Only calls that
+        # never started are cancelled; running ones finish (or time out) on their own.
+        for f in pending:
+            self._record(agents[futures[f]], "cancelled" if f.cancel() else "abandoned", time.monotonic() - started)
         return "\n\n".join([p for p in parts if p])
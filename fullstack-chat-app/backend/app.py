@@ -1,4 +1,5 @@
-import os, time, json, uuid
+import os, json, asyncio, functools
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse, JSONResponse, FileResponse, HTMLResponse
@@ -6,12 +7,15 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi_jwt_auth import AuthJWT
 from pydantic import BaseModel
 from dotenv import load_dotenv
-import bcrypt, fitz
+import bcrypt
 load_dotenv()
-from storage_manager import StorageManager
+from storage_manager import StorageManager, UploadTooLarge, MAX_UPLOAD_BYTES
 from rag_engine import RAGStore
 from agents import TextAgent, ImageAgent, ConfluenceAgent, MasterAgent
-from db import init_db, create_user, authenticate_user, add_chat_history, get_user_history
+from db import init_db, create_user, authenticate_user, add_chat_history_async, get_user_history
+from jobs import JobQueue
+from pdf_extract import extract_pdf
+from metadata_index import parse_filters
 
 
 
@@ -19,11 +23,15 @@ HOST = os.getenv("HOST","0.0.0.0")
 PORT = int(os.getenv("PORT","8000"))
 UPLOAD_FOLDER = Path(os.getenv("UPLOAD_FOLDER","./uploads"))
 UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
+# Query embedding and FAISS/BM25 search are CPU-bound; keep them off the event loop
+# and cap how many run at once so a burst of chats cannot starve the process.
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS","4"))
+retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
 
 app = FastAPI(title="Fullstack Chat App")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
-storage = StorageManager()
+storage = StorageManager(UPLOAD_FOLDER)
 rag = RAGStore()
 text_agent = TextAgent()
 img_agent = ImageAgent()
@@ -60,35 +68,64 @@ def login(data: LoginModel, Authorize: AuthJWT = Depends()):
     return {"access_token": access_token}
 
 @app.post("/upload")
-def upload(file: UploadFile = File(...), Authorize: AuthJWT = Depends()):
+def upload(request: Request, file: UploadFile = File(...), Authorize: AuthJWT = Depends()):
     Authorize.jwt_required()
     username = Authorize.get_jwt_subject()
-    filename = f"{uuid.uuid4()}_{file.filename}"
-    dest = UPLOAD_FOLDER / filename
-    with open(dest, "wb") as f:
-        f.write(file.file.read())
-    url = storage.save_file(dest)
-    text_content = ""
-    if file.filename.lower().endswith(".pdf"):
+    # Refuse oversized bodies up front when the client declares a length; the
+    # streamed copy enforces the same limit for chunked requests.
+    declared = int(request.headers.get("content-length") or 0)
+    if MAX_UPLOAD_BYTES and declared > MAX_UPLOAD_BYTES + 64 * 1024:
+        raise HTTPException(status_code=413, detail=f"upload exceeds {MAX_UPLOAD_BYTES} bytes")
+    try:
+        stored = storage.save_stream(file.file, Path(file.filename).suffix)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    filename, dest, url = stored["name"], Path(stored["path"]), stored["url"]
+    # Same bytes already indexed: only record the new uploader, no extraction or embedding.
+    if rag.document_passages(filename):
+        chunks = rag.tag_document(filename, "user", username)
+        return {"filename": file.filename, "url": url, "chunks": chunks, "duplicate": True}
+    # Extraction, OCR and embedding run on the job workers; poll /jobs/{job_id}.
+    job_id = jobs.enqueue("ingest", {"doc_id": filename, "path": str(dest), "filename": file.filename}, username)
+    return JSONResponse({"filename": file.filename, "url": url, "job_id": job_id, "status": "queued", "duplicate": False},
+                        status_code=202)
+
+def extract_text(path: Path, filename: str):
+    # PDFs come back one string per page so chunks keep their page numbers.
+    name = filename.lower()
+    if name.endswith(".pdf"):
         try:
-            doc = fitz.open(dest)
-            txt = ""
-            for p in doc:
-                txt += p.get_text("text") + "\\n"
-            doc.close()
-            text_content = txt
+            return extract_pdf(path)
         except Exception as e:
-            text_content = f"[pdf error] {e}"
-    elif file.filename.lower().endswith((".png",".jpg",".jpeg")):
-        ocr = img_agent.analyze_image(str(dest))
-        text_content = ocr.get("text","")
-    else:
-        try:
-            text_content = dest.read_text(encoding="utf-8", errors="ignore")
-        except Exception:
-            text_content = "[binary file stored]"
-    rag.add_documents([(text_content, {"filename": file.filename, "path": str(dest)})])
-    return {"filename": file.filename, "url": url}
+            return {"pages": [f"[pdf error] {e}"]}
+    if name.endswith((".png",".jpg",".jpeg")):
+        return {"pages": [img_agent.analyze_image(str(path)).get("text","")]}
+    try:
+        return {"pages": [path.read_text(encoding="utf-8", errors="ignore")]}
+    except Exception:
+        return {"pages": ["[binary file stored]"]}
+
+def run_ingest_job(job, report):
+    p = job["payload"]
+    report("extract")
+    extracted = extract_text(Path(p["path"]), p["filename"])
+    report("index", 0.0)
+    result = rag.ingest_documents(
+        [(p["doc_id"], extracted["pages"], {"filename": p["filename"], "path": p["path"], "user": job["user"]})],
+        progress=lambda done, total: report("index", done / total if total else 1.0))
+    return {"chunks": result["indexed"], "duplicates": result["duplicates"], "shared": result["shared"],
+            "pages": len(extracted["pages"]), "ocr_pages": extracted.get("ocr_pages", 0)}
+
+jobs = JobQueue({"ingest": run_ingest_job})
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str, Authorize: AuthJWT = Depends()):
+    Authorize.jwt_required()
+    job = jobs.get(job_id)
+    if job is None or job["user"] != Authorize.get_jwt_subject():
+        raise HTTPException(status_code=404, detail="job not found")
+    return {k: job[k] for k in ("id", "status", "stage", "progress", "steps", "result", "error", "attempts",
+                                "queued_seconds", "elapsed_seconds")}
 
 @app.post("/chat")
 async def chat(request: Request, Authorize: AuthJWT = Depends()):
@@ -96,30 +133,27 @@ async def chat(request: Request, Authorize: AuthJWT = Depends()):
     username = Authorize.get_jwt_subject()
     body = await request.json()
     query = body.get("query","")
-    retrieved = rag.search(query, k=5)
-    context = "\\n\\n".join([r["text"] for r in retrieved])
-    prompt = f"Context:\\n{context}\\n\\nUser: {query}\\nAssistant:"
-    def gen_stream_from_text(text):
-        for token in text.split():
-            yield f"data: {json.dumps({'role':'assistant','chunk': token + ' '})}\\n\\n"
-            time.sleep(0.02)
-        yield "event: done\\ndata: {}\\n\\n"
-    if os.getenv("OPENAI_API_KEY"):
-        try:
-            full = text_agent.generate(query, context)
-            add_chat_history(username, "assistant", full, json.dumps({"retrieved": retrieved}))
-            print("Answer : {}".format(full))
-            return StreamingResponse(gen_stream_from_text(full), media_type="text/event-stream")
-        except Exception as e:
-            full = text_agent.generate(query, context)
-            add_chat_history(username, "assistant", full, json.dumps({"error": str(e)}))
-            print("Answer2 : {}".format(full))
-            return StreamingResponse(gen_stream_from_text(full), media_type="text/event-stream")
-    else:
-        full = text_agent.generate(query, context)
-        add_chat_history(username, "assistant", full, json.dumps({"retrieved": retrieved}))
-        print("Answer3 : {}".format(full))
-        return StreamingResponse(gen_stream_from_text(full), media_type="text/event-stream")
+    # Optional {"user", "source", "type", "since", "until"} filters; a user filter
+    # always means the caller's own uploads. Filters only scope retrieval: the store
+    # is shared, so without a user filter every user's uploads are searched.
+    try:
+        filters = parse_filters(body.get("filters"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if filters and "user" in filters:
+        filters["user"] = username
+    loop = asyncio.get_running_loop()
+    retrieved = await loop.run_in_executor(retrieval_executor, functools.partial(rag.search, query, 5, filters=filters))
+    context = "\n\n".join([r["text"] for r in retrieved])
+    async def event_stream():
+        # Relay deltas as they arrive; history gets the full answer once the stream ends.
+        parts = []
+        async for delta in text_agent.stream(query, context):
+            parts.append(delta)
+            yield f"data: {json.dumps({'role':'assistant','chunk': delta})}\n\n"
+        await add_chat_history_async(username, "assistant", "".join(parts), json.dumps({"retrieved": retrieved}))
+        yield "event: done\ndata: {}\n\n"
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 @app.get("/history")
 def history(Authorize: AuthJWT = Depends()):
@@ -127,6 +161,11 @@ def history(Authorize: AuthJWT = Depends()):
     username = Authorize.get_jwt_subject()
     return get_user_history(username)
 
+@app.get("/metrics")
+def metrics():
+    return {"embedding": rag.query_encoder.stats(), "search_cache": rag.cache_stats(), "index": rag.index_stats(),
+            "jobs": jobs.stats(), "ocr": img_agent.pool.stats(), "master": master.stats()}
+
 @app.get("/uploads/{filename}")
 def serve_upload(filename: str):
     p = UPLOAD_FOLDER / filename
@@ -1,5 +1,6 @@
 \
-import os
+import os, asyncio
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import create_engine, Table, Column, Integer, String, Text, MetaData
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql import select
@@ -16,6 +17,9 @@ else:
     DB_URL = f"sqlite:///{SQLITE_PATH}"
 
 engine = create_engine(DB_URL, echo=False, future=True)
+# Blocking driver calls from async endpoints run here instead of on the event loop.
+DB_WORKERS = int(os.getenv("DB_WORKERS","4"))
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
 meta = MetaData()
 
 users = Table('users', meta,
@@ -58,6 +62,10 @@ def add_chat_history(user, role, content, meta=None):
     with engine.begin() as conn:
         conn.execute(ins)
 
+async def add_chat_history_async(user, role, content, meta=None):
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(db_executor, add_chat_history, user, role, content, meta)
+
 def get_user_history(user):
     sel = select(messages).where(messages.c.user == user).order_by(messages.c.id)
     with engine.connect() as conn:
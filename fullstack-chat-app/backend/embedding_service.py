@@ -0,0 +1,100 @@
+"""
+In-process micro-batcher for query embeddings.
+
+Concurrent requests each need one short query encoded. Running those as
+dozens of single-sentence ``encode`` calls makes them fight over the same
+cores, so callers hand their text to one worker thread instead. The worker
+waits up to ``window_ms`` after the first request for others to arrive,
+encodes the whole group in a single batched call and resolves each
+caller's future with its own row.
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict
+
+import numpy as np
+
+EMBED_BATCH_WINDOW_MS = float(os.getenv("RAG_EMBED_BATCH_WINDOW_MS", "3"))
+EMBED_MAX_BATCH = int(os.getenv("RAG_EMBED_MAX_BATCH", "64"))
+
+
+class EmbeddingBatcher:
+    def __init__(self, embedder, window_ms: float = EMBED_BATCH_WINDOW_MS, max_batch: int = EMBED_MAX_BATCH):
+        self.embedder = embedder
+        self.window = max(window_ms, 0.0) / 1000.0
+        self.max_batch = max(max_batch, 1)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._max_seen = 0
+        self._recent_sizes = deque(maxlen=1000)
+        self._recent_delays = deque(maxlen=1000)
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        fut: Future = Future()
+        self._queue.put((text, fut, time.perf_counter()))
+        return fut
+
+    def encode(self, text: str, timeout: float = None) -> np.ndarray:
+        """Normalized float32 embedding of ``text``, computed in a shared batch."""
+        return self.submit(text).result(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            started = time.perf_counter()
+            batch = [b for b in batch if b[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                embs = np.asarray(self.embedder.encode([b[0] for b in batch], batch_size=len(batch),
+                                                       normalize_embeddings=True, show_progress_bar=False),
+                                  dtype="float32")
+                for (_, fut, _), emb in zip(batch, embs):
+                    fut.set_result(emb)
+            except Exception as e:
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._max_seen = max(self._max_seen, len(batch))
+                self._recent_sizes.append(len(batch))
+                self._recent_delays.extend(started - b[2] for b in batch)
+
+    def stats(self) -> Dict:
+        """Batch sizes and queueing delay (submit to encode start) for tuning the window."""
+        with self._stats_lock:
+            delays = sorted(self._recent_delays)
+            sizes = list(self._recent_sizes)
+            out = {
+                "window_ms": self.window * 1000.0,
+                "max_batch": self.max_batch,
+                "batches": self._batches,
+                "queries": self._items,
+                "avg_batch_size": round(self._items / self._batches, 2) if self._batches else 0.0,
+                "max_batch_seen": self._max_seen,
+                "recent_avg_batch_size": round(sum(sizes) / len(sizes), 2) if sizes else 0.0,
+                "queue_depth": self._queue.qsize(),
+            }
+        if delays:
+            out["queue_delay_ms"] = {
+                "p50": round(delays[len(delays) // 2] * 1000.0, 3),
+                "p99": round(delays[min(len(delays) - 1, int(len(delays) * 0.99))] * 1000.0, 3),
+                "max": round(delays[-1] * 1000.0, 3),
+            }
+        return out
@@ -0,0 +1,49 @@
+"""
+Rank fusion for hybrid search.
+
+Both retrievers hand back ``(doc_id, score)`` lists; fusion works on the
+ids directly, so merging is linear in the number of candidates and chunks
+of the same file stay separate results.
+
+* ``weighted`` - min-max normalise each list to [0, 1] (cosine and BM25
+  live on different scales), then ``alpha * semantic + (1 - alpha) * keyword``.
+* ``rrf`` - reciprocal rank fusion, ``alpha / (c + rank)`` for the semantic
+  list plus ``(1 - alpha) / (c + rank)`` for the keyword list; only ranks
+  matter, so no score normalisation is needed. ``alpha=0.5`` is plain RRF.
+"""
+import heapq
+import os
+from typing import Dict, List, Tuple
+
+FUSION_METHODS = ("weighted", "rrf")
+DEFAULT_FUSION = os.getenv("RAG_FUSION", "weighted")
+RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+
+Hits = List[Tuple[int, float]]
+
+
+def normalize(hits: Hits) -> Hits:
+    if not hits:
+        return []
+    scores = [s for _, s in hits]
+    lo, hi = min(scores), max(scores)
+    if hi - lo <= 1e-12:
+        return [(i, 1.0) for i, _ in hits]
+    return [(i, (s - lo) / (hi - lo)) for i, s in hits]
+
+
+def fuse(semantic: Hits, keyword: Hits, k: int, alpha: float = 0.7,
+         method: str = DEFAULT_FUSION, rrf_k: int = RRF_K) -> Hits:
+    """Merge two ranked candidate lists into the top ``k`` ``(doc_id, fused_score)`` pairs."""
+    combined: Dict[int, float] = {}
+    if method == "weighted":
+        for weight, hits in ((alpha, normalize(semantic)), (1 - alpha, normalize(keyword))):
+            for doc_id, score in hits:
+                combined[doc_id] = combined.get(doc_id, 0.0) + weight * score
+    elif method == "rrf":
+        for weight, hits in ((alpha, semantic), (1 - alpha, keyword)):
+            for rank, (doc_id, _) in enumerate(hits, start=1):
+                combined[doc_id] = combined.get(doc_id, 0.0) + weight / (rrf_k + rank)
+    else:
+        raise ValueError(f"unknown fusion method {method!r}, expected one of {FUSION_METHODS}")
+    return heapq.nlargest(k, combined.items(), key=lambda x: x[1])
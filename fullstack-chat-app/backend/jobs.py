@@ -0,0 +1,164 @@
+"""
+Persistent background job queue backed by SQLite.
+
+``/upload`` stores the file and enqueues an ingestion job instead of
+extracting, OCR-ing and embedding inside the request. A small pool of
+worker threads claims queued jobs oldest first; each job reports its
+current stage and progress, and the time spent in every stage is kept so
+``GET /jobs/{id}`` can show where an ingestion spends its time.
+
+Jobs live in their own SQLite file (WAL mode), so they survive restarts:
+anything still marked ``running`` at startup was interrupted and goes back
+to ``queued`` until it has been tried ``JOB_MAX_ATTEMPTS`` times.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from typing import Callable, Dict, Optional
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "./jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    user        TEXT,
+    payload     TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    stage       TEXT,
+    progress    REAL NOT NULL DEFAULT 0,
+    steps       TEXT NOT NULL DEFAULT '{}',
+    result      TEXT,
+    error       TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    created_at  REAL NOT NULL,
+    started_at  REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+# handler(job, report) -> result dict; report(stage, progress=None) marks progress.
+Handler = Callable[[Dict, Callable[..., None]], Optional[Dict]]
+
+
+class JobQueue:
+    def __init__(self, handlers: Dict[str, Handler], path: str = JOBS_DB_PATH, workers: int = JOB_WORKERS):
+        self.handlers = handlers
+        self.path = path
+        self._local = threading.local()
+        self._wake = threading.Condition()
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        # Jobs a previous process was running when it died get another go.
+        with conn:
+            conn.execute("UPDATE jobs SET status = 'failed', error = 'interrupted too many times', finished_at = ? "
+                         "WHERE status = 'running' AND attempts >= ?", (time.time(), JOB_MAX_ATTEMPTS))
+            conn.execute("UPDATE jobs SET status = 'queued', stage = 'queued' WHERE status = 'running'")
+        self._threads = [threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+                         for i in range(max(workers, 1))]
+        for t in self._threads:
+            t.start()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, kind: str, payload: Dict, user: str = None) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"no handler for job kind {kind!r}")
+        job_id = uuid.uuid4().hex
+        self._conn().execute(
+            "INSERT INTO jobs (id, kind, user, payload, status, stage, created_at) VALUES (?, ?, ?, ?, 'queued', 'queued', ?)",
+            (job_id, kind, user, json.dumps(payload), time.time()))
+        with self._wake:
+            self._wake.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def stats(self) -> Dict:
+        rows = self._conn().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {r["status"]: r["n"] for r in rows}
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["steps"] = json.loads(job["steps"] or "{}")
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        end = job["finished_at"] or (time.time() if job["started_at"] else None)
+        job["elapsed_seconds"] = round(end - job["started_at"], 3) if end and job["started_at"] else None
+        job["queued_seconds"] = round((job["started_at"] or time.time()) - job["created_at"], 3)
+        return job
+
+    def _claim(self) -> Optional[Dict]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            now = time.time()
+            conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, "
+                         "steps = '{}', progress = 0 WHERE id = ?", (now, row["id"]))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        job = self._to_dict(row)
+        job["started_at"] = now
+        return job
+
+    def _run(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                with self._wake:
+                    self._wake.wait(timeout=1.0)
+                continue
+            self._execute(job)
+
+    def _execute(self, job: Dict):
+        conn = self._conn()
+        steps: Dict[str, float] = {}
+        current = {"stage": None, "since": time.perf_counter()}
+
+        def close_stage():
+            if current["stage"] is not None:
+                steps[current["stage"]] = round(steps.get(current["stage"], 0.0)
+                                                + time.perf_counter() - current["since"], 3)
+
+        def report(stage: str, progress: float = None):
+            if stage != current["stage"]:
+                close_stage()
+                current["stage"], current["since"] = stage, time.perf_counter()
+            conn.execute("UPDATE jobs SET stage = ?, progress = COALESCE(?, progress), steps = ? WHERE id = ?",
+                         (stage, progress, json.dumps(steps), job["id"]))
+
+        try:
+            result = self.handlers[job["kind"]](job, report)
+            close_stage()
+            conn.execute("UPDATE jobs SET status = 'done', stage = 'done', progress = 1, steps = ?, result = ?, "
+                         "finished_at = ? WHERE id = ?",
+                         (json.dumps(steps), json.dumps(result), time.time(), job["id"]))
+        except Exception as e:
+            close_stage()
+            traceback.print_exc()
+            conn.execute("UPDATE jobs SET status = 'failed', steps = ?, error = ?, finished_at = ? WHERE id = ?",
+                         (json.dumps(steps), f"{type(e).__name__}: {e}", time.time(), job["id"]))
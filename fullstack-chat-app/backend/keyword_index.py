@@ -0,0 +1,190 @@
+"""
+Incremental BM25 keyword index.
+
+Replaces refitting a TfidfVectorizer over the whole corpus on every upload.
+The vocabulary only ever grows, so adding documents touches nothing but the
+postings of the terms they contain, and a query only scores the postings of
+its own terms. Rows are numbered in insertion order, matching the position
+of the passage in ``RAGStore.documents``.
+
+Deleting a row only tombstones it: it stops scoring and counting towards
+document frequencies and the average length at once, and ``compact()``
+later rewrites the postings without it.
+"""
+import json
+import re
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+_TOKEN_RE = re.compile(r"(?u)\b\w\w+\b")
+
+FORMAT_VERSION = 2
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if t not in ENGLISH_STOP_WORDS]
+
+
+class KeywordIndex:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        self._rows: List[array] = []   # per term: rows containing it
+        self._tfs: List[array] = []    # per term: term frequency in that row
+        self.doc_len = array("I")
+        self.total_len = 0            # tokens in live rows
+        self.dead = array("B")        # per row: 1 once deleted
+        self.deleted = 0
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def add(self, texts: Iterable[str]) -> List[int]:
+        """Append documents and return the rows assigned to them."""
+        rows = []
+        for text in texts:
+            row = len(self.doc_len)
+            counts: Dict[int, int] = {}
+            tokens = tokenize(text)
+            for tok in tokens:
+                tid = self.vocab.get(tok)
+                if tid is None:
+                    tid = len(self.vocab)
+                    self.vocab[tok] = tid
+                    self._rows.append(array("I"))
+                    self._tfs.append(array("I"))
+                counts[tid] = counts.get(tid, 0) + 1
+            for tid, tf in counts.items():
+                self._rows[tid].append(row)
+                self._tfs[tid].append(tf)
+            self.doc_len.append(len(tokens))
+            self.dead.append(0)
+            self.total_len += len(tokens)
+            rows.append(row)
+        return rows
+
+    def delete(self, rows: Iterable[int]) -> int:
+        """Tombstone rows; already deleted ones are skipped. Returns the number newly deleted."""
+        n = 0
+        for row in rows:
+            if not self.dead[row]:
+                self.dead[row] = 1
+                self.total_len -= self.doc_len[row]
+                n += 1
+        self.deleted += n
+        return n
+
+    def compact(self) -> "KeywordIndex":
+        """Copy without the tombstoned rows; the remaining rows are renumbered in order."""
+        ki = KeywordIndex(self.k1, self.b)
+        dead = np.frombuffer(self.dead, dtype=np.uint8).astype(bool)
+        new_row = np.cumsum(~dead) - 1
+        for term, tid in self.vocab.items():
+            rows = np.frombuffer(self._rows[tid], dtype=np.uint32)
+            live = ~dead[rows]
+            if not live.any():
+                continue
+            ki.vocab[term] = len(ki._rows)
+            ki._rows.append(array("I", new_row[rows[live]].astype(np.uint32).tobytes()))
+            ki._tfs.append(array("I", np.frombuffer(self._tfs[tid], dtype=np.uint32)[live].tobytes()))
+        ki.doc_len = array("I", np.frombuffer(self.doc_len, dtype=np.uint32)[~dead].tobytes())
+        ki.dead = array("B", bytes(len(ki.doc_len)))
+        ki.total_len = self.total_len
+        return ki
+
+    def copy(self) -> "KeywordIndex":
+        ki = KeywordIndex(self.k1, self.b)
+        ki.vocab = dict(self.vocab)
+        ki._rows = [array("I", r) for r in self._rows]
+        ki._tfs = [array("I", t) for t in self._tfs]
+        ki.doc_len = array("I", self.doc_len)
+        ki.total_len = self.total_len
+        ki.dead = array("B", self.dead)
+        ki.deleted = self.deleted
+        return ki
+
+    def scores(self, query: str) -> Optional[np.ndarray]:
+        """Dense BM25 scores for every row, or None when no query term is indexed."""
+        n = len(self.doc_len) - self.deleted
+        tids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not n or not tids:
+            return None
+        dl = np.frombuffer(self.doc_len, dtype=np.uint32).astype("float32")
+        norm = self.k1 * (1 - self.b + self.b * dl / max(self.total_len / n, 1e-9))
+        dead = np.frombuffer(self.dead, dtype=np.uint8).astype(bool) if self.deleted else None
+        out = np.zeros(len(self.doc_len), dtype="float32")
+        for tid in tids:
+            rows = np.frombuffer(self._rows[tid], dtype=np.uint32)
+            tf = np.frombuffer(self._tfs[tid], dtype=np.uint32).astype("float32")
+            if dead is not None:
+                live = ~dead[rows]
+                rows, tf = rows[live], tf[live]
+            df = len(rows)
+            idf = np.log1p((n - df + 0.5) / (df + 0.5))
+            out[rows] += idf * tf * (self.k1 + 1) / (tf + norm[rows])
+        return out
+
+    def search(self, query: str, k: int = 5, rows: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Top ``k`` ``(row, score)`` matches, optionally only among ``rows``."""
+        s = self.scores(query)
+        if s is None:
+            return []
+        if rows is None:
+            hits = np.flatnonzero(s)
+        else:
+            rows = rows[rows < len(s)]
+            hits = rows[s[rows] > 0]
+        if len(hits) > k:
+            hits = hits[np.argpartition(-s[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-s[hits], kind="stable")]
+        return [(int(i), float(s[i])) for i in hits]
+
+    # ------------------------------------------------------------------
+    # On-disk format: one .npz holding the vocabulary (JSON, ordered by
+    # term id) and the postings flattened CSR-style with per-term offsets.
+    # ------------------------------------------------------------------
+    def save(self, path: Path):
+        terms = sorted(self.vocab, key=self.vocab.get)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        if terms:
+            offsets[1:] = np.cumsum([len(r) for r in self._rows])
+        rows = np.frombuffer(b"".join(r.tobytes() for r in self._rows), dtype=np.uint32)
+        tfs = np.frombuffer(b"".join(t.tobytes() for t in self._tfs), dtype=np.uint32)
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                header=np.frombuffer(json.dumps({
+                    "version": FORMAT_VERSION, "k1": self.k1, "b": self.b,
+                    "total_len": self.total_len, "terms": terms,
+                }).encode("utf-8"), dtype=np.uint8),
+                offsets=offsets,
+                rows=rows,
+                tfs=tfs,
+                doc_len=np.frombuffer(self.doc_len, dtype=np.uint32),
+                dead=np.frombuffer(self.dead, dtype=np.uint8),
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> "KeywordIndex":
+        with np.load(path) as data:
+            header = json.loads(data["header"].tobytes().decode("utf-8"))
+            if header.get("version") not in (1, FORMAT_VERSION):
+                raise ValueError(f"unsupported keyword index version {header.get('version')}")
+            ki = cls(k1=header["k1"], b=header["b"])
+            offsets, rows, tfs = data["offsets"], data["rows"], data["tfs"]
+            ki.vocab = {t: i for i, t in enumerate(header["terms"])}
+            for i in range(len(header["terms"])):
+                lo, hi = offsets[i], offsets[i + 1]
+                ki._rows.append(array("I", rows[lo:hi].tobytes()))
+                ki._tfs.append(array("I", tfs[lo:hi].tobytes()))
+            ki.doc_len = array("I", data["doc_len"].astype(np.uint32).tobytes())
+            # Version 1 predates deletes: nothing is tombstoned
+            ki.dead = array("B", data["dead"].astype(np.uint8).tobytes() if "dead" in data else bytes(len(ki.doc_len)))
+            ki.deleted = sum(ki.dead)
+            ki.total_len = int(header["total_len"])
+        return ki
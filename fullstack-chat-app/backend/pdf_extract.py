@@ -0,0 +1,114 @@
+"""
+Page-level PDF text extraction.
+
+Text is returned as one string per page, so chunking keeps page boundaries
+and every passage can be cited by page. Small documents are read in
+process; larger ones (``PDF_PARALLEL_MIN_PAGES`` pages and up) are split
+into contiguous page ranges that a shared process pool extracts in
+parallel, each worker opening the file itself. Only pages without a usable
+text layer (fewer than ``PDF_OCR_MIN_CHARS`` characters) are rendered and
+sent through Tesseract, when pytesseract is installed.
+"""
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Tuple
+
+import fitz
+
+try:
+    import pytesseract
+    from PIL import Image
+except Exception:
+    pytesseract = None
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+PDF_OCR_MIN_CHARS = int(os.getenv("PDF_OCR_MIN_CHARS", "16"))
+PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", "200"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    # One long-lived pool: spawning interpreters per upload would cost more than it saves.
+    # "spawn" keeps workers from inheriting the server's threads and FAISS state.
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _drop_pool(pool: ProcessPoolExecutor):
+    # A worker died (MuPDF crashing on a malformed page, the OOM killer): the pool
+    # refuses all further work, so the next large PDF starts a fresh one.
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def ocr_page(page, dpi: int = PDF_OCR_DPI) -> str:
+    pix = page.get_pixmap(dpi=dpi)
+    return pytesseract.image_to_string(Image.open(io.BytesIO(pix.tobytes("png"))))
+
+
+def _extract_range(path: str, start: int, stop: int, ocr: bool) -> List[Tuple[str, str]]:
+    """``(text, source)`` for pages ``start..stop-1``; source is "text", "ocr" or "empty"."""
+    out = []
+    with fitz.open(path) as doc:
+        for i in range(start, stop):
+            page = doc[i]
+            text = page.get_text("text")
+            source = "text"
+            if len(text.strip()) < PDF_OCR_MIN_CHARS:
+                source = "empty"
+                if ocr and pytesseract is not None:
+                    try:
+                        text, source = ocr_page(page), "ocr"
+                    except Exception as e:
+                        print(f"OCR failed on page {i + 1} of {path}:", e)
+            out.append((text, source))
+    return out
+
+
+def extract_pdf(path, workers: int = PDF_WORKERS, ocr: bool = True) -> Dict:
+    """
+    Extract ``path`` page by page. Returns ``{"pages": [text, ...],
+    "sources": [...], "ocr_pages", "page_count", "seconds", "pages_per_sec"}``.
+    When a pool worker dies the file is extracted in process instead.
+    """
+    started = time.perf_counter()
+    path = str(path)
+    with fitz.open(path) as doc:
+        n = doc.page_count
+    if workers <= 1 or n < PDF_PARALLEL_MIN_PAGES:
+        results = _extract_range(path, 0, n, ocr)
+    else:
+        # A few ranges per worker so one OCR-heavy stretch does not leave the others idle.
+        step = max(1, -(-n // (workers * 4)))
+        pool = _get_pool(workers)
+        try:
+            futures = [pool.submit(_extract_range, path, lo, min(lo + step, n), ocr) for lo in range(0, n, step)]
+            results = [r for f in futures for r in f.result()]
+        except BrokenProcessPool as e:
+            print(f"PDF worker pool broke on {path}, extracting in process:", e)
+            _drop_pool(pool)
+            results = _extract_range(path, 0, n, ocr)
+    elapsed = time.perf_counter() - started
+    sources = [s for _, s in results]
+    return {
+        "pages": [t for t, _ in results],
+        "sources": sources,
+        "ocr_pages": sources.count("ocr"),
+        "page_count": n,
+        "seconds": round(elapsed, 3),
+        "pages_per_sec": round(n / elapsed, 1) if elapsed > 0 else None,
+    }
@@ -1,116 +1,726 @@
-import json
+import json, os, threading, time
 from pathlib import Path
-from typing import List, Tuple, Dict
+from typing import Iterable, List, Optional, Tuple, Dict
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import faiss
+from snapshot import oldest_generation, read_snapshot, write_snapshot, SnapshotError
+from chunking import chunk_document
+from keyword_index import KeywordIndex
+from ingest import embed_texts, passage_hash, EMBED_BATCH_SIZE, NEAR_DUP_THRESHOLD
+from wal import WriteAheadLog
+from rwlock import ReadWriteLock
+from embedding_service import EmbeddingBatcher
+from search_cache import LRUCache, normalize_query
+from fusion import fuse, DEFAULT_FUSION
+from vector_index import (build_index, backend_of, choose_backend, configure,
+                          allow, deny, remove as vector_remove, search as vector_search)
+from metadata_index import MetadataIndex, filter_key
+
+WAL_COMPACT_BYTES = int(os.getenv("RAG_WAL_COMPACT_BYTES", str(64 * 1024 * 1024)))
+# Filters matching at most this many passages are scored exactly instead of through the ANN index.
+FILTER_EXACT_MAX = int(os.getenv("RAG_FILTER_EXACT_MAX", "4096"))
+# Deleted passages stay as tombstones until they are this share of all rows; then a background compaction reclaims them.
+TOMBSTONE_RATIO = float(os.getenv("RAG_TOMBSTONE_RATIO", "0.2"))
+
+def _with_value(meta: Dict, field: str, value) -> Dict:
+    # meta[field] grows from a single value into a list once a second value is tagged on.
+    current = meta.get(field)
+    values = current if isinstance(current, list) else ([] if current is None else [current])
+    return meta if value in values else {**meta, field: values + [value]}
+
+# Fields naming the document a passage came from. Text found in several documents is
+# stored once, and each document is listed in meta["owners"].
+OWNER_FIELDS = ("doc_id", "user", "space")
+
+def _values(v) -> List:
+    return v if isinstance(v, list) else ([] if v is None else [v])
+
+def _owner_of(meta: Dict) -> Dict:
+    return {f: meta[f] for f in OWNER_FIELDS if meta.get(f) is not None}
+
+def _owners(meta: Dict) -> List[Dict]:
+    return meta.get("owners") or [_owner_of(meta)]
+
+def _with_owners(meta: Dict, owners: List[Dict]) -> Dict:
+    # Owner fields become the union over owners; a single owner collapses back to plain fields.
+    out = {k: v for k, v in meta.items() if k not in OWNER_FIELDS and k != "owners"}
+    merged: Dict[str, List] = {}
+    for owner in owners:
+        for field in OWNER_FIELDS:
+            for value in _values(owner.get(field)):
+                if value not in merged.setdefault(field, []):
+                    merged[field].append(value)
+    out.update({f: vs[0] if len(vs) == 1 else vs for f, vs in merged.items()})
+    if len(owners) > 1:
+        out["owners"] = owners
+    return out
+
+def _share(meta: Dict, owners: List[Dict]) -> Optional[Dict]:
+    """
+    ``meta`` with ``owners`` added, or None when it lists all of them already. An owner
+    whose document already owns the passage adds its user / space to that document
+    (the same file uploaded again by someone else).
+    """
+    current = _owners(meta)
+    merged = list(current)
+    for owner in owners:
+        n = next((n for n, o in enumerate(merged) if o.get("doc_id") == owner.get("doc_id")), None)
+        if n is None:
+            merged.append(owner)
+            continue
+        for field in OWNER_FIELDS:
+            for value in _values(owner.get(field)):
+                merged[n] = _with_value(merged[n], field, value)
+    return None if merged == current else _with_owners(meta, merged)
+
+def _owned(meta: Dict, owners: List[Dict]) -> bool:
+    docs = {o.get("doc_id") for o in _owners(meta)}
+    return all(o.get("doc_id") in docs for o in owners)
+
+def _unshare(meta: Dict, doc_ids: set) -> Optional[Dict]:
+    """``meta`` without the owners in ``doc_ids``, or None when no owner is left."""
+    owners = [o for o in _owners(meta) if o.get("doc_id") is None or str(o["doc_id"]) not in doc_ids]
+    return _with_owners(meta, owners) if owners else None
+
+def _tagged(meta: Dict, doc_id: str, field: str, value) -> Dict:
+    if "owners" not in meta or field not in OWNER_FIELDS:
+        return _with_value(meta, field, value)
+    return _with_owners(meta, [_with_value(o, field, value) if o.get("doc_id") == doc_id else o
+                               for o in meta["owners"]])
 
 class RAGStore:
     def __init__(self, storage_dir: str = "./rag_data", emb_model: str = "all-MiniLM-L6-v2"):
         self.storage_dir = Path(storage_dir)
         self.storage_dir.mkdir(parents=True, exist_ok=True)
         self.documents: List[Dict] = []
+        # Every passage gets a stable integer id; _row_of maps it to its row in
+        # documents / FAISS / the keyword index.
+        self._row_of: Dict[int, int] = {}
+        self._hash_ids: Dict[str, int] = {}   # passage_hash -> id, for skipping repeats
+        self._next_id = 0
+        self.emb_model = emb_model
+        self.generation = 0
         self.embedder = SentenceTransformer(emb_model)
         self.embedding_dim = self.embedder.get_sentence_embedding_dimension()
-        self.index = faiss.IndexFlatIP(self.embedding_dim)
+        self.query_encoder = EmbeddingBatcher(self.embedder)
+        # Bumped on every change to the indexed corpus; cached results from older versions are misses.
+        self.corpus_version = 0
+        self.embedding_cache = LRUCache()
+        self.result_cache = LRUCache()
         self.embeddings = np.zeros((0, self.embedding_dim), dtype="float32")
-        self.tfidf = TfidfVectorizer(stop_words="english", max_features=20000)
-        self.tfidf_matrix = None
+        self.ids = np.zeros(0, dtype="int64")   # passage id per row; FAISS is keyed by these
+        self.index = build_index("flat", self.embedding_dim, self.embeddings, self.ids)
+        self.index_backend = "flat"
+        self._index_trained_on = 0   # vectors the current ANN index was trained on
+        self._index_rebuilding = False
+        # Ids of deleted passages whose rows have not been compacted away yet, and
+        # the FAISS selector that keeps them out of unfiltered searches.
+        self._tombstones = set()
+        self._deny = None
+        self._reclaiming = False
+        self._retagged = set()   # ids whose meta changed while a reclaim was building its copy
+        self.keyword = KeywordIndex()
+        self.metadata = MetadataIndex()   # user / space / source / type postings for filters
+        self.wal = WriteAheadLog(self.storage_dir, emb_model, self.embedding_dim)
+        self._lock = threading.RLock()   # serialises writers (ingest, compaction)
+        self._rw = ReadWriteLock()       # searches vs. in-place index updates
+        self._compacting = False
         self._load()
 
     def _load(self):
+        # Base state comes from the newest snapshot (or the pre-snapshot rag_store.json),
+        # then everything appended to the write-ahead log since is replayed on top.
+        try:
+            snap = read_snapshot(self.storage_dir, self.emb_model, self.embedding_dim)
+        except SnapshotError as e:
+            print("RAG snapshot unreadable, rebuilding from legacy store:", e)
+            snap = None
+        reembed = False
+        if snap is None:
+            self.documents = self._read_legacy()
+            reembed = bool(self.documents)
+        else:
+            self.documents = snap["documents"]
+            self.generation = snap["manifest"]["generation"]
+            if snap["embeddings"] is None:
+                print("RAG snapshot built with another embedding model, re-embedding")
+                reembed = True
+            else:
+                self._register(self.documents, 0)
+                self.embeddings = snap["embeddings"]
+                self.ids = np.array([d["id"] for d in self.documents], dtype="int64")
+                if snap["index"] is None:
+                    self._set_index(self._build_index(self.embeddings, self.ids), len(self.embeddings))
+                else:
+                    self._set_index(configure(snap["index"]), len(self.embeddings))
+                self.keyword = snap["keyword"]
+                if self.keyword is None:
+                    self.keyword = KeywordIndex()
+                    self.keyword.add(d["text"] for d in self.documents)
+
+        records = self.wal.replay(self.generation)
+        replayed = [(h["doc"], vec) for h, vec in records if h.get("op") == "add"]
+        # Passage ids are never reused, so deletes apply regardless of where they sit in the log.
+        deleted = set(snap["deleted"]) if snap else set()
+        for h, _ in records:
+            if h.get("op") == "delete":
+                deleted.update(h["ids"])
+        # A passage shared with or released by a document is logged with its whole new meta.
+        metas = [h for h, _ in records if h.get("op") == "meta"]
+        if metas:
+            by_id = {d.get("id"): d for d in self.documents + [doc for doc, _ in replayed]}
+            for h in metas:
+                if h["id"] in by_id:
+                    by_id[h["id"]]["meta"] = h["meta"]
+        # Tags only ever add a value, so they can be folded into the passages before indexing.
+        tags = {}
+        for h, _ in records:
+            if h.get("op") == "tag":
+                tags.setdefault(h["doc_id"], []).append((h["field"], h["value"]))
+        if tags:
+            for d in self.documents + [doc for doc, _ in replayed]:
+                for doc_id in _values((d.get("meta") or {}).get("doc_id")):
+                    for field, value in tags.get(doc_id, ()):
+                        d["meta"] = _tagged(d["meta"], doc_id, field, value)
+        if reembed:
+            self.documents.extend(doc for doc, _ in replayed)
+            self.documents = [d for d in self.documents if d.get("id") not in deleted]
+            self._rebuild()
+            return
+        self.metadata.add(self.documents)
+        if replayed:
+            docs = [doc for doc, _ in replayed]
+            missing = [i for i, (_, vec) in enumerate(replayed) if vec is None]
+            arr = np.zeros((len(docs), self.embedding_dim), dtype="float32")
+            for i, (_, vec) in enumerate(replayed):
+                if vec is not None:
+                    arr[i] = vec
+            if missing:
+                arr[missing], _ = embed_texts(self.embedder, [docs[i]["text"] for i in missing])
+            self._apply(docs, arr)
+        rows = [self._row_of[i] for i in deleted if i in self._row_of]
+        if rows:
+            self._tombstone(rows)
+        self.wal.open(self.generation)
+        self._maybe_compact()
+        self._maybe_rebuild_index()
+        self._maybe_reclaim()
+
+    def _read_legacy(self) -> List[Dict]:
+        # Stores written before snapshots only kept texts; they get embedded once and migrated.
         jsonp = self.storage_dir / "rag_store.json"
-        faissp = self.storage_dir / "faiss.index"
-        if jsonp.exists():
-            data = json.loads(jsonp.read_text(encoding="utf-8"))
-            self.documents = data
-            texts = [d["text"] for d in self.documents]
-            if texts:
-                self.embeddings = np.array([self.embedder.encode(t, normalize_embeddings=True) for t in texts], dtype="float32")
-                try:
-                    if faissp.exists():
-                        self.index = faiss.read_index(str(faissp))
-                    else:
-                        self.index = faiss.IndexFlatIP(self.embedding_dim)
-                        if self.embeddings.shape[0] > 0:
-                            self.index.add(self.embeddings)
-                except Exception:
-                    self.index = faiss.IndexFlatIP(self.embedding_dim)
-                    if self.embeddings.shape[0] > 0:
-                        self.index.add(self.embeddings)
-                self.tfidf_matrix = self.tfidf.fit_transform(texts)
-
-    def _save(self):
-        jsonp = self.storage_dir / "rag_store.json"
-        faissp = self.storage_dir / "faiss.index"
-        jsonp.write_text(json.dumps(self.documents, indent=2), encoding="utf-8")
+        if not jsonp.exists():
+            return []
         try:
-            faiss.write_index(self.index, str(faissp))
-        except Exception:
-            pass
+            return json.loads(jsonp.read_text(encoding="utf-8"))
+        except Exception as e:
+            print("RAG legacy store unreadable:", e)
+            return []
 
-    def add_documents(self, docs: List[Tuple[str, Dict]]):
-        new_texts = []
-        new_embs = []
+    def _register(self, docs: List[Dict], start: int):
+        # Passages stored before ids existed get the next free one.
+        for row, d in enumerate(docs, start):
+            if "id" not in d:
+                d["id"] = self._next_id
+            if "hash" not in d:
+                d["hash"] = passage_hash(d["text"])
+            self._next_id = max(self._next_id, d["id"] + 1)
+            self._row_of[d["id"]] = row
+            self._hash_ids[d["hash"]] = d["id"]
+
+    def _rebuild(self):
+        self._row_of = {}
+        self._hash_ids = {}
+        self._register(self.documents, 0)
+        texts = [d["text"] for d in self.documents]
+        self.embeddings = np.zeros((0, self.embedding_dim), dtype="float32")
+        self.ids = np.array([d["id"] for d in self.documents], dtype="int64")
+        self.keyword = KeywordIndex()
+        self.metadata = MetadataIndex()
+        self.metadata.add(self.documents)
+        if texts:
+            self.embeddings, _ = embed_texts(self.embedder, texts)
+            self.keyword.add(texts)
+        self._set_index(self._build_index(self.embeddings, self.ids), len(self.embeddings))
+        self.compact()
+
+    def _build_index(self, vectors: np.ndarray, ids: np.ndarray):
+        return build_index(choose_backend(len(vectors)), self.embedding_dim, vectors, ids)
+
+    def _set_index(self, index, trained_on: int):
+        self.index = index
+        self.index_backend = backend_of(index)
+        self._index_trained_on = trained_on
+
+    def _maybe_rebuild_index(self):
+        # Switch backend when the corpus crosses RAG_ANN_THRESHOLD, and retrain an
+        # IVF index once the corpus has doubled since its centroids were trained.
+        n = len(self.embeddings)
+        want = choose_backend(n)
+        if want != self.index_backend or (want.startswith("ivf") and n >= 2 * self._index_trained_on):
+            self.rebuild_index(background=True)
+
+    def rebuild_index(self, background: bool = False):
+        """
+        Rebuild (and train) the vector index for the current corpus size. The new
+        index is built from a copy of the embeddings outside the locks; passages
+        ingested meanwhile are added to it just before it is swapped in. Never
+        overlaps reclaim(), which renumbers the rows this relies on.
+        """
+        with self._lock:
+            if self._index_rebuilding or self._reclaiming:
+                return
+            self._index_rebuilding = True
+            vectors, ids = self.embeddings, self.ids
+
+        def run():
+            try:
+                started = time.perf_counter()
+                index = self._build_index(vectors, ids)
+                with self._lock, self._rw.write():
+                    extra = self.embeddings[len(vectors):]
+                    if len(extra):
+                        index.add_with_ids(extra, self.ids[len(vectors):])
+                    self._set_index(index, len(vectors))
+                print(f"RAG index rebuilt: {self.index_backend} over {index.ntotal} vectors "
+                      f"in {time.perf_counter() - started:.1f}s")
+            except Exception as e:
+                print("RAG index rebuild failed, keeping current index:", e)
+            finally:
+                self._index_rebuilding = False
+
+        if background:
+            threading.Thread(target=run, name="rag-index-rebuild", daemon=True).start()
+        else:
+            run()
+
+    def _apply(self, docs: List[Dict], arr: np.ndarray):
+        # FAISS and the keyword index reallocate while growing, so searches must not overlap.
+        with self._rw.write():
+            self._register(docs, len(self.documents))
+            self.documents.extend(docs)
+            ids = np.array([d["id"] for d in docs], dtype="int64")
+            self.index.add_with_ids(arr, ids)
+            self.ids = np.concatenate([self.ids, ids])
+            self.embeddings = arr if self.embeddings.shape[0] == 0 else np.vstack([self.embeddings, arr])
+            self.keyword.add(d["text"] for d in docs)
+            self.metadata.add(docs)
+            self.corpus_version += 1
+
+    def compact(self, background: bool = False):
+        """
+        Fold the write-ahead log into a new snapshot. State is captured and the
+        log rotated under the lock; the snapshot itself is written outside it,
+        so ingestion only waits for the in-memory copy.
+        """
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+            self.generation += 1
+            gen = self.generation
+            documents = list(self.documents)
+            embeddings = self.embeddings
+            index = faiss.clone_index(self.index)
+            keyword = self.keyword.copy()
+            deleted = sorted(self._tombstones)
+            self.wal.rotate(gen)
+
+        def run():
+            try:
+                write_snapshot(self.storage_dir, gen, self.emb_model, self.embedding_dim,
+                               documents, embeddings, index=index, keyword=keyword, deleted=deleted)
+                # Keep the log back to the oldest kept snapshot, the one a damaged
+                # newest snapshot falls back to.
+                self.wal.drop_before(oldest_generation(self.storage_dir) or gen)
+            except Exception as e:
+                print("RAG compaction failed, keeping write-ahead log:", e)
+            finally:
+                self._compacting = False
+
+        if background:
+            threading.Thread(target=run, name="rag-compaction", daemon=True).start()
+        else:
+            run()
+
+    def _maybe_compact(self):
+        if self.wal.size() >= WAL_COMPACT_BYTES:
+            self.compact(background=True)
+
+    def ingest(self, docs: Iterable[Tuple[str, Dict]], batch_size: int = EMBED_BATCH_SIZE, progress=None,
+               replace: Iterable[str] = ()) -> Dict:
+        """
+        Bulk-index ``(text, meta)`` passages: one batched embedding pass, one
+        write-ahead log append and one keyword-index append. Returns a throughput report.
+
+        Passages are deduplicated per document: text the same document already
+        has indexed (same normalised text, or cosine >= RAG_NEAR_DUP_THRESHOLD)
+        is dropped and counted in ``duplicates``; a new user / space on it is
+        still added to the stored passage. Text indexed for another
+        document is not embedded or stored again; the existing passage gets
+        this document's doc_id / user / space as another owner (``shared``),
+        so filters on either document find it and deleting one keeps it for the other.
+
+        ``replace`` names doc_ids this batch is the new version of: their current
+        passages are deleted in the same write, and new passages with unchanged
+        text take over the stored vector instead of being embedded again.
+        """
+        started = time.perf_counter()
+        now = time.time()
+        replace = sorted(set(replace))
+        passages, first = [], {}
+        duplicates = shared = 0
         for text, meta in docs:
-            if not text or not text.strip():
+            if not (text and text.strip()):
+                continue
+            d = {"text": text, "meta": meta or {}, "added": now, "hash": passage_hash(text)}
+            if d["hash"] not in first:
+                first[d["hash"]] = d
+                passages.append(d)
                 continue
-            self.documents.append({"text": text, "meta": meta})
-            emb = self.embedder.encode(text, normalize_embeddings=True)
-            new_embs.append(emb)
-            new_texts.append(text)
-        if new_embs:
-            arr = np.array(new_embs, dtype="float32")
-            self.index.add(arr)
-            if self.embeddings.shape[0] == 0:
-                self.embeddings = arr
+            # Repeated within the batch: stored once, with every document as an owner.
+            f, owners = first[d["hash"]], _owners(d["meta"])
+            if _owned(f["meta"], owners):
+                duplicates += 1
             else:
-                self.embeddings = np.vstack([self.embeddings, arr])
-        texts = [d["text"] for d in self.documents]
-        if texts:
-            self.tfidf_matrix = self.tfidf.fit_transform(texts)
-        self._save()
+                shared += 1
+            f["meta"] = _share(f["meta"], owners) or f["meta"]
+        reuse = {}
+        if replace:
+            with self._rw.read():
+                for row in self.metadata.rows({"doc_id": replace}):
+                    reuse.setdefault(self.documents[row]["hash"], self.embeddings[row])
+        # Text already indexed needs no vector; it is either dropped or shared under the lock.
+        reused = np.array([d["hash"] in reuse for d in passages], dtype=bool)
+        known = np.array([d["hash"] in self._hash_ids for d in passages], dtype=bool) & ~reused
+        todo = np.flatnonzero(~reused & ~known)
+        embedded, report = embed_texts(self.embedder, [passages[i]["text"] for i in todo], batch_size, progress)
+        arr = np.zeros((len(passages), self.embedding_dim), dtype="float32")
+        for i in np.flatnonzero(reused):
+            arr[i] = reuse[passages[i]["hash"]]
+        if len(todo):
+            arr[todo] = embedded
+        replaced = 0
+        if passages or replace:
+            with self._lock:
+                if replace:
+                    replaced = self._drop_documents(replace)
+                match = np.array([self._hash_ids.get(d["hash"], -1) for d in passages], dtype="int64")
+                # Passages deleted since the check above need the vector after all.
+                late = np.flatnonzero(known & (match < 0))
+                if len(late):
+                    arr[late], _ = embed_texts(self.embedder, [passages[i]["text"] for i in late])
+                check = np.flatnonzero((match < 0) & ~reused)   # reused vectors were accepted before
+                match[check] = self._near_duplicates(arr[check])
+                changes = {}
+                for i in np.flatnonzero(match >= 0):
+                    row = self._row_of[int(match[i])]
+                    current, owners = changes.get(row, self.documents[row]["meta"]), _owners(passages[i]["meta"])
+                    if _owned(current, owners):
+                        duplicates += 1
+                    else:
+                        shared += 1
+                    # A duplicate still records a new uploader of its document
+                    meta = _share(current, owners)
+                    if meta is not None:
+                        changes[row] = meta
+                if changes:
+                    self._set_meta(changes)
+                keep = match < 0
+                passages = [d for d, k in zip(passages, keep) if k]
+                arr = arr[keep]
+                for d in passages:
+                    d["id"] = self._next_id
+                    self._next_id += 1
+                if passages:
+                    self.wal.append([({"op": "add", "doc": d}, vec) for d, vec in zip(passages, arr)])
+                    self._apply(passages, arr)
+            self._maybe_compact()
+            self._maybe_rebuild_index()
+            self._maybe_reclaim()
+        report["duplicates"] = duplicates
+        report["shared"] = shared
+        report["indexed"] = len(passages)
+        report["reused"] = int(reused.sum())
+        report["replaced"] = replaced
+        report["total_seconds"] = round(time.perf_counter() - started, 3)
+        return report
+
+    def _near_duplicates(self, arr: np.ndarray) -> np.ndarray:
+        # Id of the indexed passage each vector nearly duplicates, else -1.
+        # Called under self._lock, so the index cannot change underneath the lookup.
+        out = np.full(len(arr), -1, dtype="int64")
+        if NEAR_DUP_THRESHOLD <= 0 or not self.index.ntotal or not len(arr):
+            return out
+        D, I = vector_search(self.index, arr, 1, self._deny)
+        near = (D[:, 0] >= NEAR_DUP_THRESHOLD) & (I[:, 0] >= 0)
+        out[near] = I[near, 0]
+        return out
+
+    def _set_meta(self, changes: Dict[int, Dict]):
+        # Caller holds self._lock. Logged with the whole new meta, keyed by passage id.
+        self.wal.append([({"op": "meta", "id": int(self.ids[row]), "meta": meta}, None)
+                         for row, meta in changes.items()])
+        self._apply_meta(changes)
+
+    def _apply_meta(self, changes: Dict[int, Dict]):
+        with self._rw.write():
+            for row, meta in changes.items():
+                d = self.documents[row]
+                self.metadata.update(row, d["meta"], meta)
+                d["meta"] = meta
+                if self._reclaiming:
+                    self._retagged.add(d["id"])
+            self.corpus_version += 1
+
+    def ingest_documents(self, items: Iterable[Tuple[str, object, Dict]], batch_size: int = EMBED_BATCH_SIZE, progress=None,
+                         replace: bool = False) -> Dict:
+        """
+        Chunk ``(doc_id, pages, meta)`` documents and ingest all their passages in one pass.
+        With ``replace`` each item supersedes whatever is indexed under its doc_id.
+        """
+        items = list(items)
+        chunks = [c for doc_id, pages, meta in items for c in chunk_document(doc_id, pages, meta)]
+        report = self.ingest(chunks, batch_size, progress, replace=[doc_id for doc_id, _, _ in items] if replace else ())
+        report["documents"] = len(items)
+        return report
+
+    def add_documents(self, docs: List[Tuple[str, Dict]]):
+        self.ingest(docs)
+
+    def add_document(self, doc_id: str, pages, meta: Dict):
+        """Chunk one document (whole text or one string per page) and index its passages."""
+        return self.ingest_documents([(doc_id, pages, meta)])["indexed"]
+
+    def upsert(self, doc_id: str, pages, meta: Dict) -> Dict:
+        """
+        Index a new version of ``doc_id``: its old passages are deleted and the
+        new ones added in one write, re-embedding only passages whose text changed.
+        Returns the ingest report.
+        """
+        return self.ingest_documents([(doc_id, pages, meta)], replace=True)
+
+    def delete(self, doc_id: str) -> int:
+        """Delete every passage of ``doc_id``; returns how many there were."""
+        return self.delete_documents([doc_id])
+
+    def delete_documents(self, doc_ids: Iterable[str]) -> int:
+        """
+        Delete every passage of the given documents. They are tombstoned, so
+        they leave search results at once; their rows are reclaimed by a
+        background compaction once tombstones reach RAG_TOMBSTONE_RATIO.
+        """
+        doc_ids = sorted(set(doc_ids))
+        if not doc_ids:
+            return 0
+        with self._lock:
+            n = self._drop_documents(doc_ids)
+        self._maybe_reclaim()
+        return n
+
+    def _drop_documents(self, doc_ids: List[str]) -> int:
+        # Caller holds self._lock. Passages other documents still own only lose these owners.
+        rows = self.metadata.rows({"doc_id": doc_ids})
+        wanted = {str(i) for i in doc_ids}
+        dead, changes = [], {}
+        for row in rows.tolist():
+            meta = _unshare(self.documents[row]["meta"], wanted)
+            if meta is None:
+                dead.append(row)
+            else:
+                changes[row] = meta
+        if changes:
+            self._set_meta(changes)
+        if dead:
+            self._delete_rows(np.array(dead, dtype="int64"))
+        return len(rows)
 
-    def semantic_search(self, query: str, k: int = 5):
+    def _delete_rows(self, rows: np.ndarray):
+        # Caller holds self._lock. Logged by passage id, which is never reused.
+        self.wal.append([({"op": "delete", "ids": self.ids[rows].tolist()}, None)])
+        self._tombstone(rows)
+
+    def _tombstone(self, rows):
+        with self._rw.write():
+            self._mark_dead(rows)
+            self.corpus_version += 1
+
+    def _mark_dead(self, rows):
+        # Caller holds self._rw for writing.
+        for row in rows:
+            d = self.documents[row]
+            self._tombstones.add(d["id"])
+            if self._hash_ids.get(d["hash"]) == d["id"]:
+                del self._hash_ids[d["hash"]]
+        self.keyword.delete(rows)
+        self.metadata.delete(rows)
+        self._deny = deny(np.fromiter(self._tombstones, dtype="int64")) if self._tombstones else None
+
+    def _maybe_reclaim(self):
+        if TOMBSTONE_RATIO > 0 and self._tombstones and len(self._tombstones) >= TOMBSTONE_RATIO * len(self.documents):
+            self.reclaim(background=True)
+
+    def reclaim(self, background: bool = False):
+        """
+        Compact tombstoned passages out of the documents, embeddings, FAISS,
+        keyword and metadata indexes. The compacted copies are built outside
+        the locks (FAISS drops the vectors in place where the backend can,
+        else it is rebuilt); passages added or deleted meanwhile are carried
+        over just before the swap, and a snapshot follows.
+        """
+        with self._lock:
+            if self._reclaiming or self._index_rebuilding or not self._tombstones:
+                return
+            self._reclaiming = True
+            n = len(self.documents)
+            documents, embeddings, ids = self.documents[:], self.embeddings, self.ids
+            metas = [d["meta"] for d in documents]
+            self._retagged = set()
+            dead = set(self._tombstones)
+            index = faiss.clone_index(self.index)
+            keyword = self.keyword.copy()
+
+        def run():
+            try:
+                started = time.perf_counter()
+                keep = np.array([d["id"] not in dead for d in documents], dtype=bool)
+                docs = [d for d, k in zip(documents, keep) if k]
+                embs, kept_ids = embeddings[keep], ids[keep]
+                rebuilt = not vector_remove(index, ids[~keep])
+                idx = self._build_index(embs, kept_ids) if rebuilt else index
+                base = len(docs)
+                kw = keyword.compact()
+                md = MetadataIndex()
+                md.add({"meta": m, "added": d.get("added")} for d, m, k in zip(documents, metas, keep) if k)
+                row_of = {d["id"]: row for row, d in enumerate(docs)}
+                hash_ids = {d["hash"]: d["id"] for d in docs}
+                with self._lock, self._rw.write():
+                    # Passages shared, released or tagged meanwhile: bring their postings up to date.
+                    for i in self._retagged:
+                        if i in row_of:
+                            md.update(row_of[i], metas[self._row_of[i]], docs[row_of[i]]["meta"])
+                    extra = self.documents[n:]
+                    if extra:
+                        idx.add_with_ids(self.embeddings[n:], self.ids[n:])
+                        kw.add(d["text"] for d in extra)
+                        md.add(extra)
+                        docs = docs + extra
+                        embs = np.vstack([embs, self.embeddings[n:]])
+                        kept_ids = np.concatenate([kept_ids, self.ids[n:]])
+                    later = self._tombstones - dead
+                    self.documents, self.embeddings, self.ids = docs, embs, kept_ids
+                    self._set_index(idx, base if rebuilt else self._index_trained_on)
+                    self.keyword, self.metadata = kw, md
+                    self._row_of, self._hash_ids = row_of, hash_ids
+                    self._register(extra, base)
+                    self._tombstones = set()
+                    self._mark_dead([self._row_of[i] for i in later])
+                    self.corpus_version += 1
+                print(f"RAG compaction reclaimed {len(dead)} deleted passages "
+                      f"in {time.perf_counter() - started:.1f}s")
+            except Exception as e:
+                print("RAG compaction failed, keeping tombstones:", e)
+                return
+            finally:
+                self._reclaiming = False
+            self.compact(background=True)
+            self._maybe_rebuild_index()
+
+        if background:
+            threading.Thread(target=run, name="rag-reclaim", daemon=True).start()
+        else:
+            run()
+
+    def document_passages(self, doc_id: str) -> int:
+        with self._rw.read():
+            return len(self.metadata.rows({"doc_id": doc_id}))
+
+    def tag_document(self, doc_id: str, field: str, value) -> int:
+        """
+        Add ``field=value`` (e.g. another uploader) to every passage of
+        ``doc_id`` without re-indexing it. Returns the number of passages tagged.
+        """
+        with self._lock:
+            rows = self.metadata.rows({"doc_id": doc_id})
+            if len(rows):
+                self.wal.append([({"op": "tag", "doc_id": doc_id, "field": field, "value": value}, None)])
+                self._apply_meta({row: _tagged(self.documents[row]["meta"], doc_id, field, value)
+                                  for row in rows.tolist()})
+        return len(rows)
+
+    def _embed_query(self, query: str) -> np.ndarray:
+        key = normalize_query(query)
+        emb = self.embedding_cache.get(key)
+        if emb is None:
+            # Concurrent queries share one batched encode instead of each running their own.
+            emb = self.query_encoder.encode(query).reshape(1, -1)
+            self.embedding_cache.put(key, emb)
+        return emb
+
+    # Callers of the underscored search helpers must hold self._rw for reading.
+    # They return (doc_id, score) candidates; _hydrate turns ids back into passages.
+    # ``rows`` (from self.metadata) restricts both retrievers to the passages a filter allows.
+    def _semantic(self, q_emb: np.ndarray, k: int, rows: np.ndarray = None) -> List[Tuple[int, float]]:
+        if rows is not None and len(rows) <= FILTER_EXACT_MAX:
+            # A small partition (one user's uploads, one space) is cheaper to score
+            # exactly than to search for in the whole index.
+            scores = self.embeddings[rows] @ q_emb[0]
+            top = np.argsort(-scores, kind="stable")[:k]
+            return [(int(self.ids[rows[i]]), float(scores[i])) for i in top]
+        # FAISS is keyed by passage id; tombstones are kept out by the selector.
+        D, I = vector_search(self.index, q_emb, k, allow(self.ids[rows]) if rows is not None else self._deny)
+        return [(int(i), float(score)) for score, i in zip(D[0], I[0]) if i >= 0]
+
+    def _keyword(self, query: str, k: int, rows: np.ndarray = None) -> List[Tuple[int, float]]:
+        return [(self.documents[i]["id"], score) for i, score in self.keyword.search(query, k, rows)]
+
+    def _hydrate(self, hits: List[Tuple[int, float]], method: str) -> List[Dict]:
+        return [{**self.documents[self._row_of[doc_id]], "score": float(score), "method": method} for doc_id, score in hits]
+
+    def semantic_search(self, query: str, k: int = 5, filters: Dict = None):
         if not self.documents:
             return []
-        q_emb = self.embedder.encode(query, normalize_embeddings=True).astype("float32").reshape(1, -1)
-        D, I = self.index.search(q_emb, k)
-        results = []
-        for score, idx in zip(D[0], I[0]):
-            if idx < 0 or idx >= len(self.documents):
-                continue
-            results.append({**self.documents[idx], "score": float(score), "method": "semantic"})
-        return results
+        q_emb = self._embed_query(query)
+        with self._rw.read():
+            return self._hydrate(self._semantic(q_emb, k, self.metadata.rows(filters)), "semantic")
 
-    def keyword_search(self, query: str, k: int = 5):
-        if self.tfidf_matrix is None or not self.documents:
-            return []
-        qv = self.tfidf.transform([query])
-        sims = cosine_similarity(qv, self.tfidf_matrix).flatten()
-        idx = sims.argsort()[::-1][:k]
-        return [{**self.documents[i], "score": float(sims[i]), "method": "keyword"} for i in idx]
+    def keyword_search(self, query: str, k: int = 5, filters: Dict = None):
+        with self._rw.read():
+            return self._hydrate(self._keyword(query, k, self.metadata.rows(filters)), "keyword")
 
-    def search(self, query: str, k: int = 5, alpha: float = 0.7):
+    def search(self, query: str, k: int = 5, alpha: float = 0.7, fusion: str = DEFAULT_FUSION, filters: Dict = None):
+        """
+        Hybrid search. ``fusion`` is ``"weighted"`` (normalised score blend,
+        ``alpha`` weighting the semantic side) or ``"rrf"`` (reciprocal rank fusion).
+        ``filters`` restricts retrieval by user / space / source / type / since /
+        until (see metadata_index.py) before ranking, so k results still come back.
+        """
         if not self.documents:
             return []
-        sem = self.semantic_search(query, k*2)
-        key = self.keyword_search(query, k*2)
-        combined = {}
-        def add(item, weight):
-            meta_id = item["meta"].get("path") or item["meta"].get("filename") or str(id(item))
-            combined[meta_id] = combined.get(meta_id, 0) + weight * item["score"]
-        for r in sem:
-            add(r, alpha)
-        for r in key:
-            add(r, 1 - alpha)
-        top = sorted(combined.items(), key=lambda x: x[1], reverse=True)[:k]
-        results = []
-        for meta_id, score in top:
-            for d in self.documents:
-                if d["meta"].get("path") == meta_id or d["meta"].get("filename") == meta_id or str(id(d)) == meta_id:
-                    results.append({**d, "score": float(score), "method": "hybrid"})
-                    break
+        cache_key = (normalize_query(query), k, alpha, fusion, filter_key(filters))
+        cached = self.result_cache.get(cache_key, self.corpus_version)
+        if cached is not None:
+            return [dict(r) for r in cached]
+        q_emb = self._embed_query(query)
+        with self._rw.read():
+            version = self.corpus_version
+            rows = self.metadata.rows(filters)
+            sem = self._semantic(q_emb, k*2, rows)
+            key = self._keyword(query, k*2, rows)
+            results = self._hydrate(fuse(sem, key, k, alpha, fusion), "hybrid")
+        self.result_cache.put(cache_key, [dict(r) for r in results], version)
         return results
+
+    def cache_stats(self) -> Dict:
+        return {"corpus_version": self.corpus_version,
+                "embeddings": self.embedding_cache.stats(),
+                "results": self.result_cache.stats()}
+
+    def index_stats(self) -> Dict:
+        return {"backend": self.index_backend,
+                "vectors": int(self.index.ntotal),
+                "trained_on": self._index_trained_on,
+                "rebuilding": self._index_rebuilding,
+                "tombstones": len(self._tombstones),
+                "reclaiming": self._reclaiming}
@@ -1,5 +1,6 @@
-import os
+import os, hashlib, uuid
 from pathlib import Path
+from typing import Dict
 from urllib.parse import quote_plus
 try:
     from azure.storage.blob import BlobServiceClient
@@ -9,6 +10,22 @@ except Exception:
 STORAGE_BACKEND = os.getenv("STORAGE_BACKEND","local")
 AZURE_CONN = os.getenv("AZURE_STORAGE_CONNECTION_STRING","")
 AZURE_CONTAINER = os.getenv("AZURE_CONTAINER_NAME","chatbot")
+# Uploads are copied in UPLOAD_CHUNK_BYTES pieces and refused past MAX_UPLOAD_BYTES (0 = no limit);
+# blobs go up as AZURE_BLOCK_BYTES blocks. Azurite ("UseDevelopmentStorage=true") works as a local stand-in.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+AZURE_BLOCK_BYTES = int(os.getenv("AZURE_BLOCK_BYTES", str(4 * 1024 * 1024)))
+AZURE_UPLOAD_CONCURRENCY = int(os.getenv("AZURE_UPLOAD_CONCURRENCY", "2"))
+
+class UploadTooLarge(Exception):
+    pass
+
+def file_sha256(path: Path, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
 
 class StorageManager:
     def __init__(self, upload_dir: str = "./uploads"):
@@ -18,7 +35,8 @@ class StorageManager:
         self.azure_client = None
         if self.backend and self.backend.startswith("azure") and BlobServiceClient and AZURE_CONN:
             try:
-                self.azure_client = BlobServiceClient.from_connection_string(AZURE_CONN)
+                self.azure_client = BlobServiceClient.from_connection_string(
+                    AZURE_CONN, max_block_size=AZURE_BLOCK_BYTES, max_single_put_size=AZURE_BLOCK_BYTES)
                 try:
                     self.azure_client.create_container(AZURE_CONTAINER)
                 except Exception:
@@ -27,18 +45,59 @@ class StorageManager:
                 print("Azure init error:", e)
                 self.azure_client = None
 
-    def save_file(self, local_path: Path):
+    def save_stream(self, stream, suffix: str = "", max_bytes: int = MAX_UPLOAD_BYTES) -> Dict:
+        """
+        Copy a file-like ``stream`` to disk chunk by chunk, hashing as it goes,
+        then store it like ``save_file``. Raises ``UploadTooLarge`` (leaving
+        nothing behind) once more than ``max_bytes`` arrive.
+        """
+        tmp = self.upload_dir / f"incoming-{uuid.uuid4()}{suffix}"
+        h = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp, "wb") as f:
+                for block in iter(lambda: stream.read(UPLOAD_CHUNK_BYTES), b""):
+                    size += len(block)
+                    if max_bytes and size > max_bytes:
+                        raise UploadTooLarge(f"upload exceeds {max_bytes} bytes")
+                    h.update(block)
+                    f.write(block)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        stored = self.save_file(tmp, digest=h.hexdigest())
+        stored["size"] = size
+        return stored
+
+    def save_file(self, local_path: Path, digest: str = None) -> Dict:
+        """
+        Content-addressed save: the file is stored as ``<sha256><ext>`` and
+        bytes that are already stored are neither kept twice nor re-uploaded.
+        Returns ``{"name", "path", "url", "sha256", "duplicate"}``.
+        """
+        local_path = Path(local_path)
+        digest = digest or file_sha256(local_path)
+        name = digest + local_path.suffix.lower()
+        dest = self.upload_dir / name
+        duplicate = dest.exists()
+        if duplicate:
+            if local_path.resolve() != dest.resolve():
+                local_path.unlink()
+        else:
+            os.replace(local_path, dest)
+        url = str(dest)
         if self.azure_client:
             try:
                 container_client = self.azure_client.get_container_client(AZURE_CONTAINER)
-                blob_name = local_path.name
-                with open(local_path, "rb") as data:
-                    container_client.upload_blob(name=blob_name, data=data, overwrite=True)
-                return f"https://{self.azure_client.account_name}.blob.core.windows.net/{AZURE_CONTAINER}/{quote_plus(blob_name)}"
+                blob_client = container_client.get_blob_client(name)
+                if not blob_client.exists():
+                    with open(dest, "rb") as data:
+                        # Streams the file as staged blocks instead of one in-memory put.
+                        blob_client.upload_blob(data, overwrite=True, max_concurrency=AZURE_UPLOAD_CONCURRENCY)
+                url = f"https://{self.azure_client.account_name}.blob.core.windows.net/{AZURE_CONTAINER}/{quote_plus(name)}"
             except Exception as e:
                 print("Azure upload failed:", e)
-                return str(local_path)
-        return str(local_path)
+        return {"name": name, "path": str(dest), "url": url, "sha256": digest, "duplicate": duplicate}
 
     def get_file(self, filename: str, dest: str = None):
         dest = dest or str(self.upload_dir / filename)
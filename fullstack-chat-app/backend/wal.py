@@ -0,0 +1,140 @@
+"""
+Append-only write-ahead log for RAGStore.
+
+New passages are appended here (metadata plus raw vector) instead of
+rewriting the whole snapshot on every upload. ``wal-<generation>.log``
+holds everything added on top of snapshot ``<generation>``; compaction
+writes the next snapshot, and once it is live the older logs are deleted.
+On startup the store loads the current snapshot and replays the logs from
+its generation onwards.
+
+Record layout (little endian)::
+
+    u32 payload length | u32 crc32(payload) | payload
+    payload = u32 header length | JSON header | float32 vector bytes
+
+A torn or corrupt tail (crash mid-append) ends the replay of that log and is
+truncated away so new appends start from the last good record.
+"""
+import json
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+_RECORD = struct.Struct("<II")
+_HEADER_LEN = struct.Struct("<I")
+
+Record = Tuple[Dict, Optional[np.ndarray]]
+
+
+class WriteAheadLog:
+    def __init__(self, storage_dir: Path, model_name: str, dim: int):
+        self.storage_dir = Path(storage_dir)
+        self.model_name = model_name
+        self.dim = int(dim)
+        self.generation = None
+        self._f = None
+
+    def path(self, generation: int) -> Path:
+        return self.storage_dir / f"wal-{generation:010d}.log"
+
+    def _logs(self) -> List[Tuple[int, Path]]:
+        out = []
+        for p in self.storage_dir.glob("wal-*.log"):
+            try:
+                out.append((int(p.stem.split("-", 1)[1]), p))
+            except ValueError:
+                continue
+        return sorted(out)
+
+    @staticmethod
+    def _encode(header: Dict, vector: Optional[np.ndarray]) -> bytes:
+        hdr = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        payload = _HEADER_LEN.pack(len(hdr)) + hdr
+        if vector is not None:
+            payload += np.ascontiguousarray(vector, dtype="float32").tobytes()
+        return _RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def _write(self, data: bytes):
+        self._f.write(data)
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def open(self, generation: int):
+        """Start appending to the log for ``generation``."""
+        self.close()
+        p = self.path(generation)
+        fresh = not p.exists() or p.stat().st_size == 0
+        self._f = open(p, "ab")
+        self.generation = generation
+        if fresh:
+            # Every log starts by naming the model its vectors came from.
+            self._write(self._encode({"op": "begin", "model": self.model_name, "dim": self.dim}, None))
+
+    def rotate(self, generation: int):
+        self.open(generation)
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def size(self) -> int:
+        return self._f.tell() if self._f is not None else 0
+
+    def append(self, records: List[Record]) -> int:
+        """Durably append a batch of records with a single fsync; returns bytes written."""
+        if not records:
+            return 0
+        data = b"".join(self._encode(h, v) for h, v in records)
+        self._write(data)
+        return len(data)
+
+    def replay(self, from_generation: int) -> List[Record]:
+        """
+        Read every record logged on top of snapshot ``from_generation``.
+
+        Vectors written by a different embedding model are returned as None
+        so the caller re-embeds those texts.
+        """
+        out: List[Record] = []
+        for gen, p in self._logs():
+            if gen < from_generation:
+                continue
+            data = p.read_bytes()
+            pos = 0
+            usable = False
+            while pos + _RECORD.size <= len(data):
+                length, crc = _RECORD.unpack_from(data, pos)
+                payload = data[pos + _RECORD.size:pos + _RECORD.size + length]
+                if len(payload) != length or zlib.crc32(payload) != crc:
+                    break
+                hlen = _HEADER_LEN.unpack_from(payload)[0]
+                header = json.loads(payload[_HEADER_LEN.size:_HEADER_LEN.size + hlen].decode("utf-8"))
+                raw = payload[_HEADER_LEN.size + hlen:]
+                pos += _RECORD.size + length
+                if header.get("op") == "begin":
+                    usable = header.get("model") == self.model_name and header.get("dim") == self.dim
+                    continue
+                vector = None
+                if raw and usable and len(raw) == self.dim * 4:
+                    vector = np.frombuffer(raw, dtype="float32")
+                out.append((header, vector))
+            if pos < len(data):
+                print(f"RAG WAL {p.name}: dropping {len(data) - pos} bytes of torn tail")
+                with open(p, "r+b") as f:
+                    f.truncate(pos)
+        return out
+
+    def drop_before(self, generation: int):
+        """Delete logs that are fully contained in snapshot ``generation``."""
+        for gen, p in self._logs():
+            if gen < generation:
+                try:
+                    p.unlink()
+                except OSError:
+                    pass
@@ -49,8 +49,17 @@ document.getElementById("send").onclick = async () => {
         headers: {"Content-Type":"application/json","Authorization": `Bearer ${token}`},
         body: JSON.stringify({query: q})
     });
-    const reader = res.body.getReader(); const decoder = new TextDecoder(); let botMessage = "";
-    while(true){ const {done, value} = await reader.read(); if(done) break; botMessage += decoder.decode(value); renderBotTyping(botMessage); }
+    const reader = res.body.getReader(); const decoder = new TextDecoder(); let botMessage = ""; let buffer = "";
+    while(true){
+        const {done, value} = await reader.read(); if(done) break;
+        buffer += decoder.decode(value, {stream: true});
+        const events = buffer.split("\n\n"); buffer = events.pop();
+        for(const ev of events){
+            const data = ev.split("\n").find(l => l.startsWith("data: "));
+            if(!data || ev.startsWith("event: done")) continue;
+            const payload = JSON.parse(data.slice(6)); if(payload.chunk){ botMessage += payload.chunk; renderBotTyping(botMessage); }
+        }
+    }
     console.log("text reply")
     console.log(botMessage)
     finalizeBotMessage(botMessage, "Text Agent");
@@ -60,9 +69,13 @@ document.getElementById("uploadBtn").onclick = async () => {
     const file = document.getElementById("fileUpload").files[0]; if(!file) return alert("Select a file");
     const form = new FormData(); form.append("file", file);
     const res = await fetch(`${API_BASE}/upload`, { method:"POST", headers: { "Authorization": `Bearer ${token}` }, body: form });
-    const data = await res.json(); alert(JSON.stringify(data)); if(file.type.startsWith("image/")){ appendUploadedImage(file); } else { appendUploadedFile(file); }
+    const data = await res.json(); if(file.type.startsWith("image/")){ appendUploadedImage(file); } else { appendUploadedFile(file); }
+    if(data.job_id){ pollJob(data.job_id, file.name); } else { alert(JSON.stringify(data)); }
 }
 
+// Ingestion runs in the background; poll the job until it finishes.
+async function pollJob(jobId, name){ const res = await fetch(`${API_BASE}/jobs/${jobId}`, { headers: { "Authorization": `Bearer ${token}` } }); const job = await res.json(); if(job.status === "done"){ alert(`${name} indexed: ${job.result.chunks} chunks`); } else if(job.status === "failed"){ alert(`${name} failed: ${job.error}`); } else { setTimeout(() => pollJob(jobId, name), 1000); } }
+
 async function loadHistory(){ const res = await fetch(`${API_BASE}/history`, { headers: { "Authorization": `Bearer ${token}` } }); const data = await res.json(); data.forEach(msg => { appendMessage(msg.content, msg.role === 'assistant' ? 'bot' : 'user'); }); }
 
 function appendMessage(text,cls,agent=""){ const container = document.createElement("div"); container.className = `message ${cls}`; if(agent){ const label = document.createElement("div"); label.className = "agent-label"; label.textContent = agent; container.appendChild(label); } const content = document.createElement("div"); content.textContent = text; container.appendChild(content); chatDiv.appendChild(container); chatDiv.scrollTop = chatDiv.scrollHeight; }
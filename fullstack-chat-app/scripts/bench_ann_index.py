@@ -0,0 +1,86 @@
+# scripts/bench_ann_index.py
+# Compare the RAGStore vector index backends against the exact flat index.
+#
+#   python scripts/bench_ann_index.py --n 100000 --dim 384 --queries 500
+#   python scripts/bench_ann_index.py --embeddings backend/rag_data/snap-0000000003/embeddings.npy
+#
+# Reports build time, per-query latency and recall@k (overlap with the flat
+# top-k) so RAG_ANN_THRESHOLD / RAG_IVF_NPROBE / RAG_HNSW_EF_SEARCH can be
+# tuned against real corpus sizes. Synthetic data is a Gaussian mixture of
+# normalised vectors, which clusters roughly like sentence embeddings do.
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from vector_index import BACKENDS, build_index  # noqa: E402
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def normalize(x):
+    return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype("float32")
+
+
+def synthetic(n, dim, clusters, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim))
+    labels = rng.integers(0, clusters, n)
+    return normalize(centers[labels] + 0.6 * rng.standard_normal((n, dim)))
+
+
+def main(args):
+    if args.embeddings:
+        data = normalize(np.load(args.embeddings))
+    else:
+        data = synthetic(args.n + args.queries, args.dim, args.clusters, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    pick = rng.choice(len(data), size=min(args.queries, len(data)), replace=False)
+    if args.embeddings:
+        # Perturbed copies of stored passages stand in for user queries
+        queries = normalize(data[pick] + 0.1 * rng.standard_normal(data[pick].shape))
+        base = data
+    else:
+        mask = np.zeros(len(data), dtype=bool)
+        mask[pick] = True
+        queries, base = data[mask], data[~mask]
+    dim = base.shape[1]
+    print(f"vectors={len(base)} dim={dim} queries={len(queries)} k={args.k}")
+
+    truth = None
+    for kind in args.backends:
+        started = time.perf_counter()
+        index = build_index(kind, dim, base, np.arange(len(base)))
+        build = time.perf_counter() - started
+        latencies, found = [], []
+        for q in queries:
+            t = time.perf_counter()
+            _, I = index.search(q.reshape(1, -1), args.k)
+            latencies.append(time.perf_counter() - t)
+            found.append(I[0])
+        if truth is None:
+            if kind != "flat":
+                raise SystemExit("the first backend must be flat (it is the recall baseline)")
+            truth = found
+        recall = np.mean([len(set(f) & set(t)) / args.k for f, t in zip(found, truth)])
+        print(f"{kind:>9}: build={build:7.2f}s p50={pct(latencies, 50) * 1000:7.3f}ms "
+              f"p99={pct(latencies, 99) * 1000:7.3f}ms recall@{args.k}={recall:.4f}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=50000)
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--clusters", type=int, default=200)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--embeddings", help="embeddings.npy from a RAG snapshot instead of synthetic data")
+    ap.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    main(ap.parse_args())
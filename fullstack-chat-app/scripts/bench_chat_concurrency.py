@@ -0,0 +1,85 @@
+# scripts/bench_chat_concurrency.py
+# Fire N parallel /chat requests at a running backend and report latency percentiles.
+#
+#   python scripts/mock_openai_server.py --port 8001 &
+#   OPENAI_API_KEY=test OPENAI_BASE_URL=http://127.0.0.1:8001/v1 uvicorn app:app --port 8000 &
+#   python scripts/bench_chat_concurrency.py --concurrency 32 --requests 256
+#
+# Time-to-first-chunk shows whether one request's retrieval or DB write is
+# stalling the others on the event loop; total time includes the stream.
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+def pct(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def login(client, user, password):
+    await client.post("/register", json={"username": user, "password": password})
+    r = await client.post("/login", json={"username": user, "password": password})
+    r.raise_for_status()
+    return r.json()["access_token"]
+
+
+async def one_chat(client, token, query):
+    started = time.perf_counter()
+    first = None
+    async with client.stream("POST", "/chat", json={"query": query},
+                             headers={"Authorization": f"Bearer {token}"}) as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            if first is None and line.startswith("data: "):
+                first = time.perf_counter() - started
+            if line.startswith("event: done"):
+                break
+    return first if first is not None else float("nan"), time.perf_counter() - started
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        token = await login(client, args.user, args.password)
+        sem = asyncio.Semaphore(args.concurrency)
+        ttfb, total, errors = [], [], 0
+
+        async def worker(i):
+            nonlocal errors
+            async with sem:
+                try:
+                    f, t = await one_chat(client, token, f"{args.query} #{i}")
+                    ttfb.append(f)
+                    total.append(t)
+                except Exception as e:
+                    errors += 1
+                    print("request failed:", e)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(args.requests)))
+        wall = time.perf_counter() - started
+
+    print(f"requests={args.requests} concurrency={args.concurrency} errors={errors} wall={wall:.2f}s "
+          f"throughput={len(total) / wall:.1f} req/s")
+    for name, vals in (("first chunk", ttfb), ("total", total)):
+        if vals:
+            print(f"{name:>11}: p50={pct(vals, 50) * 1000:.0f}ms p99={pct(vals, 99) * 1000:.0f}ms "
+                  f"mean={statistics.mean(vals) * 1000:.0f}ms max={max(vals) * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--requests", type=int, default=128)
+    ap.add_argument("--query", default="How do I get access to the build servers?")
+    ap.add_argument("--user", default="bench")
+    ap.add_argument("--password", default="bench")
+    ap.add_argument("--timeout", type=float, default=120.0)
+    asyncio.run(main(ap.parse_args()))
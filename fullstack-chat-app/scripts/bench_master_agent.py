@@ -0,0 +1,86 @@
+# scripts/bench_master_agent.py
+# Latency of MasterAgent.generate: the old one-after-another loop vs. the parallel fan-out.
+#
+#   python scripts/bench_master_agent.py --llm-ms 800 --search-ms 300 --slow-ms 5000 --timeout 2
+#
+# Stub agents stand in for TextAgent (LLM call) and ConfluenceAgent (CQL
+# search) with the given latencies; --slow-ms adds a third agent that hangs,
+# to show the per-agent deadline and the first/quorum policies at work.
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from agents import MASTER_POLICIES, MasterAgent  # noqa: E402
+
+
+class StubLLM:
+    def __init__(self, ms):
+        self.ms = ms
+
+    def generate(self, prompt, context=""):
+        time.sleep(self.ms / 1000.0)
+        return f"[llm] {prompt}"
+
+
+class StubSearch:
+    def __init__(self, ms):
+        self.ms = ms
+
+    def search(self, query):
+        time.sleep(self.ms / 1000.0)
+        return [{"title": f"page about {query}", "id": "1"}]
+
+
+class StubSlow(StubSearch):
+    # Hangs like a stuck HTTP call, but honours the deadline MasterAgent passes
+    # in, as an HTTP client timeout would.
+    def search(self, query, timeout=None):
+        time.sleep(min(self.ms / 1000.0, timeout if timeout is not None else float("inf")))
+        return [{"title": f"page about {query}", "id": "2"}]
+
+
+def sequential(agents, prompt):
+    # MasterAgent.generate before the fan-out.
+    parts = []
+    for a in agents:
+        parts.append(a.generate(prompt, "") if hasattr(a, "generate") else str(a.search(prompt)))
+    return "\n\n".join(p for p in parts if p)
+
+
+def timed(fn, n):
+    out = []
+    for _ in range(n):
+        started = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - started) * 1000.0)
+    return statistics.median(out), max(out)
+
+
+def main(args):
+    agents = [StubLLM(args.llm_ms), StubSearch(args.search_ms)]
+    if args.slow_ms:
+        agents.append(StubSlow(args.slow_ms))
+    print(f"agents: llm {args.llm_ms} ms, search {args.search_ms} ms"
+          + (f", slow {args.slow_ms} ms" if args.slow_ms else "") + f"; timeout {args.timeout} s")
+    p50, worst = timed(lambda: sequential(agents, "q"), args.repeat)
+    print(f"{'sequential (old)':>18}: p50 {p50:8.1f} ms  max {worst:8.1f} ms")
+    for policy in MASTER_POLICIES:
+        master = MasterAgent(agents, policy=policy, timeout=args.timeout)
+        p50, worst = timed(lambda: master.generate("q"), args.repeat)
+        abandoned = sum(st["abandoned"] for st in master.stats()["agents"].values())
+        print(f"{policy:>18}: p50 {p50:8.1f} ms  max {worst:8.1f} ms  abandoned {abandoned}  "
+              f"still running {master.stats()['running']}")
+        master._executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--llm-ms", type=float, default=800)
+    ap.add_argument("--search-ms", type=float, default=300)
+    ap.add_argument("--slow-ms", type=float, default=0, help="add an agent that takes this long")
+    ap.add_argument("--timeout", type=float, default=30, help="per-agent deadline in seconds")
+    ap.add_argument("--repeat", type=int, default=5)
+    main(ap.parse_args())
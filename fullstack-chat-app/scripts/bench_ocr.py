@@ -0,0 +1,63 @@
+# scripts/bench_ocr.py
+# Images/sec of ImageAgent OCR: one tesseract call per image (old) vs. the pool in ocr.py.
+#
+#   python scripts/bench_ocr.py ~/Pictures/screenshots --workers 1 2 4
+#
+# Every image in the folder (png/jpg/jpeg/tif/bmp) is OCR'd serially on the raw
+# image, then through an OcrPool per worker count, cold (empty cache) and warm
+# (every image already cached). Needs pytesseract and the tesseract binary.
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import wait
+
+import pytesseract
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from ocr import OcrPool  # noqa: E402
+
+EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+
+
+def run_pool(pool, paths):
+    started = time.perf_counter()
+    futures = [pool.submit(p) for p in paths]
+    wait(futures)
+    for f in futures:
+        f.result()
+    return len(paths) / (time.perf_counter() - started)
+
+
+def main(args):
+    paths = sorted(os.path.join(args.folder, f) for f in os.listdir(args.folder) if f.lower().endswith(EXTENSIONS))
+    if args.limit:
+        paths = paths[:args.limit]
+    if not paths:
+        sys.exit(f"no images in {args.folder}")
+    mb = sum(os.path.getsize(p) for p in paths) / 2 ** 20
+    print(f"{args.folder}: {len(paths)} images, {mb:.1f} MiB")
+    if not args.skip_serial:
+        started = time.perf_counter()
+        for p in paths:
+            pytesseract.image_to_string(Image.open(p))
+        print(f"{'serial (old)':>16}: {len(paths) / (time.perf_counter() - started):8.2f} images/s")
+    for workers in args.workers:
+        pool = OcrPool(workers=workers, max_dim=args.max_dim)
+        pool.ocr(paths[0])   # start the worker processes
+        pool.cache.clear()
+        cold = run_pool(pool, paths)
+        warm = run_pool(pool, paths)
+        print(f"{f'workers={workers}':>16}: {cold:8.2f} images/s cold, {warm:10.1f} images/s cached")
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("folder")
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    ap.add_argument("--max-dim", type=int, default=2000, help="OCR_MAX_DIM for the pool runs")
+    ap.add_argument("--limit", type=int, default=0, help="only the first N images")
+    ap.add_argument("--skip-serial", action="store_true", help="skip the unpooled baseline")
+    main(ap.parse_args())
@@ -0,0 +1,72 @@
+# scripts/bench_pdf_extract.py
+# Pages/sec of PDF text extraction: serial vs. the process pool in pdf_extract.py.
+#
+#   python scripts/bench_pdf_extract.py backend/uploads/*_C.pdf --pages 400 --workers 1 2 4
+#
+# Short inputs such as uploads/C.pdf are tiled (their pages repeated) into a
+# --pages long document first so the parallel path has something to split.
+# The old path (one thread, string concatenation per page) is timed as well.
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import fitz
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+import pdf_extract  # noqa: E402
+
+
+def tile(src, pages):
+    out = fitz.open()
+    with fitz.open(src) as doc:
+        while out.page_count < pages:
+            out.insert_pdf(doc, to_page=min(doc.page_count, pages - out.page_count) - 1)
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    out.save(path)
+    out.close()
+    return path
+
+
+def concat_baseline(path):
+    started = time.perf_counter()
+    doc = fitz.open(path)
+    txt = ""
+    for p in doc:
+        txt += p.get_text("text") + "\n"
+    n = doc.page_count
+    doc.close()
+    return n / (time.perf_counter() - started)
+
+
+def main(args):
+    path = tile(args.pdf, args.pages) if args.pages else args.pdf
+    try:
+        with fitz.open(path) as doc:
+            print(f"{args.pdf}: {doc.page_count} pages")
+        best = max(concat_baseline(path) for _ in range(args.repeat))
+        print(f"{'concat (old)':>14}: {best:8.1f} pages/s")
+        for workers in args.workers:
+            if workers > 1:
+                pdf_extract._pool = None   # fresh pool sized for this run
+                pdf_extract.extract_pdf(path, workers=workers, ocr=not args.no_ocr)   # warm up worker processes
+            best = max(pdf_extract.extract_pdf(path, workers=workers, ocr=not args.no_ocr)["pages_per_sec"]
+                       for _ in range(args.repeat))
+            print(f"{f'workers={workers}':>14}: {best:8.1f} pages/s")
+            if pdf_extract._pool is not None:
+                pdf_extract._pool.shutdown()
+    finally:
+        if path != args.pdf:
+            os.unlink(path)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("pdf")
+    ap.add_argument("--pages", type=int, default=400, help="tile the input to this many pages (0 = as is)")
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--no-ocr", action="store_true", help="never OCR pages without a text layer")
+    main(ap.parse_args())
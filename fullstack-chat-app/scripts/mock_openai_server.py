@@ -0,0 +1,85 @@
+# scripts/mock_openai_server.py
+# Minimal OpenAI-compatible chat completions server for local testing.
+#
+#   python scripts/mock_openai_server.py --port 8001 --delay 0.02
+#   OPENAI_API_KEY=test OPENAI_BASE_URL=http://127.0.0.1:8001/v1 uvicorn app:app
+#
+# Answers every request with a fixed number of word tokens, waiting --delay
+# seconds before each one, streamed as chat.completion.chunk events when
+# the request sets stream=true.
+import argparse
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(delay, tokens, first_token_delay):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            model = body.get("model", "mock")
+            words = [f"token{i} " for i in range(tokens)]
+            cid = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+            if not body.get("stream"):
+                time.sleep(first_token_delay + delay * tokens)
+                data = json.dumps({
+                    "id": cid, "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "".join(words)}}],
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def send(obj):
+                payload = f"data: {obj}\n\n".encode()
+                self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+                self.wfile.flush()
+
+            time.sleep(first_token_delay)
+            for i, w in enumerate(words):
+                time.sleep(delay)
+                delta = {"content": w} if i else {"role": "assistant", "content": w}
+                send(json.dumps({
+                    "id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+                }))
+            send(json.dumps({
+                "id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }))
+            send("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8001)
+    ap.add_argument("--delay", type=float, default=0.02, help="seconds between tokens")
+    ap.add_argument("--first-token-delay", type=float, default=0.2)
+    ap.add_argument("--tokens", type=int, default=50)
+    args = ap.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.delay, args.tokens, args.first_token_delay))
+    print(f"mock OpenAI server on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
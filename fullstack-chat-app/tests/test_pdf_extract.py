@@ -0,0 +1,45 @@
+# tests/test_pdf_extract.py
+# Page-level PDF extraction through the shared process pool.
+# Run from fullstack-chat-app/:  python -m pytest tests
+import os
+import sys
+
+import fitz
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+import pdf_extract  # noqa: E402
+
+PAGES = 2 * pdf_extract.PDF_PARALLEL_MIN_PAGES
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    path = tmp_path / "doc.pdf"
+    with fitz.open() as doc:
+        for i in range(PAGES):
+            doc.new_page().insert_text((72, 72), f"page {i + 1} of the maintenance handbook")
+        doc.save(str(path))
+    return path
+
+
+def test_large_pdf_is_extracted_in_the_pool(pdf):
+    out = pdf_extract.extract_pdf(pdf, workers=2, ocr=False)
+    assert out["page_count"] == PAGES
+    assert [p.strip() for p in out["pages"]] == [f"page {i + 1} of the maintenance handbook" for i in range(PAGES)]
+
+
+def test_dead_worker_does_not_break_later_extractions(pdf):
+    pdf_extract.extract_pdf(pdf, workers=2, ocr=False)
+    broken = pdf_extract._pool
+    for proc in list(broken._processes.values()):
+        proc.terminate()
+        proc.join()
+
+    out = pdf_extract.extract_pdf(pdf, workers=2, ocr=False)
+    assert out["page_count"] == PAGES and "page 1 of" in out["pages"][0]
+    assert pdf_extract._pool is not broken
+
+    # The replacement pool takes work again
+    assert pdf_extract.extract_pdf(pdf, workers=2, ocr=False)["pages"] == out["pages"]
+    assert pdf_extract._pool is not None and pdf_extract._pool is not broken
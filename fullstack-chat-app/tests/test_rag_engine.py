@@ -0,0 +1,229 @@
+# tests/test_rag_engine.py
+# RAGStore storage engine: deletes, reclaim and the vector index backends.
+# Run from fullstack-chat-app/:  python -m pytest tests
+import os
+import sys
+import time
+import zlib
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+import rag_engine  # noqa: E402
+import snapshot  # noqa: E402
+import vector_index  # noqa: E402
+from rag_engine import RAGStore  # noqa: E402
+
+DIM = 64
+
+
+class HashEmbedder:
+    """Stands in for SentenceTransformer: a fixed random unit vector per text, no model download."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def get_sentence_embedding_dimension(self):
+        return DIM
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=False, show_progress_bar=False):
+        single = isinstance(texts, str)
+        vecs = np.stack([np.random.default_rng(zlib.crc32(t.encode("utf-8"))).standard_normal(DIM)
+                         for t in ([texts] if single else texts)]).astype("float32")
+        if normalize_embeddings:
+            vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+        return vecs[0] if single else vecs
+
+
+@pytest.fixture
+def open_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag_engine, "SentenceTransformer", HashEmbedder)
+    # Reclaim only when a test asks for it
+    monkeypatch.setattr(rag_engine, "TOMBSTONE_RATIO", 0)
+    stores = []
+
+    def open_store():
+        stores.append(RAGStore(str(tmp_path / "rag_data")))
+        return stores[-1]
+
+    yield open_store
+    for store in stores:
+        settle(store)
+
+
+def settle(store):
+    # Index rebuilds, reclaims and snapshots run on background threads
+    deadline = time.time() + 60
+    while store._index_rebuilding or store._reclaiming or store._compacting:
+        assert time.time() < deadline, "background work did not finish"
+        time.sleep(0.01)
+
+
+def passages(n, per_doc=4):
+    return [(f"passage {i} of document {i // per_doc}", {"doc_id": f"doc{i // per_doc}", "user": "alice"})
+            for i in range(n)]
+
+
+def assert_self_hits(store, expected):
+    # Every surviving passage must still be its own nearest neighbour, with its own vector
+    for text, _ in expected:
+        hits = store.semantic_search(text, k=1)
+        assert [h["text"] for h in hits] == [text]
+        assert hits[0]["score"] == pytest.approx(1.0, abs=1e-3)
+
+
+@pytest.mark.parametrize("kind", vector_index.BACKENDS)
+def test_delete_reclaim_search(open_store, monkeypatch, kind):
+    monkeypatch.setattr(rag_engine, "choose_backend", lambda n: vector_index.choose_backend(n, kind))
+    # IVF-PQ needs ~10k points by default; 256 is the least its 8-bit codebooks can train on
+    monkeypatch.setattr(vector_index, "_PQ_MIN_TRAIN", 256)
+    store = open_store()
+    docs = passages(400)
+    assert store.ingest(docs)["indexed"] == 400
+    settle(store)
+    assert store.index_backend == kind
+
+    gone = {f"doc{i}" for i in range(0, 100, 3)}
+    assert store.delete_documents(gone) == 4 * len(gone)
+    kept = [d for d in docs if d[1]["doc_id"] not in gone]
+    assert_self_hits(store, kept)
+
+    store.reclaim()
+    settle(store)
+    assert store.index_stats()["tombstones"] == 0
+    assert store.index.ntotal == len(kept)
+    assert_self_hits(store, kept)
+    # Deleted passages stay gone for filtered (exact) and unfiltered (index) searches alike
+    assert not store.semantic_search(docs[0][0], k=len(docs), filters={"doc_id": sorted(gone)})
+
+    # The compacted index is what the snapshot holds, so a restart must search the same way
+    assert_self_hits(open_store(), kept)
+
+
+def test_same_document_ingested_again_by_another_user(open_store):
+    # Two uploads of one file, both queued before either job ran: same doc_id, different users
+    store = open_store()
+    pages = ["release checklist for the payments service", "rollback steps and on-call contacts"]
+    first = store.ingest([(p, {"doc_id": "f.pdf", "user": "alice"}) for p in pages])
+    second = store.ingest([(p, {"doc_id": "f.pdf", "user": "bob"}) for p in pages])
+    assert (first["indexed"], second["indexed"], second["duplicates"], second["shared"]) == (2, 0, 2, 0)
+    for user in ("alice", "bob"):
+        assert {h["text"] for h in store.semantic_search(pages[0], k=5, filters={"user": user})} == set(pages)
+    # The same upload again changes nothing
+    assert store.ingest([(pages[0], {"doc_id": "f.pdf", "user": "bob"})])["duplicates"] == 1
+    assert store.document_passages("f.pdf") == 2
+
+    settle(store)
+    reopened = open_store()
+    assert {h["text"] for h in reopened.semantic_search(pages[1], k=5, filters={"user": "bob"})} == set(pages)
+
+
+def texts(hits):
+    return {h["text"] for h in hits}
+
+
+def test_wal_replays_writes_after_crash_before_pointer_swap(open_store, monkeypatch):
+    store = open_store()
+    docs = passages(40)
+    store.ingest(docs[:20])
+    store.compact()
+    assert (store.storage_dir / snapshot.CURRENT_FILE).read_text().strip() == "snap-0000000001"
+    store.ingest(docs[20:30])
+    store.delete("doc0")
+
+    # Snapshot 2 reaches disk, then the process dies before CURRENT is replaced
+    real_write = snapshot._write_atomic
+
+    def crash_on_pointer(path, data):
+        if path.name == snapshot.CURRENT_FILE:
+            raise OSError("simulated crash")
+        real_write(path, data)
+
+    monkeypatch.setattr(snapshot, "_write_atomic", crash_on_pointer)
+    store.compact()
+    monkeypatch.setattr(snapshot, "_write_atomic", real_write)
+    assert (store.storage_dir / "snap-0000000002").is_dir()
+    assert (store.storage_dir / snapshot.CURRENT_FILE).read_text().strip() == "snap-0000000001"
+    store.ingest(docs[30:])
+
+    reopened = open_store()
+    alive = [d for d in docs if d[1]["doc_id"] != "doc0"]
+    assert reopened.generation == 1
+    assert len(reopened.documents) - len(reopened._tombstones) == len(alive)
+    assert_self_hits(reopened, alive)
+    assert not reopened.keyword_search(docs[0][0], k=5, filters={"doc_id": "doc0"})
+
+
+def test_damaged_snapshot_falls_back_and_replays_the_log(open_store):
+    store = open_store()
+    docs = passages(30)
+    store.ingest(docs[:10])
+    store.compact()
+    store.ingest(docs[10:20])
+    store.compact()
+    store.ingest(docs[20:])
+    settle(store)
+    # The newest snapshot is torn: the store must fall back to snap-1 and replay every log since
+    with open(store.storage_dir / "snap-0000000002" / snapshot.DOCUMENTS_FILE, "r+b") as f:
+        f.truncate(10)
+
+    reopened = open_store()
+    assert reopened.generation == 1
+    assert len(reopened.documents) == len(docs)
+    assert_self_hits(reopened, docs)
+
+
+def test_delete_reclaim_hybrid_search_and_restart(open_store):
+    store = open_store()
+    docs = passages(60)
+    store.ingest(docs)
+    store.delete_documents(["doc1", "doc2"])
+    gone = [d[0] for d in docs if d[1]["doc_id"] in ("doc1", "doc2")]
+    kept = [d for d in docs if d[0] not in gone]
+    assert not texts(store.search("passage 5 of document 1", k=10)) & set(gone)
+
+    # The deletes are only in the log: a restart replays them before reclaiming
+    settle(store)
+    store = open_store()
+    assert len(store._tombstones) == len(gone)
+    store.reclaim()
+    settle(store)
+    assert len(store.documents) == len(kept) and not store._tombstones
+    for query in ("passage 5 of document 1", "document 2"):
+        assert not texts(store.search(query, k=len(docs))) & set(gone)
+    assert texts(store.search("passage 12 of document 3", k=1)) == {"passage 12 of document 3"}
+    assert texts(store.keyword_search("document", k=len(docs))) == {d[0] for d in kept}
+    assert texts(store.keyword_search("document", k=10, filters={"doc_id": "doc3"})) == \
+        {d[0] for d in docs if d[1]["doc_id"] == "doc3"}
+    assert len(store.semantic_search("document", k=len(docs), filters={"user": "alice"})) == len(kept)
+
+    settle(store)
+    reopened = open_store()
+    assert len(reopened.documents) == len(kept)
+    assert_self_hits(reopened, kept)
+
+
+def test_shared_passage_survives_until_its_last_owner_is_deleted(open_store):
+    store = open_store()
+    common = ["shared onboarding checklist for every new starter", "expense policy and travel limits"]
+    store.ingest([(t, {"doc_id": "a.pdf", "user": "alice"}) for t in common + ["alice's own notes on the q3 plan"]])
+    report = store.ingest([(t, {"doc_id": "b.pdf", "user": "bob"}) for t in common])
+    assert (report["indexed"], report["shared"]) == (0, 2)
+    assert texts(store.semantic_search(common[0], k=5, filters={"user": "bob"})) == set(common)
+
+    store.delete("a.pdf")
+    assert texts(store.semantic_search(common[0], k=5, filters={"user": "bob"})) == set(common)
+    assert not store.semantic_search(common[0], k=5, filters={"user": "alice"})
+    assert not store.keyword_search("q3 plan", k=5)
+    assert store.document_passages("a.pdf") == 0 and store.document_passages("b.pdf") == 2
+
+    store.reclaim()
+    settle(store)
+    reopened = open_store()
+    assert texts(reopened.semantic_search(common[1], k=5, filters={"doc_id": "b.pdf"})) == set(common)
+    assert all(h["meta"]["user"] == "bob" for h in reopened.semantic_search(common[1], k=5))
+
+    reopened.delete("b.pdf")
+    assert not reopened.search(common[0], k=5)
+    assert len(reopened._tombstones) == 2